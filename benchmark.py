@@ -0,0 +1,236 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# By: Jason Ferrell, Sep. 2023
+# https://github.com/jgferrell/
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+"""Throughput benchmarks for the configurators over a synthetic fleet
+of user profiles. Results are written as JSON and can be compared
+with a stored baseline:
+
+    python benchmark.py --profiles 5000 --lines 20000 --output new.json
+    python benchmark.py --baseline old.json --threshold 0.25
+"""
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+from typing import NoReturn, Any, Set, Tuple, List, Union, Dict
+import argparse, contextlib, io, json, os, platform, random, shutil, sys
+import tempfile, time
+from lib.configurator import Configurator
+from lib.font import FontConfigurator, gui_components
+from lib.receipt_printer import ReceiptPrinter
+from lib.state_cache import StateCache
+from lib.os import iter_sirsi_dirs, get_property_files, \
+    add_local_receipt_printer
+from lib import printers
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+# differences smaller than this (seconds) are noise, not regressions
+NOISE_FLOOR = 0.005
+
+def generate_tree(users_dir: str, profiles: int, lines: int,
+                  duplicates: float, seed: int) -> List[str]:
+    """Creates `profiles` user profiles in `users_dir`, each with a
+    Property folder holding a `preference` file of `lines` lines (a
+    `duplicates` fraction of which repeat an earlier key) and a `font`
+    file. Returns the keys of the preference files, in file order."""
+    rng = random.Random(seed)
+    keys = ['section%d.group%d.key%d' % (i % 50, i % 7, i)
+            for i in range(lines)]
+    content = []
+    for i, key in enumerate(keys):
+        if i and rng.random() < duplicates:
+            key = keys[rng.randrange(i)]
+        content.append('%s=%s\n' % (key, rng.choice(['Y', 'N', str(i)])))
+    content = ''.join(content)
+    fonts = ''.join('%s|Arial|plain|12|\n' % gc for gc in gui_components)
+    for n in range(profiles):
+        prop = os.path.join(users_dir, 'user%05d' % n, 'Sirsi', 'Workflows',
+                            'Property')
+        os.makedirs(prop)
+        with open(os.path.join(prop, 'preference'), 'w') as fo:
+            fo.write(content)
+        with open(os.path.join(prop, 'font'), 'w') as fo:
+            fo.write(fonts)
+    return keys
+
+def pick_keys(keys: List[str], count: int, distribution: str,
+              seed: int) -> List[str]:
+    """Returns `count` keys to update: spread through the file
+    ('uniform'), near its start ('head') or end ('tail'), or absent
+    from it ('missing')."""
+    count = min(count, len(keys))
+    if distribution == 'uniform':
+        return random.Random(seed).sample(keys, count)
+    if distribution == 'head':
+        return keys[:count]
+    if distribution == 'tail':
+        return keys[-count:]
+    return ['benchmark.missing.key%d' % i for i in range(count)]
+
+def stage_main(files, keys):
+    configurator = Configurator(files)
+    for key in keys:
+        configurator.update(key, 'benchmark')
+    configurator.delete(keys[0])
+    return configurator
+
+def stage_font(files, keys):
+    configurator = FontConfigurator(files)
+    configurator.update('ALL', 'Verdana', 'bold', 14)
+    return configurator
+
+def stage_receipt(files, keys):
+    configurator = ReceiptPrinter(files)
+    configurator.add('Benchmark Printer')
+    configurator.paper.width = 3.0
+    configurator.font.size = 11
+    return configurator
+
+def stage_find_printer(files, keys):
+    configurator = ReceiptPrinter(files)
+    add_local_receipt_printer(configurator, 'No Such Printer',
+                              'BENCHMARK PRINTER 0')
+    return configurator
+
+# scenario name to (subject file name, staging function)
+scenarios = {
+    'main': ('preference', stage_main),
+    'font': ('font', stage_font),
+    'receipt_printer': ('preference', stage_receipt),
+    'find_printer': ('preference', stage_find_printer),
+}
+
+def timed(func, *args) -> Tuple[float, Any]:
+    """Returns the seconds taken by func(*args) and its return value."""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        value = func(*args)
+    return time.perf_counter() - start, value
+
+def run_scenario(name: str, users_dir: str, keys: List[str],
+                 args: argparse.Namespace) -> Dict[str, float]:
+    """Times each phase of one scenario over the tree in `users_dir`:
+    discovering subject files, staging changes, the first run (which
+    rewrites every file), a second run (every file already up to
+    date), and a run skipped by a state cache."""
+    filename, stage = scenarios[name]
+    phases = {}
+    phases['discover'], files = timed(
+        lambda: get_property_files(filename, set(iter_sirsi_dirs(users_dir))))
+    phases['stage'], configurator = timed(stage, files, keys)
+    configurator.workers = args.workers
+    phases['apply'], results = timed(configurator.run)
+    if {r.status for r in results} != {'updated'}:
+        raise RuntimeError("%s: not every file was updated." % name)
+    # staging may print (e.g., printer lookups), so it is done by timed()
+    # too, keeping standard output for the results
+    _, configurator = timed(stage, files, keys)
+    phases['unchanged'], _ = timed(configurator.run)
+    cache = StateCache(os.path.join(users_dir, 'state.json'))
+    _, configurator = timed(stage, files, keys)
+    configurator.state_cache = cache
+    timed(configurator.run)
+    _, configurator = timed(stage, files, keys)
+    configurator.state_cache = StateCache(cache.path)
+    phases['cached'], _ = timed(configurator.run)
+    phases['total'] = sum(phases.values())
+    return phases
+
+def benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    """Runs every scenario `args.repeat` times on a freshly generated
+    tree and keeps the fastest time of each phase. Printers are looked
+    up among `args.printers` fake printers."""
+    results = {}
+    printers.configure(printers.StaticProvider(
+        ['Benchmark Printer %d' % i for i in range(args.printers)]))
+    for name in args.scenarios:
+        best = {}
+        for _ in range(args.repeat):
+            users_dir = tempfile.mkdtemp(prefix='wfcfg_bench_')
+            try:
+                keys = generate_tree(users_dir, args.profiles, args.lines,
+                                     args.duplicates, args.seed)
+                keys = pick_keys(keys, args.keys, args.distribution,
+                                 args.seed)
+                phases = run_scenario(name, users_dir, keys, args)
+            finally:
+                shutil.rmtree(users_dir)
+            for phase, seconds in phases.items():
+                best[phase] = min(seconds, best.get(phase, seconds))
+        results[name] = best
+    printers.configure()
+    return {
+        'meta': {'python': platform.python_version(),
+                 'platform': platform.platform(),
+                 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'parameters': {k: v for k, v in vars(args).items()
+                                if k not in ('output', 'baseline')}},
+        'results': results,
+    }
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any],
+            threshold: float) -> List[str]:
+    """Returns a description of each scenario phase that is more than
+    `threshold` (a fraction) slower than in `baseline`."""
+    regressions = []
+    for name, phases in current['results'].items():
+        for phase, seconds in phases.items():
+            before = baseline['results'].get(name, {}).get(phase)
+            if before is None:
+                continue
+            if seconds > before * (1 + threshold) and \
+               seconds - before > NOISE_FLOOR:
+                regressions.append('%s/%s: %.3fs -> %.3fs (%+.0f%%)' % (
+                    name, phase, before, seconds,
+                    100 * (seconds - before) / before))
+    return regressions
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', type=int, default=50,
+        help='user profiles to generate (default: 50)')
+    parser.add_argument('--lines', type=int, default=2000,
+        help='lines per preference file (default: 2000)')
+    parser.add_argument('--keys', type=int, default=20,
+        help='keys updated by the main scenario (default: 20)')
+    parser.add_argument('--distribution', default='uniform',
+        choices=['uniform', 'head', 'tail', 'missing'],
+        help='where the updated keys are in the file (default: uniform)')
+    parser.add_argument('--duplicates', type=float, default=0.01,
+        help='fraction of lines repeating an earlier key (default: 0.01)')
+    parser.add_argument('--workers', type=int, default=1,
+        help='worker threads for each run (default: 1)')
+    parser.add_argument('--printers', type=int, default=200,
+        help='fake printers installed for the find_printer scenario '
+            '(default: 200)')
+    parser.add_argument('--repeat', type=int, default=3,
+        help='runs of each scenario; the fastest counts (default: 3)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenarios', nargs='+', default=list(scenarios),
+        choices=list(scenarios))
+    parser.add_argument('--output', metavar='PATH',
+        help='write results to PATH instead of standard output')
+    parser.add_argument('--baseline', metavar='PATH',
+        help='compare results with a previous output')
+    parser.add_argument('--threshold', type=float, default=0.25,
+        help='slowdown, as a fraction of the baseline, counted as a '
+            'regression (default: 0.25)')
+    args = parser.parse_args(argv)
+
+    current = benchmark(args)
+    text = json.dumps(current, indent=1)
+    if args.output:
+        with open(args.output, 'w') as fo:
+            fo.write(text + '\n')
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline, 'r') as fo:
+            regressions = compare(current, json.load(fo), args.threshold)
+        for regression in regressions:
+            print('REGRESSION', regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
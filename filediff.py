@@ -1,8 +1,234 @@
 #!/usr/bin/python
 import argparse
-import os.path
-import glob
-import difflib, sys
+import os
+import difflib, hashlib, sys
+
+def scan(root):
+    """Returns a dict of the path (relative to `root`) and stat result of
+    every file under `root`. Stat results come with the directory
+    listing where the OS provides them (e.g., on Windows)."""
+    files = {}
+    pending = ['']
+    while pending:
+        relative = pending.pop()
+        with os.scandir(os.path.join(root, relative)) as entries:
+            for entry in entries:
+                path = os.path.join(relative, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(path)
+                else:
+                    files[path] = entry.stat()
+    return files
+
+def file_digest(path):
+    """Returns the SHA-256 digest of the file at `path`."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fo:
+        for chunk in iter(lambda: fo.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+def changed_files(odir_path, mdir_path, o, m, workers=8):
+    """Returns the sorted paths common to both trees whose content
+    differs. Files with the same size and modification time are taken
+    to be unchanged without being read, and files of different sizes
+    to be changed; only the rest are hashed, `workers` at a time."""
+    changed, to_hash = [], []
+    for path in o.keys() & m.keys():
+        ostat, mstat = o[path], m[path]
+        if ostat.st_size != mstat.st_size:
+            changed.append(path)
+        elif ostat.st_mtime_ns != mstat.st_mtime_ns:
+            to_hash.append(path)
+    if to_hash:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            odigests = pool.map(file_digest, [os.path.join(odir_path, p)
+                                              for p in to_hash])
+            mdigests = pool.map(file_digest, [os.path.join(mdir_path, p)
+                                              for p in to_hash])
+            changed += [path for path, odigest, mdigest in
+                        zip(to_hash, odigests, mdigests) if odigest != mdigest]
+    return sorted(changed)
+
+def property_codec(filepath):
+    """Returns a configurator whose line parser reads the Workflows
+    Property file at `filepath`, or None if it is not one."""
+    directory, name = os.path.split(filepath)
+    if os.path.basename(directory).lower() != 'property':
+        return None
+    if name == 'preference':
+        from lib.configurator import Configurator
+        return Configurator(set())
+    if name == 'font':
+        from lib.font import FontConfigurator
+        return FontConfigurator(set())
+    return None
+
+def key_diff(ofile, mfile, codec):
+    """Compares two Property files (as lists of lines) key by key, using
+    the line parser of `codec`. Returns (added, removed, changed) dicts;
+    `changed` maps each key to its (old, new) values. As in Workflows,
+    the last occurrence of a repeated key counts."""
+    return compare_keys(parse_keys(ofile, codec), parse_keys(mfile, codec))
+
+def parse_keys(lines, codec):
+    """Returns the keys and values of a Property file, as parsed by
+    `codec`; the last occurrence of a repeated key counts."""
+    return dict(filter(None, map(codec.config_line_processor, lines)))
+
+def compare_keys(okeys, mkeys):
+    """Returns (added, removed, changed) dicts describing how the keys
+    `mkeys` differ from `okeys`; see key_diff()."""
+    added = {k: v for k, v in mkeys.items() if k not in okeys}
+    removed = {k: v for k, v in okeys.items() if k not in mkeys}
+    changed = {k: (v, mkeys[k]) for k, v in okeys.items()
+               if k in mkeys and mkeys[k] != v}
+    return added, removed, changed
+
+def _quote(text):
+    return '"%s"' % text.replace('"', '\\"')
+
+def suggestion(codec, added, removed, changed, form):
+    """Returns lines of a wfcfg.py command (`form` 'command') or policy
+    snippet ('policy') that makes the key changes."""
+    updates = dict(added)
+    updates.update({k: new for k, (old, new) in changed.items()})
+    lines = []
+    if type(codec).__name__ == 'FontConfigurator':
+        # font values are type|style|size; policies cannot remove
+        # components
+        command = 'python wfcfg.py font'
+        for key, value in updates.items():
+            font_type, style, size = (value.split('|') + ['', '', ''])[:3]
+            command += ' %s %s %s %s' % (key, _quote(font_type), size, style)
+            lines += ['[font.%s]' % key, 'type = %s' % _quote(font_type),
+                      'size = %s' % size, 'style = %s' % _quote(style)]
+        if removed:
+            command += ' --delete ' + ' '.join(removed)
+        return [command] if form == 'command' else lines
+    if form == 'command':
+        command = 'python wfcfg.py main'
+        if updates:
+            command += ' --update ' + ' '.join(_quote('%s=%s' % item)
+                                               for item in updates.items())
+        if removed:
+            command += ' --delete ' + ' '.join(map(_quote, removed))
+        return [command]
+    lines.append('[main]')
+    if updates:
+        lines.append('update = { %s }' % ', '.join(
+            '%s = %s' % (_quote(k), _quote(v)) for k, v in updates.items()))
+    if removed:
+        lines.append('delete = [%s]' % ', '.join(map(_quote, removed)))
+    return lines
+
+def print_key_diff(ofilepath, mfilepath, ofile, mfile, codec, form=None):
+    added, removed, changed = key_diff(ofile, mfile, codec)
+    print('*** %s\n--- %s' % (ofilepath, mfilepath))
+    for key, value in sorted(added.items()):
+        print(' + %s=%s' % (key, value))
+    for key, value in sorted(removed.items()):
+        print(' - %s=%s' % (key, value))
+    for key, (old, new) in sorted(changed.items()):
+        print(' ! %s: %s --> %s' % (key, old, new))
+    if not (added or removed or changed):
+        print(' (no key changes; only order, comments, or spacing differ)')
+    elif form is not None:
+        print()
+        print('\n'.join(suggestion(codec, added, removed, changed, form)))
+    print()
+
+# files compared by fleet_drift(), if the baseline has them
+FLEET_FILES = ('preference', 'font')
+
+def deviations(baseline, target_dir, codecs, by_value=False):
+    """Returns the deviation signature of the Workflows folder
+    `target_dir` from `baseline`, a dict of file name to parsed keys:
+    a sorted tuple of (file name, mark, key) for each key added ('+'),
+    removed ('-'), or changed ('!'), with the key's new value appended
+    if `by_value` is True. A file missing from (or unreadable in) the
+    target is a single ('file name', '-' or '?', '') entry."""
+    signature = []
+    for name, okeys in baseline.items():
+        path = os.path.join(target_dir, 'Property', name)
+        try:
+            with open(path, 'r', errors='replace') as fo:
+                mkeys = parse_keys(fo, codecs[name])
+        except FileNotFoundError:
+            signature.append((name, '-', ''))
+            continue
+        except OSError:
+            signature.append((name, '?', ''))
+            continue
+        added, removed, changed = compare_keys(okeys, mkeys)
+        for mark, keys in [('+', added), ('-', removed),
+                           ('!', {k: new for k, (old, new) in
+                                  changed.items()})]:
+            for key, value in keys.items():
+                signature.append((name, mark, key, value) if by_value
+                                 else (name, mark, key))
+    return tuple(sorted(signature))
+
+def fleet_drift(baseline_dir, target_dirs, workers=8, by_value=False):
+    """Compares the Property files of each Workflows folder in
+    `target_dirs` with those of `baseline_dir`, which are parsed once,
+    reading `workers` targets at a time. Returns a dict mapping each
+    deviation signature (see deviations()) to the sorted targets that
+    have it; targets matching the baseline have the signature ()."""
+    codecs, baseline = {}, {}
+    for name in FLEET_FILES:
+        path = os.path.join(baseline_dir, 'Property', name)
+        codec = property_codec(path)
+        if os.path.isfile(path):
+            with open(path, 'r', errors='replace') as fo:
+                codecs[name], baseline[name] = codec, parse_keys(fo, codec)
+    targets = [target for target in target_dirs if
+               os.path.normcase(os.path.abspath(target)) !=
+               os.path.normcase(os.path.abspath(baseline_dir))]
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        signatures = pool.map(lambda target: deviations(
+            baseline, target, codecs, by_value), targets)
+        groups = {}
+        for target, signature in zip(targets, signatures):
+            groups.setdefault(signature, []).append(target)
+    return {signature: sorted(group) for signature, group in groups.items()}
+
+def print_fleet_drift(baseline_dir, groups, examples=3):
+    total = sum(map(len, groups.values()))
+    print('Compared %d profiles with %s' % (total, baseline_dir))
+    for signature, targets in sorted(groups.items(),
+                                     key=lambda g: (-len(g[1]), g[0])):
+        print()
+        if not signature:
+            print('%d profiles match the baseline.' % len(targets))
+        else:
+            print('%d profiles differ %sin:' % (
+                len(targets), 'only ' if len(signature) == 1 else ''))
+            for entry in signature:
+                name, mark, key = entry[:3]
+                if not key:
+                    key = '(file missing)' if mark == '-' else '(unreadable)'
+                elif len(entry) > 3:
+                    key = '%s=%s' % (key, entry[3])
+                print(' %s %s: %s' % (mark, name, key))
+        shown = targets[:examples]
+        if shown:
+            print('  e.g.', ', '.join(shown) +
+                  (', ...' if len(targets) > len(shown) else ''))
+
+def _cli_fleet(args):
+    baseline_dir = args.original_directory[0]
+    if not os.path.isdir(baseline_dir):
+        print("Error!", baseline_dir, "is not a valid directory.")
+        return
+    targets = args.modified_directory
+    if not targets:
+        from lib.os import get_sirsi_dirs
+        targets = get_sirsi_dirs()
+    groups = fleet_drift(baseline_dir, targets, args.workers, args.by_value)
+    print_fleet_drift(baseline_dir, groups, args.examples)
 
 def _cli_parse(args):
     odir_path = args.original_directory[0]
@@ -11,48 +237,74 @@ def _cli_parse(args):
         assert(os.path.isdir(odir_path))
     except AssertionError:
         print("Error!", odir_path, "is not a valid directory.")
+        return
     try:
         assert(os.path.isdir(mdir_path))
     except AssertionError:
         print("Error!", mdir_path, "is not a valid directory.")
+        return
     try:
         assert(odir_path != mdir_path)
     except AssertionError:
         print("These directories are the same directory.")
 
-    o = set()
-    for path in glob.iglob(os.path.join(odir_path, '**'), recursive=True):
-        if os.path.isdir(path):
-            continue
-        o.add(path[len(odir_path):])
-    m = set()
-    for path in glob.iglob(os.path.join(mdir_path, '**'), recursive=True):
-        if os.path.isdir(path):
-            continue
-        m.add(path[len(mdir_path):])
+    o = scan(odir_path)
+    m = scan(mdir_path)
 
-    if (o - m):
+    if (o.keys() - m.keys()):
         print("\nDeleted files:")
-        for path in (o - m):
-            print(' ---', path)
-    if (m - o):
+        for path in sorted(o.keys() - m.keys()):
+            print(' ---', os.sep + path)
+    if (m.keys() - o.keys()):
         print("\nNew files:")
-        for path in (m - o):
-            print(' +++', path)
-    if o.intersection(m):
+        for path in sorted(m.keys() - o.keys()):
+            print(' +++', os.sep + path)
+    if o.keys() & m.keys():
         print("\nLooking for changed files...")
-        for filepath in o.intersection(m):
-            with open(odir_path + filepath, 'r') as ofile_obj:
+        for filepath in changed_files(odir_path, mdir_path, o, m,
+                                      args.workers):
+            ofilepath = os.path.join(odir_path, filepath)
+            mfilepath = os.path.join(mdir_path, filepath)
+            with open(ofilepath, 'r', errors='replace') as ofile_obj:
                 ofile = ofile_obj.readlines()
-            with open(mdir_path + filepath, 'r') as mfile_obj:
+            with open(mfilepath, 'r', errors='replace') as mfile_obj:
                 mfile = mfile_obj.readlines()
-            sys.stdout.writelines(difflib.context_diff(ofile, mfile, fromfile=odir_path+filepath, tofile=mdir_path+filepath))
+            codec = None if args.line_diff else property_codec(mfilepath)
+            if codec is not None:
+                print_key_diff(ofilepath, mfilepath, ofile, mfile, codec,
+                               args.suggest)
+                continue
+            sys.stdout.writelines(difflib.context_diff(ofile, mfile, fromfile=ofilepath, tofile=mfilepath))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('original_directory', nargs=1,
                         help="Directory path containing the original files.")
-    parser.add_argument('modified_directory', nargs=1,
-                        help="Directory path containing the modified files.")
+    parser.add_argument('modified_directory', nargs='*',
+                        help="Directory path containing the modified files "
+                        "(with --fleet, any number of Workflows folders; by "
+                        "default, every profile's).")
+    parser.add_argument('--workers', type=int, default=8,
+                        help="Number of files to hash concurrently.")
+    parser.add_argument('--line-diff', action='store_true',
+                        help="Compare Property files line by line instead "
+                        "of key by key.")
+    parser.add_argument('--suggest', choices=['command', 'policy'],
+                        help="Also print the wfcfg.py command or policy "
+                        "file lines that make the key changes.")
+    parser.add_argument('--fleet', action='store_true',
+                        help="Compare the Property files of many Workflows "
+                        "folders with those of the original directory, "
+                        "grouping folders that differ in the same keys.")
+    parser.add_argument('--by-value', action='store_true',
+                        help="With --fleet, group folders by the values of "
+                        "the keys that differ, too.")
+    parser.add_argument('--examples', type=int, default=3,
+                        help="With --fleet, folders to list for each group.")
     args = parser.parse_args()
-    _cli_parse(args)
+    if args.fleet:
+        _cli_fleet(args)
+    elif len(args.modified_directory) != 1:
+        parser.error("one modified directory is required")
+    else:
+        _cli_parse(args)
@@ -0,0 +1,188 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# By: Jason Ferrell, Sep. 2023
+# https://github.com/jgferrell/
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+"""Backups of subject files taken just before WfCfg rewrites them, so
+that a run can be rolled back. Content is stored compressed and once
+per distinct content, however many files share it."""
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+from typing import NoReturn, Any, Set, Tuple, List, Union, Dict
+import hashlib, json, os, threading, time, zlib
+from .configurator import FileResult, map_in_order, measured, summarize
+from .os import LockedFile, data_path, write_atomically
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+# runs kept by default when a store is pruned
+KEEP_RUNS = 10
+# seconds during which unreferenced content is kept anyway, as a run in
+# progress may be about to refer to it
+PRUNE_GRACE = 3600
+
+def default_backup_dir() -> str:
+    """Returns the default location of the backup store."""
+    return data_path('backups')
+
+
+class BackupStore:
+    def __init__(self, root: str, command: Union[None, List[str]] = None) \
+            -> "BackupStore":
+        """
+        Create a store in the folder `root` for the backups of one run.
+        Each backed-up file's content is saved, zlib-compressed, in
+        `root`\\objects under its SHA-256 digest, so identical files
+        are stored once across all runs. Which file had which content
+        is recorded in a manifest, `root`\\runs\\<run_id>.json, written
+        by save(). `command` is recorded in the manifest.
+        """
+        self.root = root
+        self.command = command
+        self.run_id = '%s-%d' % (time.strftime('%Y%m%d-%H%M%S'),
+                                 os.getpid())
+        self.started = time.time()
+        self._files: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.root, 'objects', digest[:2], digest[2:])
+
+    def _manifest_path(self, run_id: str) -> str:
+        return os.path.join(self.root, 'runs', run_id + '.json')
+
+    def add(self, path: str) -> str:
+        """Backs up the current content of the file at `path`, unless it
+        has been backed up already in this run. Returns its digest."""
+        with self._lock:
+            if path in self._files:
+                return self._files[path]
+        with open(path, 'rb') as fo:
+            content = fo.read()
+        digest = hashlib.sha256(content).hexdigest()
+        object_path = self._object_path(digest)
+        try:
+            # touched, so that prune() leaves it to the run in progress
+            os.utime(object_path)
+        except FileNotFoundError:
+            write_atomically(object_path, zlib.compress(content))
+        with self._lock:
+            self._files.setdefault(path, digest)
+        return digest
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def save(self) -> Union[None, str]:
+        """Writes the manifest of this run, if any file was backed up.
+        Returns the run's ID, or None."""
+        if not self._files:
+            return None
+        with self._lock:
+            files = dict(sorted(self._files.items()))
+        # runs of one process within a second need IDs of their own
+        base, n = self.run_id, 0
+        while os.path.exists(self._manifest_path(self.run_id)):
+            n += 1
+            self.run_id = '%s.%d' % (base, n)
+        write_atomically(self._manifest_path(self.run_id), json.dumps(
+            {'run': self.run_id, 'command': self.command,
+             'started': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                      time.localtime(self.started)),
+             'files': files}, indent=1))
+        return self.run_id
+
+    def runs(self) -> List[str]:
+        """Returns the IDs of the runs in the store, oldest first."""
+        try:
+            names = os.listdir(os.path.join(self.root, 'runs'))
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-len('.json')] for name in names
+                      if name.endswith('.json'))
+
+    def manifest(self, run_id: str) -> Dict[str, Any]:
+        """Returns the manifest of the run `run_id`."""
+        try:
+            with open(self._manifest_path(run_id), 'r') as fo:
+                return json.load(fo)
+        except FileNotFoundError:
+            raise KeyError("No backup of run '%s' in %s." %
+                           (run_id, self.root)) from None
+
+    def content(self, digest: str) -> bytes:
+        """Returns the content stored under `digest`."""
+        with open(self._object_path(digest), 'rb') as fo:
+            content = zlib.decompress(fo.read())
+        if hashlib.sha256(content).hexdigest() != digest:
+            raise ValueError("Backup object %s is corrupt." % digest)
+        return content
+
+    def _restore_file(self, path: str, digest: str, test_run: bool,
+                      durability: str) -> "FileResult":
+        lock = None
+        try:
+            content = self.content(digest)
+            exists = True
+            try:
+                with open(path, 'rb') as fo:
+                    if fo.read() == content:
+                        return FileResult(path, FileResult.UNCHANGED)
+            except FileNotFoundError:
+                exists = False
+            if test_run:
+                return FileResult(path, FileResult.SIMULATED)
+            if not exists:
+                # LockedFile only replaces existing files
+                open(path, 'ab').close()
+            lock = LockedFile(path, 'wb', durability=durability)
+            with lock as fo:
+                # what rollback replaces can be rolled back in turn
+                self.add(path)
+                fo.write(content)
+        except Exception as e:
+            return FileResult(path, FileResult.ERROR, e,
+                              lock.lock_wait if lock is not None else 0.0)
+        return FileResult(path, FileResult.UPDATED, lock_wait=lock.lock_wait)
+
+    def restore(self, run_id: str, workers: int = 1, test_run: bool = False,
+                durability: str = 'file',
+                quiet: bool = False) -> List["FileResult"]:
+        """Puts back the content every file had before the run `run_id`,
+        `workers` files at a time. Files already holding that content
+        are not written. The content replaced is backed up as a run of
+        this store; call save() to keep it. Returns a list of
+        FileResult objects, one per file."""
+        files = self.manifest(run_id)['files']
+        restore = measured(lambda path: self._restore_file(
+            path, files[path], test_run, durability))
+        if not quiet:
+            print('Restoring files from run %s:' % run_id)
+        results = []
+        for result in map_in_order(restore, sorted(files), workers):
+            if not quiet or result.status == FileResult.ERROR:
+                print(' *', result)
+            results.append(result)
+        print(('' if quiet else '\n') + summarize(results))
+        return results
+
+    def prune(self, keep: int = KEEP_RUNS) -> int:
+        """Deletes all but the `keep` most recent runs, and the content
+        no remaining run refers to. Returns the number of runs deleted."""
+        runs = self.runs()
+        old = runs[:max(0, len(runs) - keep)]
+        if not old:
+            return 0
+        for run_id in old:
+            os.remove(self._manifest_path(run_id))
+        referenced = set(self._files.values())
+        for run_id in self.runs():
+            referenced.update(self.manifest(run_id)['files'].values())
+        objects = os.path.join(self.root, 'objects')
+        cutoff = time.time() - PRUNE_GRACE
+        for prefix in os.listdir(objects):
+            with os.scandir(os.path.join(objects, prefix)) as entries:
+                for entry in entries:
+                    if prefix + entry.name not in referenced and \
+                       entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+        return len(old)
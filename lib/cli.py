@@ -8,33 +8,224 @@
 files."""
 #:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
 import argparse
-from .configurator import Configurator
-from .receipt_printer import ReceiptPrinter
-from .font import FontConfigurator, gui_components, gui_component_styles
-from .paper import Paper, paper_units, paper_sizes, paper_orientation
-try:
-    from .os import add_local_receipt_printer
-except NotImplementedError:
-    add_local_receipt_printer = lambda x: None
+from typing import Set
+# configurators and their helpers are imported by the commands that use
+# them, so that startup (paid once per GPO line at every boot) only
+# loads what the requested command needs
 #:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
 
+class _FontSpecs(argparse.Action):
+    """Stores font specs given as COMPONENT TYPE SIZE STYLE groups as
+    (component, type, size, style) tuples, reporting invalid ones as
+    usage errors."""
+    def __call__(self, parser, namespace, values, option_string=None):
+        from .font import gui_components, gui_component_styles
+        if len(values) % 4:
+            raise argparse.ArgumentError(self, "each font needs a "
+                "component, type, size, and style")
+        specs = []
+        for i in range(0, len(values), 4):
+            component, font_type, size, style = values[i:i + 4]
+            if component != 'ALL' and component not in gui_components:
+                raise argparse.ArgumentError(self, "unknown GUI component "
+                                             "'%s'" % component)
+            if not size.isdigit():
+                raise argparse.ArgumentError(self, "font size must be an "
+                                             "integer, not '%s'" % size)
+            if style not in gui_component_styles:
+                raise argparse.ArgumentError(self, "font style must be one "
+                    "of: %s" % ', '.join(gui_component_styles))
+            specs.append((component, font_type, int(size), style))
+        setattr(namespace, self.dest, specs)
+
+
 class WfCfgParser:
     def __init__(self, pref_files, font_files):
-        self.main_cfg = Configurator(pref_files)
-        self.font_cfg = FontConfigurator(font_files)
-        self.receipt = ReceiptPrinter(pref_files)
-        self.paper = Paper()
-        
-        self._parser = argparse.ArgumentParser()
-        self._parser.add_argument('--test', action='store_true', 
+        """
+        Create the command line interface. Preference and font files are
+        provided as sets of paths or as functions returning such sets;
+        functions are called only when a command needs that file type,
+        with the profile discovery options given on the command line
+        (max_age_days, exclude, limit) as keyword arguments.
+        """
+        self._pref_files = pref_files
+        self._font_files = font_files
+        self._discovery = {}
+        self._command_line = None
+        self._main_cfg = None
+        self._font_cfg = None
+        self._receipt = None
+        self._paper = None
+        # sub-command name, help, and method adding its arguments
+        self._commands = [
+            ('main', 'Modify preferences of Workflows GUI.',
+             self._add_main_arguments),
+            ('paper', 'Paper settings for the "screen printer."',
+             self._add_paper_arguments),
+            ('font', 'Modify display font settings of Workflows GUI.',
+             self._add_font_arguments),
+            ('receipt-printer', 'Modify receipt printer settings.',
+             self._add_receipt_arguments),
+            ('apply', 'Apply a policy file (TOML or JSON).',
+             self._add_apply_arguments),
+            ('watch', 'Keep a policy file applied, reapplying it to files '
+             'as they change.', self._add_watch_arguments),
+            ('rollback', 'Restore the files changed by a run made with '
+             '--backup.', self._add_rollback_arguments),
+        ]
+
+    @property
+    def pref_files(self) -> Set[str]:
+        """Paths to the preference files, discovered on first use."""
+        if callable(self._pref_files):
+            from . import profiling
+            with profiling.phase('discovery'):
+                self._pref_files = self._pref_files(**self._discovery)
+        return self._pref_files
+
+    @property
+    def font_files(self) -> Set[str]:
+        """Paths to the font files, discovered on first use."""
+        if callable(self._font_files):
+            from . import profiling
+            with profiling.phase('discovery'):
+                self._font_files = self._font_files(**self._discovery)
+        return self._font_files
+
+    @property
+    def main_cfg(self) -> "Configurator":
+        if self._main_cfg is None:
+            from .configurator import Configurator
+            self._main_cfg = Configurator(lambda: self.pref_files)
+        return self._main_cfg
+
+    @property
+    def font_cfg(self) -> "FontConfigurator":
+        if self._font_cfg is None:
+            from .font import FontConfigurator
+            self._font_cfg = FontConfigurator(lambda: self.font_files)
+        return self._font_cfg
+
+    @property
+    def receipt(self) -> "ReceiptPrinter":
+        if self._receipt is None:
+            from .receipt_printer import ReceiptPrinter
+            self._receipt = ReceiptPrinter(lambda: self.pref_files)
+        return self._receipt
+
+    @property
+    def paper(self) -> "Paper":
+        if self._paper is None:
+            from .paper import Paper
+            self._paper = Paper()
+        return self._paper
+
+    def _build_parser(self, command: str) -> "argparse.ArgumentParser":
+        """Returns an argument parser listing every sub-command, but with
+        the arguments of only `command` (if any) added."""
+        parser = argparse.ArgumentParser()
+        parser.add_argument('--test', action='store_true', 
             help='Simulated run --- Does not write changes to disk.')
-        subparsers = self._parser.add_subparsers(required=True, 
+        parser.add_argument('--check', action='store_true',
+            help='report files that do not already have the requested '
+                'settings, without locking or writing anything; exits with '
+                'status 3 if any are found')
+        parser.add_argument('--workers', type=int, default=1,
+            help='number of files to process concurrently (default: 1)')
+        parser.add_argument('--state-cache', action='store_true',
+            help='skip files left untouched since these changes were last '
+                'applied, as recorded in a state cache (kept in '
+                '%%ProgramData%%\\WfCfg\\state.json)')
+        parser.add_argument('--state-cache-path', metavar='PATH',
+            help='keep the state cache at PATH instead (implies '
+                '--state-cache)')
+        parser.add_argument('--durability', default='file',
+            choices=['none', 'file', 'dir'],
+            help='flush each rewritten file to disk before replacing the '
+                'original (file, the default), also flush the replacement '
+                '(dir), or leave flushing to the OS (none)')
+        parser.add_argument('--incremental', action='store_true',
+            help='only process user profiles that are new or changed since '
+                'these changes were last applied, as recorded in a profile '
+                'inventory (kept in %%ProgramData%%\\WfCfg\\profiles.json)')
+        parser.add_argument('--inventory-path', metavar='PATH',
+            help='keep the profile inventory at PATH instead (implies '
+                '--incremental)')
+        parser.add_argument('--full-resync', action='store_true',
+            help='with --incremental, process every profile and rebuild '
+                'the inventory')
+        parser.add_argument('--backup', action='store_true',
+            help='save the content of each file before rewriting it, in a '
+                'backup store (kept in %%ProgramData%%\\WfCfg\\backups), '
+                'so the run can be rolled back')
+        parser.add_argument('--backup-dir', metavar='DIR',
+            help='keep the backup store in DIR instead (implies --backup); '
+                'give the same DIR to rollback')
+        parser.add_argument('--backup-keep', type=int, default=10,
+            metavar='N',
+            help='with --backup, keep the backups of the N most recent runs '
+                '(default: 10)')
+        parser.add_argument('--transform-cache', type=float, metavar='MB',
+            help='read files of up to MB/8 megabytes whole, and use up to '
+                'MB megabytes to remember what the changes make of file '
+                'content already seen, so identical files are parsed once')
+        parser.add_argument('--quiet', action='store_true',
+            help='print only errors and the summary line')
+        parser.add_argument('--report', action='store_true',
+            help='append a JSON record for each file and for the run to '
+                'wfcfg.jsonl next to wfcfg.log')
+        parser.add_argument('--report-path', metavar='PATH',
+            help='append the records to PATH instead (implies --report)')
+        parser.add_argument('--report-max-bytes', type=int,
+            default=5 * 1024 * 1024, metavar='BYTES',
+            help='rotate the report once it reaches BYTES (default: 5 MiB)')
+        parser.add_argument('--report-backups', type=int, default=3,
+            metavar='N', help='rotated reports to keep (default: 3)')
+        parser.add_argument('--profile', action='store_true',
+            help='report the time spent in each phase of the run and on '
+                'the slowest files')
+        parser.add_argument('--profile-dump', action='store_true',
+            help='with --profile, also save cProfile and tracemalloc data '
+                'to the folder of wfcfg.log')
+        parser.add_argument('--profile-dump-dir', metavar='DIR',
+            help='save that data to DIR instead (implies --profile-dump)')
+        parser.add_argument('--printer-cache', action='store_true',
+            help='reuse the list of installed printers saved by a run in '
+                'the last --printer-cache-ttl seconds, instead of reading '
+                'the registry again (kept in '
+                '%%ProgramData%%\\WfCfg\\printers.json)')
+        parser.add_argument('--printer-cache-path', metavar='PATH',
+            help='keep the saved printer list at PATH instead (implies '
+                '--printer-cache)')
+        parser.add_argument('--printer-cache-ttl', type=float, default=60.0,
+            metavar='SECONDS',
+            help='seconds a saved printer list is reused (default: 60)')
+        parser.add_argument('--printers-from', metavar='PATH',
+            help='take the installed printers from a JSON list at PATH '
+                'instead of the registry (for testing)')
+        parser.add_argument('--max-profile-age', type=float, metavar='DAYS',
+            help='skip user profiles whose Workflows preferences have not '
+                'changed in DAYS days')
+        parser.add_argument('--exclude-profile', action='append',
+            metavar='PATTERN',
+            help='skip user profiles whose names match PATTERN (may be '
+                'repeated)')
+        parser.add_argument('--exclude-system-profiles', action='store_true',
+            help='skip profiles that never run Workflows (Public, '
+                'defaultuser*, etc.); the Default profile is still updated')
+        parser.add_argument('--max-profiles', type=int, metavar='N',
+            help='only update the N most recently used user profiles')
+        subparsers = parser.add_subparsers(required=True, 
             help='sub-command help')
+        for name, help, add_arguments in self._commands:
+            subparser = subparsers.add_parser(name, help=help)
+            if name == command:
+                add_arguments(subparser)
+        return parser
 
+    def _add_main_arguments(self, parser_mn):
         ##################################################################
         # MAIN CONFIG PARSER
-        parser_mn = subparsers.add_parser('main', 
-            help='Modify preferences of Workflows GUI.')
         parser_mn.add_argument('--update', nargs='+')
         parser_mn.add_argument('--delete', nargs='+')
         parser_mn.add_argument('--find-printer', nargs='+', 
@@ -45,10 +236,10 @@ class WfCfgParser:
             help='change desktop settings to use tabbed windows')
         parser_mn.set_defaults(func=self._proc_main)
 
+    def _add_paper_arguments(self, parser_paper):
         ##################################################################
         # SCREEN PRINTER PAPER CONFIG
-        parser_paper = subparsers.add_parser('paper',
-            help='Paper settings for the "screen printer."')
+        from .paper import paper_units, paper_sizes, paper_orientation
         margin_help = '''Set all margins to the same value by
         providing a single number. Or set each margin individually by
         providing four numbers. When four numbers are provided, the
@@ -64,23 +255,26 @@ class WfCfgParser:
             choices=sorted(list(paper_sizes)))
         parser_paper.set_defaults(func=self._proc_paper)
         
+    def _add_font_arguments(self, parser_ft):
         ##################################################################
         # CLIENT-GUI FONT PARSER
-        parser_ft = subparsers.add_parser('font', 
-            help='Modify display font settings of Workflows GUI.')
-        parser_ft.add_argument('component', 
-            choices=['ALL'] + gui_components, help='affected UI component')
-        parser_ft.add_argument('type', help='font type (name)')
-        parser_ft.add_argument('size', type=int, 
-            help='font size (in points)')
-        parser_ft.add_argument('style', choices=gui_component_styles,
-            help='font style')
+        from .font import gui_components, gui_component_styles
+        parser_ft.add_argument('spec', nargs='*', action=_FontSpecs,
+            metavar='COMPONENT TYPE SIZE STYLE',
+            help='affected UI component (ALL or one of: %s), font type '
+                '(name), font size (in points), and font style (%s); may '
+                'be repeated to set several components at once' %
+                (', '.join(gui_components), ', '.join(gui_component_styles)))
+        parser_ft.add_argument('--delete', nargs='+', metavar='COMPONENT',
+            choices=['ALL'] + gui_components,
+            help='remove the font setting of UI components, so that '
+                'Workflows uses its default font')
         parser_ft.set_defaults(func=self._proc_font)
 
+    def _add_receipt_arguments(self, parser_rp):
         ##################################################################
         # RECEIPT PRINTER CONFIG parser
-        parser_rp = subparsers.add_parser(
-            'receipt-printer', help='Modify receipt printer settings.')
+        from .paper import paper_units
         parser_rp.set_defaults(func=self._proc_receipt)
         # add or remove printer: only one of these allowed per call
         rp_addremove = parser_rp.add_mutually_exclusive_group()    
@@ -109,18 +303,59 @@ class WfCfgParser:
             help='declare which units to use')
         rp_paper.add_argument('--paper-width', nargs=1, 
             help='set paper width in terms of units')
+
+    def _add_apply_arguments(self, parser_ap):
+        ##################################################################
+        # POLICY FILE parser
+        parser_ap.add_argument('policy', help='path to the policy file')
+        parser_ap.add_argument('--no-plan-cache', action='store_true',
+            help='compile the policy even if a cached plan is current')
+        parser_ap.set_defaults(func=self._proc_apply)
+
+    def _add_watch_arguments(self, parser_wt):
+        ##################################################################
+        # ENFORCEMENT DAEMON parser
+        parser_wt.add_argument('policy', help='path to the policy file')
+        parser_wt.add_argument('--no-plan-cache', action='store_true',
+            help='compile the policy even if a cached plan is current')
+        parser_wt.add_argument('--debounce', type=float, default=2.0,
+            metavar='SECONDS',
+            help='wait until files have been quiet for SECONDS before '
+                'reapplying the policy (default: 2)')
+        parser_wt.add_argument('--poll', action='store_true',
+            help='check folders for changes periodically instead of using '
+                'Windows change notifications')
+        parser_wt.add_argument('--interval', type=float, default=1.0,
+            metavar='SECONDS',
+            help='seconds between checks with --poll (default: 1)')
+        parser_wt.add_argument('--status', action='store_true',
+            help='write status counters to '
+                '%%ProgramData%%\\WfCfg\\watch.json')
+        parser_wt.add_argument('--status-path', metavar='PATH',
+            help='write status counters to PATH instead (implies --status)')
+        parser_wt.set_defaults(func=self._proc_watch)
         
-        
+    def _add_rollback_arguments(self, parser_rb):
+        ##################################################################
+        # ROLLBACK parser
+        parser_rb.add_argument('run', nargs='?',
+            help='ID of the run to undo, as printed by that run')
+        parser_rb.add_argument('--list', action='store_true',
+            help='list the runs that can be rolled back')
+        parser_rb.set_defaults(func=self._proc_rollback)
+
     def _proc_main(self, args):
         """Procedure called by running the 'main' subparser."""
         if args.update:
-            print('args.update:', args.update)
-            for key, val in [arg.split('=') for arg in args.update]:
+            if not args.quiet:
+                print('args.update:', args.update)
+            for key, val in [arg.split('=', 1) for arg in args.update]:
                 self.main_cfg.update(key, val)
         if args.delete:
             for key in args.delete:
                 self.main_cfg.delete(key)
         if args.find_printer:
+            from .os import local_printers_available
             try:
                 printer = local_printers_available(args.find_printer).pop()
                 key = 'peripherals.screen.printer'
@@ -133,7 +368,7 @@ class WfCfgParser:
             self.main_cfg.update('desktop.multiple_windows', 'Y')
             self.main_cfg.update('desktop.tabbed_windows', 'Y')
             self.main_cfg.update('desktop.tabbed_window_bottom', 'N')
-        self.main_cfg.run(args.test)
+        return self._run_cfg(self.main_cfg, args)
       
     def _proc_paper(self, args):
         """Procedure called by running the 'paper' subparser."""
@@ -152,18 +387,24 @@ class WfCfgParser:
             self.paper.size = args.size[0]
         for key, value in self.paper.settings:
             self.main_cfg.update(key, value)
-        self.main_cfg.run(args.test)
+        return self._run_cfg(self.main_cfg, args)
 
     def _proc_font(self, args):   
         """Procedure called by running the 'font' subparser."""
-        self.font_cfg.update(args.component, args.type, args.style, args.size)
-        self.font_cfg.run(args.test)
+        from .font import Font
+        batch = [(component, Font(font_type, style, size))
+                 for component, font_type, size, style in args.spec]
+        self.font_cfg.batch_update(batch)
+        for component in args.delete or []:
+            self.font_cfg.delete(component)
+        return self._run_cfg(self.font_cfg, args)
 
     def _proc_receipt(self, args):
         """Procedure called by running the 'receipt-printer' subparser."""
         
         # receipt printer settings
         if args.find:
+            from .os import add_local_receipt_printer
             add_local_receipt_printer(self.receipt, *args.find)
         if args.add:
             printer_name = args.add[0]
@@ -193,9 +434,121 @@ class WfCfgParser:
             self.receipt.font.name = args.font_type
         if args.font_style:
             self.receipt.font.style = args.font_style
-        self.receipt.run(args.test)
+        return self._run_cfg(self.receipt, args)
+
+    def _proc_apply(self, args):
+        """Procedure called by running the 'apply' subparser."""
+        from .session import ApplySession
+        from .policy import load_plan, stage_plan
+        session = ApplySession()
+        plan = load_plan(args.policy, not args.no_plan_cache)
+        stage_plan(plan, session, lambda: self.pref_files,
+                   lambda: self.font_files)
+        return self._run_cfg(session, args)
 
-    def run(self, args):
+    def _proc_watch(self, args):
+        """Procedure called by running the 'watch' subparser."""
+        from .watch import Enforcer, default_status_path
+        status = args.status_path
+        if args.status and status is None:
+            status = default_status_path()
+        enforcer = Enforcer(args.policy, self.pref_files, self.font_files,
+            debounce=args.debounce, poll=args.poll, interval=args.interval,
+            status_path=status, use_plan_cache=not args.no_plan_cache,
+            workers=args.workers, test_run=args.test,
+            durability=args.durability, quiet=args.quiet)
+        enforcer.run()
+        return []
+
+    def _backup_store(self, args) -> "BackupStore":
+        from .backup import BackupStore, default_backup_dir
+        return BackupStore(args.backup_dir or default_backup_dir(),
+                           self._command_line)
+
+    def _proc_rollback(self, args):
+        """Procedure called by running the 'rollback' subparser."""
+        store = self._backup_store(args)
+        if args.list or args.run is None:
+            for run_id in store.runs():
+                manifest = store.manifest(run_id)
+                print(run_id, '%d files' % len(manifest['files']),
+                      ' '.join(manifest['command'] or []))
+            return []
+        results = store.restore(args.run, args.workers, args.test,
+                                args.durability, args.quiet)
+        from .configurator import report_backup
+        report_backup(store)
+        return results
+
+    def _run_cfg(self, configurator, args):
+        """Applies the global options to `configurator` (or ApplySession)
+        and runs it. Returns the list of FileResult objects from the run."""
+        if args.check:
+            from .session import ApplySession
+            if not isinstance(configurator, ApplySession):
+                session = ApplySession()
+                session.add(configurator)
+                configurator = session
+            configurator.workers = args.workers
+            configurator.quiet = args.quiet
+            return configurator.check()
+        configurator.workers = args.workers
+        configurator.quiet = args.quiet
+        configurator.durability = args.durability
+        if args.transform_cache is not None and args.transform_cache > 0:
+            from .transform_cache import TransformCache
+            configurator.transform_cache = TransformCache(
+                int(args.transform_cache * 1024 * 1024))
+        if args.state_cache or args.state_cache_path:
+            from .state_cache import StateCache, default_cache_path
+            configurator.state_cache = StateCache(
+                args.state_cache_path or default_cache_path())
+        if (args.backup or args.backup_dir) and not args.test:
+            configurator.backup = self._backup_store(args)
+        if args.incremental or args.inventory_path:
+            from .inventory import ProfileInventory, default_inventory_path
+            configurator.inventory = ProfileInventory(
+                args.inventory_path or default_inventory_path(),
+                args.full_resync)
+        results = configurator.run(args.test)
+        if configurator.backup is not None:
+            configurator.backup.prune(args.backup_keep)
+        return results
+
+    def _run_profiled(self, args):
+        """Runs the command with timings (and, with --profile-dump,
+        cProfile and tracemalloc) recorded, then reports them."""
+        from . import profiling
+        dump = None
+        if args.profile_dump or args.profile_dump_dir:
+            import cProfile, os, time, tracemalloc
+            directory = args.profile_dump_dir or profiling.default_dump_dir()
+            dump = os.path.join(directory, 'wfcfg-%s-%d' % (
+                time.strftime('%Y%m%d-%H%M%S'), os.getpid()))
+            tracemalloc.start()
+            profiler = cProfile.Profile()
+            profiler.enable()
+        profiling.active = profiling.Profile()
+        try:
+            results = args.func(args) or []
+        finally:
+            profile, profiling.active = profiling.active, None
+            if dump is not None:
+                profiler.disable()
+                profiler.dump_stats(dump + '.prof')
+                tracemalloc.take_snapshot().dump(dump + '.tracemalloc')
+                tracemalloc.stop()
+        print('\n' + profile.report())
+        if dump is not None:
+            print('  Saved %s.prof (cProfile) and %s.tracemalloc.' %
+                  (dump, dump))
+        return results
+
+    def run(self, args) -> int:
+        """Parses and executes a command line. Returns an exit status:
+        0 on success, 1 if any subject file could not be updated (or,
+        with --check, read), or 3 if --check found any subject file out
+        of compliance (2 is argparse's usage error)."""
         ##################################################################
         # DEFAULT TO 'HELP': display a help message if user does not
         # supply enough arguments to run anything
@@ -214,9 +567,58 @@ class WfCfgParser:
         elif len(args) == 1 and args[0] == 'receipt-printer':
             # user enters: python wfcfg.py receipt-printer
             args = ['receipt-printer', '-h']
+        elif len(args) == 1 and args[0] == 'apply':
+            # user enters: python wfcfg.py apply
+            args = ['apply', '-h']
+        elif len(args) == 1 and args[0] == 'watch':
+            # user enters: python wfcfg.py watch
+            args = ['watch', '-h']
+        elif len(args) == 1 and args[0] == 'rollback':
+            # user enters: python wfcfg.py rollback
+            args = ['rollback', '--list']
         else:
             # continue as normal
             pass
 
-        args = self._parser.parse_args(args)
-        args.func(args)    
+        command_line = self._command_line = list(args)
+        command = next((a for a in args if a in
+                        [name for name, _, _ in self._commands]), None)
+        args = self._build_parser(command).parse_args(args)
+        self._discovery = {}
+        if args.max_profile_age is not None:
+            self._discovery['max_age_days'] = args.max_profile_age
+        if args.exclude_profile or args.exclude_system_profiles:
+            from .os import SYSTEM_PROFILES
+            self._discovery['exclude'] = (args.exclude_profile or []) + \
+                (list(SYSTEM_PROFILES) if args.exclude_system_profiles
+                 else [])
+        if args.max_profiles is not None:
+            self._discovery['limit'] = args.max_profiles
+        if args.printer_cache or args.printer_cache_path or \
+           args.printers_from:
+            from . import printers
+            path = args.printer_cache_path
+            if args.printer_cache and path is None:
+                path = printers.default_cache_path()
+            provider = None
+            if args.printers_from:
+                provider = printers.JsonProvider(args.printers_from)
+            printers.configure(provider, path,
+                               args.printer_cache_ttl)
+        import time
+        started = time.time()
+        if args.profile:
+            results = self._run_profiled(args)
+        else:
+            results = args.func(args) or []
+        if args.report or args.report_path:
+            from .report import write_report, default_report_path
+            path = args.report_path or default_report_path()
+            write_report(path, results, command_line, started,
+                         args.report_max_bytes, args.report_backups)
+        from .configurator import FileResult
+        if any(r.status == FileResult.ERROR for r in results):
+            return 1
+        if any(r.status == FileResult.NONCOMPLIANT for r in results):
+            return 3
+        return 0
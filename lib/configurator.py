@@ -6,26 +6,199 @@
 #:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
 """A class to update Sirsi Workflows configuration files."""
 #:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
-from typing import NoReturn, Any, Set, Tuple, List, Union, Generator
+from typing import NoReturn, Any, Set, Tuple, List, Union, Generator, \
+    Iterable, Iterator, Callable, Dict
+from collections import Counter
+import io, os, re
 from .os import LockedFile
+from .preference_file import PreferenceFile, line_ending
+from .inventory import profile_of
+from . import profiling
+# key (any run of unescaped non-'=' characters) '=' value; lines that
+# start with '#' or '!' are comments
+_key_value = re.compile(r'^(?![#!])((?:[^\\=]|\\.)+)=(.*)$')
 #:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
 
+class FileResult:
+    """The outcome of applying staged changes to one subject file."""
+    UPDATED = 'updated'
+    UNCHANGED = 'unchanged'
+    CACHED = 'cached'
+    SIMULATED = 'simulated'
+    ERROR = 'error'
+    # outcomes of a check (see ApplySession.check)
+    COMPLIANT = 'compliant'
+    NONCOMPLIANT = 'noncompliant'
+
+    def __init__(self, path: str, status: str, error: Exception = None,
+                 lock_wait: float = 0.0):
+        self.path = path
+        self.status = status
+        self.error = error
+        # seconds spent waiting for the file's lock
+        self.lock_wait = lock_wait
+        # seconds spent on the file, and its size once processed
+        self.duration = 0.0
+        self.size = None
+        # (key, expected value, actual value) of each key a check found
+        # out of compliance; None stands for an absent key
+        self.deviations: List[Tuple[str, Union[None, str],
+                                    Union[None, str]]] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the result as a JSON-serializable dict."""
+        record = {'path': self.path, 'status': self.status,
+                  'error': None if self.error is None else str(self.error),
+                  'duration': round(self.duration, 6), 'bytes': self.size,
+                  'lock_wait': round(self.lock_wait, 6)}
+        if self.deviations:
+            record['deviations'] = [
+                {'key': key, 'expected': expected, 'actual': actual}
+                for key, expected, actual in self.deviations]
+        return record
+
+    def __str__(self) -> str:
+        if self.error is not None:
+            return '%s (%s: %s)' % (self.path, self.status, self.error)
+        return '%s (%s)' % (self.path, self.status)
+
+
+def summarize(results: List["FileResult"]) -> str:
+    """Returns a one-line summary of a list of FileResult objects."""
+    counts = Counter(r.status for r in results)
+    if counts[FileResult.COMPLIANT] or counts[FileResult.NONCOMPLIANT]:
+        return '%d files checked: %d compliant, %d non-compliant, ' \
+            '%d errors.' % (len(results), counts[FileResult.COMPLIANT],
+                            counts[FileResult.NONCOMPLIANT],
+                            counts[FileResult.ERROR])
+    summary = '%d files processed: %d updated, %d unchanged' % \
+        (len(results), counts[FileResult.UPDATED], counts[FileResult.UNCHANGED])
+    if counts[FileResult.CACHED]:
+        summary += ', %d skipped (cached)' % counts[FileResult.CACHED]
+    if counts[FileResult.SIMULATED]:
+        summary += ', %d to update' % counts[FileResult.SIMULATED]
+    summary += ', %d errors.' % counts[FileResult.ERROR]
+    lock_wait = sum(r.lock_wait for r in results)
+    if lock_wait >= 0.01:
+        summary += ' Waited %.2fs for locks.' % lock_wait
+    return summary
+
+
+def report_backup(backup: "BackupStore") -> NoReturn:
+    """Saves the manifest of a run's backups and says how to roll the
+    run back."""
+    from .backup import default_backup_dir
+    run_id = backup.save()
+    if run_id is not None:
+        store = '' if os.path.abspath(backup.root) == \
+            os.path.abspath(default_backup_dir()) else \
+            '--backup-dir "%s" ' % backup.root
+        print('Backed up %d files. To undo: python wfcfg.py %srollback %s'
+              % (len(backup), store, run_id))
+
+
+def measured(apply: Callable[[str], "FileResult"]) -> \
+        Callable[[str], "FileResult"]:
+    """Returns `apply`, a function processing one subject file, wrapped
+    to record the time it takes and the resulting size of the file in
+    the FileResult it returns."""
+    import time
+    def wrapper(path):
+        start = time.perf_counter()
+        result = apply(path)
+        result.duration = time.perf_counter() - start
+        if result.status != FileResult.ERROR:
+            try:
+                result.size = os.path.getsize(path)
+            except OSError:
+                pass
+        return result
+    return wrapper
+
+def map_in_order(func, items: Iterable[Any], workers: int = 1) -> Iterator[Any]:
+    """Yields func(item) for each of `items`, in order. When `workers` is
+    greater than one, items are processed by a pool of that many
+    threads. `items` may be a lazy iterable; it is consumed only a few
+    items ahead of the results yielded."""
+    if workers == 1:
+        yield from map(func, items)
+        return
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
 class Configurator:
-    def __init__(self, config_files: Set[str]) -> "Configurator":
+    def __init__(self, config_files: Union[Set[str], Callable[[], Set[str]]],
+                 workers: int = 1,
+                 state_cache: "StateCache" = None,
+                 inventory: "ProfileInventory" = None,
+                 durability: str = 'file',
+                 backup: "BackupStore" = None,
+                 transform_cache: "TransformCache" = None) -> \
+            "Configurator":
         """
         Create a new Configurator object. Subject files are provided as
-        a set of strings of filepaths.
+        a set of strings of filepaths, or as a function returning such a
+        set, which is called the first time the files are needed. When
+        `workers` is greater than one, subject files are processed
+        concurrently by that many threads. When a StateCache is provided, files that have not
+        changed since the same staged changes were last applied to them
+        are skipped without being opened. When a ProfileInventory is
+        provided, files are skipped in the same way for whole user
+        profiles left untouched since the last run. `durability` sets
+        how far each write is flushed; see LockedFile. When a
+        BackupStore is provided, each file's content is backed up in it
+        before the file is rewritten. When a TransformCache is
+        provided, files small enough for it are read whole instead of
+        streamed, and content seen before, in any file, is not
+        transformed again while the cache remembers it.
         """
         self._update_items = {}
         self._delete_items = set()
         self._config_files = config_files
         self._changes_staged = False
+        self.workers = workers
+        self.state_cache = state_cache
+        self.inventory = inventory
+        self.durability = durability
+        self.backup = backup
+        self.transform_cache = transform_cache
+        # print only errors and the summary line
+        self.quiet = False
         
+    @property
+    def workers(self) -> int:
+        """Number of threads used to process subject files."""
+        return self._workers
+    @workers.setter
+    def workers(self, workers: int) -> NoReturn:
+        if workers < 1:
+            raise ValueError("At least one worker is required.")
+        self._workers = workers
+
     @property
     def changes_staged(self) -> bool:
         """Boolean indicating if changes have been staged."""
         return self._changes_staged
 
+    @property
+    def fingerprint(self) -> str:
+        """A digest identifying the staged changes and the format of the
+        files they apply to."""
+        import hashlib, json
+        staged = [type(self).__name__, list(self._update_items.items()),
+                  sorted(self._delete_items)]
+        return hashlib.sha256(json.dumps(staged).encode('utf-8')).hexdigest()
+
     def update(self, key: str, value: str) -> NoReturn:
         """
         Stages an update to a key in the preference files, replacing its
@@ -49,49 +222,106 @@ class Configurator:
         self._delete_items.add(key)
         self._changes_staged = True
                 
-    def _updated_files(self) -> Generator[Tuple[str, str], None, None]:
+    def _rewrite(self, lines: Iterable[str],
+                 parse: Callable = None) -> Generator[str, None, None]:
+        """
+        Single-pass rewrite engine. Yields the lines (with line endings)
+        that result from applying the staged deletes and updates to
+        `lines`, followed by staged updates whose keys were not found.
+        Lines that are not touched by a staged change, including blank
+        lines and comments, are yielded exactly as read. Every
+        occurrence of an updated or deleted key is affected. Lines are
+        parsed with `parse` if given, otherwise config_line_processor.
+        """
+        parse = self.config_line_processor if parse is None else parse
+        keys_to_update = set(self._update_items)
+        eol, last = None, None
+        for line in lines:
+            if eol is None and line_ending(line):
+                eol = line_ending(line)
+            entry = parse(line)
+            if entry is not None:
+                key, value = entry
+                keys_to_update.discard(key)
+                if key in self._delete_items:
+                    continue
+                if key in self._update_items and \
+                   value != self._update_items[key]:
+                    line = self.config_line_formatter(
+                        key, self._update_items[key]) + line_ending(line)
+            last = line
+            yield line
+        if not keys_to_update:
+            return
+        # append 'update' values that were not in file, in staged order
+        if eol is None:
+            eol = os.linesep
+        if last is not None and not line_ending(last):
+            yield eol
+        for key, value in self._update_items.items():
+            if key in keys_to_update:
+                yield self.config_line_formatter(key, value) + eol
+
+    def _updated_lines(self, path: str) -> Generator[str, None, None]:
+        """
+        Yields the new content of the file at `path`, one line at a time.
+        The file is read lazily, so the content can be written out as it
+        is produced.
+        """
+        profile = profiling.active
+        with open(path, newline='') as pref:
+            if profile is None:
+                yield from self._rewrite(pref)
+                return
+            profile.add_bytes(path, read=os.fstat(pref.fileno()).st_size)
+            parse = profile.timed(self.config_line_processor, 'parse', path)
+            try:
+                yield from self._rewrite(profile.timed_lines(pref, path),
+                                         parse)
+            finally:
+                parse.flush()
+
+    def apply_to(self, preferences: "PreferenceFile") -> bool:
+        """
+        Applies the staged deletes and updates to a PreferenceFile, with
+        the same result as rewriting the file it was loaded from. Returns
+        True if the PreferenceFile was modified.
+        """
+        was_modified = preferences.modified
+        absent = {key for key in self._update_items if key not in preferences}
+        for key in self._delete_items:
+            preferences.delete(key)
+        for key, value in self._update_items.items():
+            # keys slated for deletion are only added if they were absent
+            if key not in self._delete_items or key in absent:
+                preferences.set(key, value)
+        return preferences.modified and not was_modified
+
+    def load(self, path: str) -> "PreferenceFile":
+        """Returns a PreferenceFile for `path`, parsed by this
+        Configurator's line processor."""
+        return PreferenceFile.load(path, self)
+
+    def _updated_files(self) -> Generator[Tuple[str, Iterator[str]], None, None]:
         """
         Yields a (path, content) tuple for each subject file of the
         Configurator. The 'path' value contains the full path to the file,
-        and the 'content' value contains the new content of the file based
-        on delete and update rules of the configurator.
-        """
-        for path in self._config_files:
-            keys_to_update = set(self._update_items.keys())
-            lines_to_delete = set()
-            buffer = []
-            with open(path) as pref:
-                for line in [_.strip() for _ in pref if _.strip()]:
-                    key, value = self.config_line_processor(line)
-                    buffer.append([key, value])
-            # do the staged updates; record the line numbers to be deleted
-            if buffer:
-                for i, cfg in enumerate(buffer):
-                    key = cfg[0]
-                    if key in self._delete_items:
-                        lines_to_delete.add(i)
-                    if key in keys_to_update:
-                        buffer[i][1] = self._update_items[key]
-                        keys_to_update.remove(key)
-            # delete the keys slated for deletion
-            if buffer:
-                for i, line_num in enumerate(sorted(list(lines_to_delete))):
-                    del buffer[line_num - i]
-                    i += 1
-            # append 'update' values that were not in file
-            for new_item in keys_to_update:
-                value = self._update_items[new_item]
-                buffer.append((new_item, value))
-            # reformat buffer and write to file
-            content = '\n'.join([self.config_line_formatter(key,val) \
-                                for key, val in buffer])
-            yield path, content
+        and the 'content' value is an iterator over the new content of the
+        file based on delete and update rules of the configurator.
+        """
+        for path in self.config_files:
+            yield path, self._updated_lines(path)
             
-    def config_line_processor(self, line: str) -> List[str]:
+    def config_line_processor(self, line: str) -> Union[None, List[str]]:
         """Config line to key/value pair: Returns a two-item list,
-        [key, item], based on provided configuration line."""
-        key, value = line.strip().split('=')
-        return [key, value]
+        [key, item], based on provided configuration line. Returns None
+        for blank lines, comments, and other lines without a key. The
+        key ends at the first '=' that is not escaped by a backslash;
+        escapes are otherwise left as they are."""
+        match = _key_value.match(line.strip())
+        if match is None:
+            return None
+        return [match.group(1).rstrip(), match.group(2).lstrip()]
             
     def config_line_formatter(self, key: str, value: str) -> str:
         """Key/value pair to config line: Return a configuration file
@@ -102,13 +332,128 @@ class Configurator:
     def config_files(self):
         """A set containing paths to configuration files affected by
         this Configurator."""
+        if callable(self._config_files):
+            self._config_files = self._config_files()
         return self._config_files
 
-    def run(self, test_run: bool = False) -> NoReturn:
-        """Applies updates and deletions to preference files."""
-        if not self.changes_staged:
-            print("No changes staged. Not executing run.")
-            return None
+    def _needs_update(self, path: str, digest: "hashlib._Hash") -> bool:
+        """
+        True if applying the staged changes would alter the file at
+        `path`. The rewritten content is compared with the current
+        content piece by piece, stopping at the first difference. Matching
+        content is fed to `digest` along the way.
+        """
+        updated_file = self._updated_lines(path)
+        try:
+            with open(path, newline='') as current:
+                for chunk in updated_file:
+                    if current.read(len(chunk)) != chunk:
+                        return True
+                    digest.update(chunk.encode('utf-8'))
+                return current.read(1) != ''
+        finally:
+            updated_file.close()
+
+    def _transform(self, content: str) -> str:
+        """Returns the content the staged changes make of `content`."""
+        return ''.join(self._rewrite(io.StringIO(content, newline='')))
+
+    def _apply_file(self, path: str, test_run: bool,
+                    fingerprint: str) -> "FileResult":
+        """Applies staged changes to a single subject file. Files whose
+        content would not change are neither locked nor written. With a
+        transform cache, files small enough for it are read whole, and
+        files whose content it has seen before are not parsed again. Errors
+        are captured in the returned FileResult rather than raised, so
+        that one bad file does not stop the others from being processed."""
+        import hashlib
+        cache = self.state_cache
+        lock = None
+        try:
+            if self.inventory is not None and self.inventory.is_current(
+                    profile_of(path), fingerprint):
+                return FileResult(path, FileResult.CACHED)
+            if cache is not None and cache.is_current(path, fingerprint):
+                return FileResult(path, FileResult.CACHED)
+            memoized = self.transform_cache is not None and \
+                self.transform_cache.fits(os.path.getsize(path))
+            if memoized:
+                content, updated = self.transform_cache.transform_file(
+                    path, fingerprint, self._transform)
+                if updated is None:
+                    if cache is not None:
+                        cache.record(path, fingerprint, hashlib.sha256(
+                            content.encode('utf-8')).hexdigest())
+                    return FileResult(path, FileResult.UNCHANGED)
+            else:
+                digest = hashlib.sha256()
+                if not self._needs_update(path, digest):
+                    if cache is not None:
+                        cache.record(path, fingerprint, digest.hexdigest())
+                    return FileResult(path, FileResult.UNCHANGED)
+            if test_run:
+                # if we're in test mode, don't write staged changes
+                return FileResult(path, FileResult.SIMULATED)
+            digest = hashlib.sha256()
+            updated_file = self._updated_lines(path) if not memoized else \
+                iter(())
+            lock = LockedFile(path, 'w', newline='',
+                              durability=self.durability)
+            profile = profiling.active
+            try:
+                with lock as fo:
+                    if self.backup is not None:
+                        self.backup.add(path)
+                    if memoized:
+                        # read again under the lock, in case the file
+                        # has changed
+                        content, updated = \
+                            self.transform_cache.transform_file(
+                                path, fingerprint, self._transform)
+                        updated_file = iter([content if updated is None
+                                             else updated])
+                    write = fo.write if profile is None else \
+                        profile.timed(fo.write, 'write', path)
+                    for chunk in updated_file:
+                        digest.update(chunk.encode('utf-8'))
+                        write(chunk)
+            finally:
+                if not memoized:
+                    updated_file.close()
+            if profile is not None:
+                write.flush()
+                profile.add('write', lock.commit_time, path)
+                profile.add('lock wait', lock.lock_wait, path)
+                profile.add_bytes(path, written=os.path.getsize(path))
+            if cache is not None:
+                cache.record(path, fingerprint, digest.hexdigest())
+        except Exception as e:
+            return FileResult(path, FileResult.ERROR, e,
+                              lock.lock_wait if lock is not None else 0.0)
+        return FileResult(path, FileResult.UPDATED, lock_wait=lock.lock_wait)
+
+    def _apply_files(self, test_run: bool) -> Iterator["FileResult"]:
+        """Yields a FileResult for each subject file, regardless of the
+        order in which the files are processed: in path order for a set
+        of files, otherwise in the order they are given."""
+        fingerprint = self.fingerprint
+        apply = measured(lambda path: self._apply_file(path, test_run,
+                                                       fingerprint))
+        if profiling.active is not None:
+            apply = profiling.active.per_file(apply)
+        paths = self.config_files
+        if isinstance(paths, (set, frozenset)):
+            paths = sorted(paths)
+        yield from map_in_order(apply, paths, self.workers)
+
+    def _stage(self) -> NoReturn:
+        """Stages changes held outside of update() and delete(). Called
+        before the staged changes are applied; subclasses that collect
+        settings of their own override it."""
+        pass
+
+    def _print_staged(self) -> NoReturn:
+        """Prints the staged updates and deletions."""
         if self._update_items:
             print("Updating items:")
             for key, value in self._update_items.items():
@@ -117,12 +462,29 @@ class Configurator:
         if self._delete_items:
             print("Deleting items:")
             print('\n'.join([' * ' + itm for itm in self._delete_items]) + '\n')
-        print('Updating files:')
-        for j, (path, updated_file) in enumerate(self._updated_files()):
-            print(' *', path)
-            if test_run:
-                # if we're in test mode, don't write staged changes
-                continue
-            with LockedFile(path, 'w') as fo:
-                fo.write(updated_file)
+
+    def run(self, test_run: bool = False) -> List["FileResult"]:
+        """Applies updates and deletions to preference files. Returns a
+        list of FileResult objects, one per subject file."""
+        if not self.changes_staged:
+            print("No changes staged. Not executing run.")
+            return []
+        self._stage()
+        if not self.quiet:
+            self._print_staged()
+            print('Updating files:')
+        results = []
+        for result in self._apply_files(test_run):
+            if not self.quiet or result.status == FileResult.ERROR:
+                print(' *', result)
+            results.append(result)
+        if self.state_cache is not None:
+            self.state_cache.save()
+        if self.inventory is not None:
+            self.inventory.record_results(results, self.fingerprint)
+            self.inventory.save()
+        print(('' if self.quiet else '\n') + summarize(results))
+        if self.backup is not None:
+            report_backup(self.backup)
         self._changes_staged = False
+        return results
@@ -23,8 +23,16 @@ class Font:
         
 
 class FontConfigurator(Configurator):
-    def __init__(self, config_files) -> "FontConfigurator":
-        super().__init__(config_files)    
+    def __init__(self, config_files, **kwargs) -> "FontConfigurator":
+        super().__init__(config_files, **kwargs)
+
+    @staticmethod
+    def _components(gui_component: str) -> List[str]:
+        """Returns the GUI components named by `gui_component`: every
+        one of them for 'ALL'."""
+        if gui_component.lower() == 'all':
+            return gui_components
+        return [gui_component]
 
     def update(self, gui_component: str, font_type: str, 
                   font_style: str, font_size: int) -> NoReturn:
@@ -37,22 +45,40 @@ class FontConfigurator(Configurator):
         If an update has already been staged for the provided GUI
         component, it will be overwritten with the provided value.
         """
-        font = Font(font_type, font_style, font_size)
-        if gui_component.lower() == 'all':
-            for gc in gui_components:
-                super().update(gc, str(font))
-        else:
-            super().update(gui_component, str(font))
+        self.batch_update([(gui_component,
+                            Font(font_type, font_style, font_size))])
 
-    def batch_update(self, batch: List[Tuple[str, str]]) -> NoReturn:
-        raise NotImplementedError
+    def batch_update(self, batch: List[Tuple[str, Union[str, "Font"]]]) \
+            -> NoReturn:
+        """
+        Stages an update for each (GUI component, font) pair of `batch`,
+        in order, where the font is a Font or a formatted font value
+        ('type|style|size'). 'ALL' stands for every GUI component. A
+        later pair (or deletion) for a component replaces an earlier one,
+        and all of them are applied in a single pass over each file.
+        """
+        for gui_component, font in batch:
+            value = str(font)
+            for gc in self._components(gui_component):
+                self._delete_items.discard(gc)
+                Configurator.update(self, gc, value)
 
-    def delete(self, key: str) -> NoReturn:
-        raise NotImplementedError
+    def delete(self, gui_component: str) -> NoReturn:
+        """
+        Slates a GUI component (or, for 'ALL', every GUI component) in
+        the font files for deletion, so that Workflows uses its default
+        font for it. Replaces any update staged for the component.
+        """
+        for gc in self._components(gui_component):
+            self._update_items.pop(gc, None)
+            Configurator.delete(self, gc)
 
-    def config_line_processor(self, line: str) -> List[str]:
-        """Return a list in [key, value] format of a configuration line."""
+    def config_line_processor(self, line: str) -> Union[None, List[str]]:
+        """Return a list in [key, value] format of a configuration line,
+        or None if the line does not hold a font setting."""
         line = line.strip().split('|')
+        if len(line) < 2 or not line[0]:
+            return None
         return [line[0], '|'.join(line[1:-1])]
             
     def config_line_formatter(self, key: str, value: str) -> str:
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# By: Jason Ferrell, Sep. 2023
+# https://github.com/jgferrell/
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+"""An on-disk inventory of the user profiles WfCfg has processed, so
+that incremental runs touch only profiles that are new or changed."""
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+from typing import NoReturn, Any, Set, Tuple, List, Union, Dict, Iterable
+import os
+from .os import JsonIndex, data_path
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+def default_inventory_path() -> str:
+    """Returns the default location of the profile inventory."""
+    return data_path('profiles.json')
+
+def profile_of(filepath: str) -> str:
+    """Returns the Workflows folder of the profile holding `filepath`,
+    a file in its Property folder."""
+    return os.path.dirname(os.path.dirname(os.path.abspath(filepath)))
+
+
+class ProfileInventory(JsonIndex):
+    SECTION = 'profiles'
+    # results that leave a profile up to date with the staged changes
+    _DONE = {'updated', 'unchanged', 'cached'}
+
+    def __init__(self, path: str,
+                 full_resync: bool = False) -> "ProfileInventory":
+        """
+        Create an inventory backed by the file at `path`. For each
+        profile and change fingerprint, the inventory records a
+        watermark: the latest modification time found in the profile's
+        Property folder once the changes had been applied. A profile is
+        current while nothing in that folder has changed since. With
+        `full_resync`, no profile is current, but watermarks are still
+        recorded for the next run. The file is read on first use.
+        """
+        super().__init__(path)
+        self.full_resync = full_resync
+
+    @staticmethod
+    def watermark(profile: str) -> int:
+        """Returns the latest modification time (in nanoseconds) of the
+        Property folder of `profile` and the files in it."""
+        property_dir = os.path.join(profile, 'Property')
+        latest = os.stat(property_dir).st_mtime_ns
+        with os.scandir(property_dir) as entries:
+            for entry in entries:
+                latest = max(latest, entry.stat().st_mtime_ns)
+        return latest
+
+    def is_current(self, profile: str, fingerprint: str) -> bool:
+        """True if nothing in the Property folder of `profile` has changed
+        since it was last recorded with `fingerprint`."""
+        if self.full_resync:
+            return False
+        seen = self._get(profile, fingerprint)
+        if seen is None:
+            return False
+        try:
+            return self.watermark(profile) == seen
+        except OSError:
+            return False
+
+    def record(self, profile: str, fingerprint: str) -> NoReturn:
+        """Records the current watermark of `profile` as the state left
+        by applying the changes identified by `fingerprint`."""
+        self._put(profile, fingerprint, self.watermark(profile))
+
+    def record_results(self, results: Iterable["FileResult"],
+                       fingerprint: str) -> NoReturn:
+        """Records each profile for which every file in `results` is up
+        to date with the changes identified by `fingerprint`."""
+        done = {}
+        for result in results:
+            profile = profile_of(result.path)
+            done[profile] = done.get(profile, True) and \
+                result.status in ProfileInventory._DONE
+        for profile, ok in done.items():
+            if ok:
+                try:
+                    self.record(profile, fingerprint)
+                except OSError:
+                    # removed during the run; seen as new next time
+                    pass
@@ -6,72 +6,483 @@
 #:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
 """For when we have to deal with Windows."""
 #:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
-from typing import NoReturn, Any, Set, Tuple, List, Union, Generator
-import os, time, random
+from typing import NoReturn, Any, Set, Tuple, List, Union, Dict, \
+    Generator, Iterable, Iterator
+import os, threading, time
 LOCKFILE = '.wfcfg_lock~'
+SCRATCHFILE = '.wfcfg_new~'
+# how far a write must reach before LockedFile reports success:
+# the OS cache, the disk (file contents), or the disk (contents and
+# the directory entry pointing at them)
+DURABILITY_LEVELS = ('none', 'file', 'dir')
 RUNNING_WINDOWS = os.name == 'nt'
-if RUNNING_WINDOWS:
-    import winreg
 #::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::: 
 
+class LockTimeout(TimeoutError):
+    """Raised when a file's lock is not acquired in time."""
+
+
+# locks held by this process, by lock file; OS byte-range locks do not
+# exclude other threads of the process that holds them
+_process_locks = {}
+_process_locks_guard = threading.Lock()
+
+# whether a file can be removed while it is open (Windows cannot, even
+# by the process that has it open)
+_removes_open_files = not RUNNING_WINDOWS
+
+def _process_lock(lockfile: str) -> "threading.Lock":
+    with _process_locks_guard:
+        return _process_locks.setdefault(os.path.abspath(lockfile),
+                                         threading.Lock())
+
+# directories on file systems found not to support byte-range locks
+_without_os_locks = set()
+
+_host = None
+
+def _hostname() -> str:
+    global _host
+    if _host is None:
+        import socket
+        _host = socket.gethostname()
+    return _host
+
+def _os_lock(fd: int) -> bool:
+    """Tries to take an exclusive lock on the first byte of the file
+    open as `fd` without blocking. Returns False if another process
+    holds it. Raises OSError if the file system cannot lock files."""
+    import errno
+    if RUNNING_WINDOWS:
+        import msvcrt
+        os.lseek(fd, 0, os.SEEK_SET)
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except PermissionError:  # EACCES: locked by someone else
+            return False
+        return True
+    import fcntl
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, 0)
+    except OSError as e:
+        if e.errno in (errno.EACCES, errno.EAGAIN):
+            return False
+        raise
+    return True
+
+def _os_unlock(fd: int) -> NoReturn:
+    if RUNNING_WINDOWS:
+        import msvcrt
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.lockf(fd, fcntl.LOCK_UN, 1, 0)
+
+def _pid_alive(pid: int) -> bool:
+    """True unless process `pid` is known not to be running."""
+    if RUNNING_WINDOWS:
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        # PROCESS_QUERY_LIMITED_INFORMATION
+        handle = kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            # ERROR_ACCESS_DENIED: it exists, but belongs to someone else
+            return ctypes.GetLastError() == 5
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
 class LockedFile:
-    def __init__(self, filepath, mode):
+    # seconds allowed to acquire a lock
+    TIMEOUT = 60.0
+    # first and longest pause between attempts (seconds); pauses double
+    # after each attempt and are randomized to spread out contenders
+    MIN_DELAY = 0.01
+    MAX_DELAY = 1.0
+    # sentinel locks from other machines are stale after this long
+    MAX_LOCK_AGE = 15 * 60
+
+    def __init__(self, filepath, mode, newline=None, timeout=None,
+                 durability='file'):
+        """
+        Open `filepath` with `mode` (and `newline`, as for the built-in
+        open) while holding a lock on it. Files
+        opened for writing ('w') are written to a scratch file next to
+        the target, which replaces the target only after the content has
+        been written completely. A crash mid-write therefore leaves the
+        old file in place. With `durability` 'file', the scratch file is
+        flushed to disk before it replaces the target; with 'dir', the
+        replacement itself is also flushed, so a completed write
+        survives power loss; with 'none', flushing is left to the OS.
+
+        The lock is an OS byte-range lock (msvcrt or fcntl) on a lock
+        file next to the target, so it is released by the OS if the
+        holder dies. Where the file system cannot lock files, the lock
+        file's existence is the lock, and it is removed as stale once
+        the process named in it has exited. LockTimeout is raised if
+        the lock is not acquired within `timeout` seconds (default:
+        LockedFile.TIMEOUT). The time spent waiting is kept in
+        `lock_wait`.
+        """
         if not os.path.isfile(filepath):
             raise ValueError("%s is not a file." % filepath)        
         self._filepath = filepath
         self._mode = mode
+        self._newline = newline
         self._lockfile = filepath + LOCKFILE
+        self._scratchfile = filepath + SCRATCHFILE
+        self._timeout = LockedFile.TIMEOUT if timeout is None else timeout
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError("durability must be one of: %s" %
+                             ', '.join(DURABILITY_LEVELS))
+        self._durability = durability
         self._has_lock = False
-
-        # check for and delete stale locks
-        max_lock_age = 15 # minutes
-        if os.path.exists(self._lockfile):
-            modtime = os.path.getmtime(self._lockfile)
-            if time.time() - modtime > 60 * max_lock_age:
-                os.remove(self._lockfile)
+        self._fd = None
+        self.lock_wait = 0.0
+        # seconds spent flushing and replacing the target on exit
+        self.commit_time = 0.0
 
     @property
     def locked(self):
         """Returns true iff the file is currently locked."""
-        return os.path.exists(self._lockfile)
+        if self._has_lock:
+            return True
+        process_lock = _process_lock(self._lockfile)
+        if not process_lock.acquire(blocking=False):
+            return True
+        try:
+            if not self._try_lock():
+                return True
+            self._release()
+            return False
+        finally:
+            process_lock.release()
+
+    def _owner_gone(self) -> bool:
+        """True if a sentinel lock file was left by a process that is no
+        longer running."""
+        try:
+            with open(self._lockfile, 'r') as fo:
+                host, pid = fo.read().split()
+            if host == _hostname():
+                return not _pid_alive(int(pid))
+            age = time.time() - os.path.getmtime(self._lockfile)
+            return age > LockedFile.MAX_LOCK_AGE
+        except FileNotFoundError:
+            return False
+        except ValueError:
+            # being written, or not ours; judge by age alone
+            try:
+                age = time.time() - os.path.getmtime(self._lockfile)
+            except OSError:
+                return False
+            return age > LockedFile.MAX_LOCK_AGE
 
-    def wait(self):
-        """Wait until target file is not locked."""
-        while self.locked:
-            print("WAITING!")
-            time.sleep(random.uniform(0,3))
+    def _try_sentinel(self) -> bool:
+        """Tries to take the lock by creating the lock file."""
+        try:
+            fd = os.open(self._lockfile, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            if self._owner_gone():
+                try:
+                    os.remove(self._lockfile)
+                except FileNotFoundError:
+                    pass
+            return False
+        os.write(fd, ('%s %d' % (_hostname(), os.getpid())).encode())
+        os.close(fd)
+        self._fd = None
+        self._has_lock = True
+        return True
+
+    def _try_lock(self) -> bool:
+        """Makes one attempt to take the lock without blocking."""
+        directory = os.path.dirname(os.path.abspath(self._lockfile))
+        if directory in _without_os_locks:
+            return self._try_sentinel()
+        try:
+            fd = os.open(self._lockfile, os.O_RDWR | os.O_CREAT | os.O_EXCL)
+            created = True
+        except FileExistsError:
+            try:
+                fd = os.open(self._lockfile, os.O_RDWR)
+            except FileNotFoundError:  # just released
+                return False
+            created = False
+        try:
+            got_lock = _os_lock(fd)
+        except OSError:
+            # no byte-range locks here (e.g., some network shares)
+            os.close(fd)
+            if created:
+                os.remove(self._lockfile)
+            _without_os_locks.add(directory)
+            return self._try_sentinel()
+        if got_lock:
+            try:
+                same_file = os.fstat(fd).st_ino == \
+                    os.stat(self._lockfile).st_ino
+            except FileNotFoundError:
+                same_file = False
+            if not same_file:
+                # the holder we waited on removed the lock file
+                _os_unlock(fd)
+                got_lock = False
+        if not got_lock:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, ('%s %d' % (_hostname(), os.getpid())).encode())
+        self._fd = fd
+        self._has_lock = True
+        return True
 
     def get_lock(self):
         """Acquire lock on target file. If the target file is already
-        locked, wait and try again."""
+        locked, retry with exponential backoff until the timeout."""
+        import random
+        _hostname()  # so that the lookup is not counted as waiting
+        start = time.monotonic()
+        deadline = start + self._timeout
+        process_lock = _process_lock(self._lockfile)
+        if not process_lock.acquire(timeout=self._timeout):
+            self.lock_wait = time.monotonic() - start
+            raise LockTimeout("Timed out waiting for lock on %s." %
+                              self._filepath)
+        delay = LockedFile.MIN_DELAY
         try:
-            # open for exclusive creation
-            with open(self._lockfile, 'x'):
-                pass
-            self._has_lock = True
-        except FileExistsError:
-            self.wait()
-            self.get_lock()
+            while not self._try_lock():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise LockTimeout("Timed out waiting for lock on %s." %
+                                      self._filepath)
+                time.sleep(min(random.uniform(0, delay), remaining))
+                delay = min(delay * 2, LockedFile.MAX_DELAY)
+        except BaseException:
+            process_lock.release()
+            raise
+        finally:
+            self.lock_wait = time.monotonic() - start
 
     def release_lock(self):
         """Release lock on target file."""
         if not self._has_lock:
             raise Exception("Foreign lock.")
-        os.remove(self._lockfile)
+        try:
+            self._release()
+        finally:
+            _process_lock(self._lockfile).release()
+
+    def _release(self):
         self._has_lock = False
+        if _removes_open_files:
+            # remove the lock file while still holding the lock; waiters
+            # notice that it is gone and start over
+            self._remove()
+            self._close()
+        else:
+            # unlock and close the file first; if a waiter locks it
+            # meanwhile, the removal fails and the file stays theirs
+            self._close()
+            self._remove()
+
+    def _remove(self):
+        try:
+            os.remove(self._lockfile)
+        except (PermissionError, FileNotFoundError):
+            pass
+
+    def _close(self):
+        if self._fd is not None:
+            _os_unlock(self._fd)
+            os.close(self._fd)
+            self._fd = None
 
     def write(self, content):
         self._file.write(content)
 
+    def writelines(self, lines):
+        self._file.writelines(lines)
+
     def __enter__(self):
         self.get_lock()
-        self._file = open(self._filepath, self._mode)
+        try:
+            if self._mode.startswith('w'):
+                self._file = open(self._scratchfile, self._mode,
+                                  newline=self._newline)
+            else:
+                self._file = open(self._filepath, self._mode,
+                                  newline=self._newline)
+        except BaseException:
+            self.release_lock()
+            raise
         return self
 
+    def _replace(self):
+        """Moves the scratch file over the target."""
+        if self._durability != 'dir':
+            os.replace(self._scratchfile, self._filepath)
+        elif RUNNING_WINDOWS:
+            import ctypes
+            # MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH
+            if not ctypes.windll.kernel32.MoveFileExW(
+                    self._scratchfile, self._filepath, 0x1 | 0x8):
+                raise ctypes.WinError()
+        else:
+            os.replace(self._scratchfile, self._filepath)
+            fd = os.open(os.path.dirname(os.path.abspath(self._filepath)),
+                         os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _commit(self, complete):
+        """Closes the scratch file and, if `complete`, replaces the
+        target with it; otherwise (or on failure) discards it."""
+        try:
+            if complete and self._durability != 'none':
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            self._file.close()
+            if complete:
+                self._replace()
+        except BaseException:
+            complete = False
+            raise
+        finally:
+            if not complete:
+                self._file.close()
+                try:
+                    os.remove(self._scratchfile)
+                except FileNotFoundError:
+                    pass
+
     def __exit__(self, exc_type, exc_value, traceback):
-        self._file.close()
-        self.release_lock()
-        
+        try:
+            if self._mode.startswith('w'):
+                start = time.perf_counter()
+                self._commit(exc_type is None)
+                self.commit_time = time.perf_counter() - start
+            else:
+                self._file.close()
+        finally:
+            self.release_lock()
+
+
+def data_path(name: str) -> str:
+    """Returns the default location of WfCfg's own file (or folder)
+    `name`: in %ProgramData%\\WfCfg on Windows, or in the temporary
+    directory (as wfcfg_`name`) elsewhere."""
+    if RUNNING_WINDOWS:
+        base = os.environ.get('ProgramData', 'C:\\ProgramData')
+        return os.path.join(base, 'WfCfg', name)
+    import tempfile
+    return os.path.join(tempfile.gettempdir(), 'wfcfg_' + name)
+
+def write_atomically(path: str, data: Union[str, bytes]) -> NoReturn:
+    """Replaces the file at `path` (creating its folder if needed) with
+    `data`, which is written in full beside it first, so that readers
+    never see a partial file. Text is written as UTF-8."""
+    import tempfile
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fo:
+            fo.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class JsonIndex:
+    # format version; files of another version are ignored
+    VERSION = 1
+    # the key holding the entries in the file
+    SECTION = 'entries'
+    # fingerprints remembered per entry; several GPO lines may apply
+    # different changes to the same files
+    MAX_FINGERPRINTS = 8
+
+    def __init__(self, path: str) -> "JsonIndex":
+        """
+        Create an index backed by the JSON file at `path`, holding a
+        value per entry (such as a file or profile) and change
+        fingerprint. The file is read on first use, and written by
+        save().
+        """
+        self._path = path
+        self._entries: Union[None, Dict[str, Dict[str, Any]]] = None
+        self._dirty: Set[str] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        import json
+        try:
+            with open(self._path, 'r') as fo:
+                data = json.load(fo)
+            if data.get('version') == self.VERSION:
+                return data[self.SECTION]
+        except (OSError, ValueError, KeyError, AttributeError):
+            # a missing or unreadable index is an empty index
+            pass
+        return {}
+
+    def _get(self, entry: str, fingerprint: str) -> Any:
+        """Returns the value recorded for `entry` with `fingerprint`, or
+        None."""
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._read()
+            return self._entries.get(entry, {}).get(fingerprint)
+
+    def _put(self, entry: str, fingerprint: str, value: Any) -> NoReturn:
+        """Records `value` for `entry` with `fingerprint`, forgetting
+        the oldest fingerprints of `entry` beyond MAX_FINGERPRINTS."""
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._read()
+            fingerprints = self._entries.setdefault(entry, {})
+            fingerprints.pop(fingerprint, None)
+            fingerprints[fingerprint] = value
+            while len(fingerprints) > self.MAX_FINGERPRINTS:
+                del fingerprints[next(iter(fingerprints))]
+            self._dirty.add(entry)
+
+    def save(self) -> NoReturn:
+        """Writes recorded values to the index file. Entries recorded by
+        other processes since the file was read are kept, except where
+        this index has recorded the same entry."""
+        import json
+        with self._lock:
+            if not self._dirty:
+                return None
+            entries = self._read()
+            for entry in self._dirty:
+                entries[entry] = self._entries[entry]
+            write_atomically(self._path, json.dumps(
+                {'version': self.VERSION, self.SECTION: entries}))
+            self._entries = entries
+            self._dirty.clear()
+
 
 def add_local_receipt_printer(rpConfigurator: "ReceiptPrinter",
                               *printer_names) -> NoReturn:
@@ -102,52 +513,109 @@ def local_printers_available(printers_sought: Union[None, Set[str]] =\
 
     If a set of printer names is provided, returns the intersection of 
     the provided set and names of locally installed printers (i.e., 
-    keys in HKML\SYSTEM\CurrentControlSet\Control\Print\Printers).
+    keys in HKML\\SYSTEM\\CurrentControlSet\\Control\\Print\\Printers).
+    """
+    from . import profiling
+    with profiling.phase('printer lookup'):
+        return _local_printers_available(printers_sought)
+
+def _local_printers_available(printers_sought: Union[None, Set[str]] =\
+                              None) -> Set[str]:
     """
-    if not RUNNING_WINDOWS:
-        raise NotImplementedError
-    
+    Returns a set of names of locally installed printers.
+
+    If a set of printer names is provided, returns the intersection of 
+    the provided set and names of locally installed printers, matched
+    regardless of case. Printers are listed once per process by the
+    printer inventory (see lib.printers).
+    """
+    from .printers import inventory
+    if printers_sought is None:
+        return inventory().names()
     print("Looking for printers:", printers_sought)
-    printers_sought = set(map(str.lower, printers_sought))
-    printers_found = set()
+    printers_found = inventory().find(printers_sought)
+    for printer in sorted(printers_found):
+        print("Found printer:", printer)
+    return printers_found
 
-    key_path = r'SYSTEM\CurrentControlSet\Control\Print\Printers'
-    with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, key_path) as printers:
-        i = 0
-        while True:
+# user profiles that never run Workflows, skipped on request; see
+# iter_sirsi_dirs(). 'Default', the template new profiles are copied
+# from, is not one of them: settings written there reach new users.
+SYSTEM_PROFILES = ('Public', 'Default User', 'All Users', 'defaultuser*',
+                   'WDAGUtilityAccount')
+MAIN_SIRSI_DIR = 'C:\\Program Files (x86)\\Sirsi\\JWF\\'
+USERS_DIR = 'C:\\Users'
+
+def _scan_profiles(users_dir: str, exclude: Iterable[str]) -> \
+        Generator[Tuple[str, Union[None, float]], None, None]:
+    """Yields a (path, mtime) tuple for each user profile's Sirsi
+    Workflows folder in `users_dir`, where mtime is the modification
+    time of its Property folder (None if there is no Property folder).
+    Profiles matching any of the `exclude` patterns are skipped."""
+    from fnmatch import fnmatch
+    patterns = [pattern.lower() for pattern in exclude]
+    with os.scandir(users_dir) as profiles:
+        for profile in profiles:
+            name = profile.name.lower()
+            if any(fnmatch(name, pattern) for pattern in patterns):
+                continue
+            if not profile.is_dir():
+                continue
+            path = os.path.join(profile.path, 'Sirsi', 'Workflows')
+            mtime = None
             try:
-                printer = winreg.EnumKey(printers, i)
-                # if we're looking for all printers, add this one
-                # to results
-                if printers_sought is None:
-                    printers_found.add(printer)
-                # if we're looking for specific printers, check
-                # what we've found against that set
-                else:
-                    if printer.lower() in printers_sought:
-                        print("Found printer:", printer)
-                        printers_found.add(printer)                        
-                i += 1
-            except OSError:
-                # no more printers
-                break
-    return printers_found
+                # DirEntry caches stat results (and on Windows gets them
+                # with the directory listing), so this is the only call
+                # made per profile
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.name == 'Property' and entry.is_dir():
+                            mtime = entry.stat().st_mtime
+                            break
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+            yield path, mtime
+
+def iter_sirsi_dirs(users_dir: str = USERS_DIR,
+                    main_dir: Union[None, str] = None,
+                    max_age_days: Union[None, float] = None,
+                    exclude: Iterable[str] = (),
+                    limit: Union[None, int] = None) -> Iterator[str]:
+    """
+    Lazily yields `main_dir` (if provided) and then the
+    <users_dir>\\*\\Sirsi\\Workflows\\ folders, as they are found.
 
-def get_sirsi_dirs() -> Set[str]:
+    Profiles whose Property folder has not been modified in
+    `max_age_days` days (or that have no Property folder) are skipped,
+    as are profiles whose names match one of the `exclude` patterns
+    (shell-style, case-insensitive), such as SYSTEM_PROFILES. If
+    `limit` is provided, only the `limit` most recently used profiles
+    are yielded; every profile must then be examined before the first
+    is yielded.
+    """
+    if main_dir is not None:
+        yield main_dir
+    profiles = _scan_profiles(users_dir, exclude)
+    if max_age_days is not None:
+        cutoff = time.time() - max_age_days * 86400
+        profiles = ((path, mtime) for path, mtime in profiles
+                    if mtime is not None and mtime >= cutoff)
+    if limit is not None:
+        import heapq
+        profiles = heapq.nlargest(limit, profiles,
+                                  key=lambda profile: profile[1] or 0)
+    for path, mtime in profiles:
+        yield path
+
+def get_sirsi_dirs(**options) -> Set[str]:
     """
     Returns a set containing C:\\Program Files (x86)\\Sirsi\\JWF\\ and
-    C:\\Users\\*\\Sirsi\\Workflows\\ folders.
+    C:\\Users\\*\\Sirsi\\Workflows\\ folders. Keyword options
+    (max_age_days, exclude, limit) are passed to iter_sirsi_dirs().
     """
     if not RUNNING_WINDOWS: # presumably testing from Linux
         raise NotImplementedError("Directory must be specified.")
-
-    main_sirsi_dir = 'C:\\Program Files (x86)\\Sirsi\JWF\\'
-    sirsi_dirs = set([main_sirsi_dir])
-    for username in os.listdir('C:\\Users'):
-        path = os.path.join('C:\\Users', username, 'Sirsi', 'Workflows')
-        if os.path.isdir(path):
-            sirsi_dirs.add(path)
-    return sirsi_dirs
+    return set(iter_sirsi_dirs(USERS_DIR, MAIN_SIRSI_DIR, **options))
 
 def _make_file(fpath):
     try:
@@ -159,27 +627,37 @@ def _make_file(fpath):
             pass      
 
 def get_property_files(filename: str, sirsi_dirs: Union[None, Set[str]] = None,
-                       create_as_needed = False) -> Set[str]:
+                       create_as_needed = False, **options) -> Set[str]:
     """
     Returns a set of paths to files located in Workflows' "Property"
     folder. Target directories containing "Property" folder can be
     provided as a set of paths (string format); if no set is provided,
-    then one will be generated with get_sirsi_dirs() function.
+    then one will be generated with get_sirsi_dirs() function, to which
+    any keyword options are passed.
     """
     if sirsi_dirs is None:
-        sirsi_dirs = get_sirsi_dirs()
+        sirsi_dirs = get_sirsi_dirs(**options)
     if not isinstance(sirsi_dirs, set):
         raise TypeError("sirsi_dirs must be a set")
-    pref_files = set()
+    property_files = set()
     for sirsi_dir in sirsi_dirs:
         property_dir = os.path.join(sirsi_dir, 'Property')
         fpath = os.path.join(property_dir, filename)
         if create_as_needed:
             _make_file(fpath)
         if os.path.isfile(fpath):
-            pref_files.add(fpath)
-    return pref_files
+            property_files.add(fpath)
+    return property_files
+
+_discovered = {}
 
-if RUNNING_WINDOWS:
-    preference_files = get_property_files('preference')
-    font_files = get_property_files('font')
+def __getattr__(name: str) -> Set[str]:
+    """Discovers `preference_files` and `font_files` on first access
+    rather than at import time, so that commands that never touch a
+    file type do not pay for listing every user profile."""
+    filenames = {'preference_files': 'preference', 'font_files': 'font'}
+    if not RUNNING_WINDOWS or name not in filenames:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    if name not in _discovered:
+        _discovered[name] = get_property_files(filenames[name])
+    return _discovered[name]
@@ -0,0 +1,274 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# By: Jason Ferrell, Sep. 2023
+# https://github.com/jgferrell/
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+"""Declarative policy files: a department's whole Workflows
+configuration in one TOML or JSON file, compiled into an execution
+plan that is cached next to the policy."""
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+from typing import NoReturn, Any, Set, Tuple, List, Union, Dict
+import json, os
+from .configurator import Configurator
+from .font import FontConfigurator, gui_components, gui_component_styles
+from .paper import Paper
+from .os import write_atomically
+from .receipt_printer import ReceiptPrinter
+PLANFILE = '.wfcfg_plan~'
+PLAN_VERSION = 2
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+# sections and options recognized in a policy file
+policy_schema = {
+    'main': {'update', 'delete', 'find_printer', 'add_printer',
+             'tabbed_windows'},
+    'paper': {'margins', 'units', 'orientation', 'size'},
+    'font': None,  # table of GUI component (or ALL) to font
+    'receipt_printer': {'find', 'add', 'remove', 'font_type', 'font_size',
+                        'font_style', 'paper_margins', 'paper_units',
+                        'paper_width'},
+}
+
+def _read_policy_file(path: str) -> Dict[str, Any]:
+    """Returns the content of a single TOML or JSON policy file."""
+    if path.lower().endswith('.json'):
+        with open(path, 'r') as fo:
+            policy = json.load(fo)
+    else:
+        try:
+            import tomllib
+        except ImportError:  # Python < 3.11
+            raise ValueError("Reading %s requires Python 3.11 or later; "
+                             "use a JSON policy instead." % path)
+        with open(path, 'rb') as fo:
+            policy = tomllib.load(fo)
+    if not isinstance(policy, dict):
+        raise ValueError("%s does not contain a policy table." % path)
+    return policy
+
+def _overlay(base: Dict[str, Any], top: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns `base` overlaid with `top`: tables are merged key by key,
+    'delete' lists are combined, and other values in `top` replace
+    those in `base`. A key updated in one layer and deleted in the other
+    is only kept by `top`'s 'update' or 'delete'."""
+    merged = dict(base)
+    if isinstance(top.get('delete'), list) and \
+       isinstance(base.get('update'), dict):
+        merged['update'] = {k: v for k, v in base['update'].items()
+                            if k not in top['delete']}
+    if isinstance(top.get('update'), dict) and \
+       isinstance(base.get('delete'), list):
+        merged['delete'] = [k for k in base['delete']
+                            if k not in top['update']]
+    for key, value in top.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _overlay(merged[key], value)
+        elif key == 'delete' and isinstance(merged.get(key), list):
+            merged[key] = merged[key] + [v for v in value
+                                         if v not in merged[key]]
+        else:
+            merged[key] = value
+    return merged
+
+def load_policy(path: str, _seen: Union[None, List[str]] = None) -> \
+        Tuple[Dict[str, Any], List[str]]:
+    """
+    Returns a (policy, sources) tuple for the policy file at `path`.
+    Files named by its 'include' list (relative to the including file)
+    are read first, and the including file is overlaid on them, so an
+    OU policy can include and then refine an organization-wide policy.
+    `sources` lists every file read.
+    """
+    path = os.path.abspath(path)
+    _seen = [] if _seen is None else _seen
+    if path in _seen:
+        raise ValueError("Policy %s includes itself." % path)
+    _seen.append(path)
+    policy = _read_policy_file(path)
+    includes = policy.pop('include', [])
+    if isinstance(includes, str):
+        includes = [includes]
+    merged, sources = {}, []
+    for include in includes:
+        include = os.path.join(os.path.dirname(path), include)
+        included, included_sources = load_policy(include, _seen)
+        merged = _overlay(merged, included)
+        sources += included_sources
+    _seen.pop()
+    return _overlay(merged, policy), sources + [path]
+
+def _margins(value: Any) -> Union[float, List[float]]:
+    if isinstance(value, list) and len(value) == 1:
+        value = value[0]
+    if isinstance(value, list) and len(value) != 4:
+        raise ValueError("Bad number of values supplied.")
+    return value
+
+def compile_policy(policy: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validates a policy and returns its execution plan: the key/value
+    updates and deletions for the preference and font files, plus the
+    printer names to look up on each machine when the plan is applied.
+    Raises ValueError or TypeError for an invalid policy.
+    """
+    for section, value in policy.items():
+        if section not in policy_schema:
+            raise ValueError("Unknown policy section '%s'." % section)
+        if not isinstance(value, dict):
+            raise ValueError("Policy section '%s' must be a table." % section)
+        options = policy_schema[section]
+        unknown = set() if options is None else set(value) - options
+        if unknown:
+            raise ValueError("Unknown option(s) in '%s': %s" %
+                             (section, ', '.join(sorted(unknown))))
+
+    main = Configurator(set())
+    section = policy.get('main', {})
+    for key, value in section.get('update', {}).items():
+        main.update(key, str(value))
+    for key in section.get('delete', []):
+        main.delete(key)
+    if 'add_printer' in section:
+        main.update('peripherals.screen.printer', section['add_printer'])
+    if section.get('tabbed_windows'):
+        main.update('desktop.multiple_windows', 'Y')
+        main.update('desktop.tabbed_windows', 'Y')
+        main.update('desktop.tabbed_window_bottom', 'N')
+
+    paper = Paper()
+    section = policy.get('paper', {})
+    if 'margins' in section:
+        paper.margins = _margins(section['margins'])
+    for option, attribute in [('units', 'units'), ('size', 'size'),
+                              ('orientation', 'orientation')]:
+        if option in section:
+            setattr(paper, attribute, section[option])
+    main.batch_update(paper.settings)
+
+    receipt = ReceiptPrinter(set())
+    section = policy.get('receipt_printer', {})
+    if sum(option in section for option in ['find', 'add', 'remove']) > 1:
+        raise ValueError("Only one of find, add, or remove is allowed "
+                         "for the receipt printer.")
+    if 'add' in section:
+        receipt.add(section['add'])
+    if section.get('remove'):
+        receipt.disable()
+    if 'paper_units' in section:
+        receipt.paper.units = section['paper_units']
+    if 'paper_width' in section:
+        receipt.paper.width = section['paper_width']
+    if 'paper_margins' in section:
+        receipt.paper.margins = _margins(section['paper_margins'])
+    if 'font_size' in section:
+        receipt.font.size = section['font_size']
+    if 'font_type' in section:
+        receipt.font.name = section['font_type']
+    if 'font_style' in section:
+        receipt.font.style = section['font_style']
+
+    font = FontConfigurator(set())
+    for component, spec in policy.get('font', {}).items():
+        if component != 'ALL' and component not in gui_components:
+            raise ValueError("Unknown GUI component '%s'." % component)
+        if not isinstance(spec, dict) or \
+           set(spec) != {'type', 'size', 'style'}:
+            raise ValueError("Font for '%s' needs type, size, and style."
+                             % component)
+        if spec['style'] not in gui_component_styles:
+            raise ValueError("Font style must be one of: %s" %
+                             ', '.join(gui_component_styles))
+        if not isinstance(spec['size'], int):
+            raise TypeError("Font size for '%s' must be an integer."
+                            % component)
+        font.update(component, spec['type'], spec['style'], spec['size'])
+
+    pairs = lambda items: [[key, value] for key, value in items]
+    return {
+        'main': {'update': pairs(main._update_items.items()),
+                 'delete': sorted(main._delete_items),
+                 'find_printer': list(policy.get('main', {})
+                                      .get('find_printer', []))},
+        'receipt_printer': {'update': pairs(receipt.settings),
+                            'find': list(policy.get('receipt_printer', {})
+                                         .get('find', []))},
+        'font': {'update': pairs(font._update_items.items())},
+    }
+
+def _plan_path(path: str) -> str:
+    return os.path.abspath(path) + PLANFILE
+
+def _mtimes(sources: List[str]) -> List[List[Union[str, int]]]:
+    return [[source, os.stat(source).st_mtime_ns] for source in sources]
+
+def _read_cached_plan(path: str) -> \
+        Union[None, Tuple[Dict[str, Any], List[str]]]:
+    try:
+        with open(_plan_path(path), 'r') as fo:
+            cached = json.load(fo)
+        sources = [s for s, _ in cached['sources']]
+        if cached['version'] == PLAN_VERSION and \
+           _mtimes(sources) == cached['sources']:
+            return cached['plan'], sources
+    except (OSError, ValueError, KeyError, TypeError):
+        # missing, unreadable, or stale
+        pass
+    return None
+
+def _write_cached_plan(path: str, sources: List[str],
+                       plan: Dict[str, Any]) -> NoReturn:
+    try:
+        write_atomically(_plan_path(path), json.dumps(
+            {'version': PLAN_VERSION, 'sources': _mtimes(sources),
+             'plan': plan}))
+    except OSError:
+        # e.g., a read-only share; the plan is simply not cached
+        pass
+
+def load_plan_sources(path: str, use_cache: bool = True) -> \
+        Tuple[Dict[str, Any], List[str]]:
+    """Returns a (plan, sources) tuple: the execution plan for the
+    policy file at `path`, and every file it was compiled from. A plan
+    cached next to the policy is used as long as the policy and the
+    files it includes have not been modified since it was compiled."""
+    if use_cache:
+        cached = _read_cached_plan(path)
+        if cached is not None:
+            return cached
+    policy, sources = load_policy(path)
+    plan = compile_policy(policy)
+    if use_cache:
+        _write_cached_plan(path, sources, plan)
+    return plan, sources
+
+def load_plan(path: str, use_cache: bool = True) -> Dict[str, Any]:
+    """Returns the execution plan for the policy file at `path`; see
+    load_plan_sources()."""
+    return load_plan_sources(path, use_cache)[0]
+
+def stage_plan(plan: Dict[str, Any], session: "ApplySession",
+               pref_files: Set[str], font_files: Set[str]) -> NoReturn:
+    """Adds the changes of an execution plan to an ApplySession,
+    looking up printers named in the plan on this machine."""
+    from .os import add_local_receipt_printer, local_printers_available
+    main = Configurator(pref_files)
+    main.batch_update(plan['main']['update'])
+    for key in plan['main']['delete']:
+        main.delete(key)
+    if plan['main']['find_printer']:
+        printers = local_printers_available(set(plan['main']['find_printer']))
+        if printers:
+            main.update('peripherals.screen.printer', printers.pop())
+    session.add(main)
+
+    receipt = ReceiptPrinter(pref_files)
+    receipt.batch_update(plan['receipt_printer']['update'])
+    if plan['receipt_printer']['find']:
+        add_local_receipt_printer(receipt, *plan['receipt_printer']['find'])
+    session.add(receipt)
+
+    font = FontConfigurator(font_files)
+    # the plan holds formatted font values
+    font.batch_update(plan['font']['update'])
+    session.add(font)
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# By: Jason Ferrell, Sep. 2023
+# https://github.com/jgferrell/
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+"""An indexed, lossless model of a Sirsi Workflows configuration
+file."""
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+from typing import NoReturn, Any, Set, Tuple, List, Union, Dict, \
+    Iterable, Iterator
+import os, threading
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+def line_ending(line: str) -> str:
+    """Returns the line ending ('\\r\\n', '\\n', '\\r', or '') of `line`."""
+    return line[len(line.rstrip('\r\n')):]
+
+
+def codec_type(codec: "Configurator") -> type:
+    """Returns the class that defines how `codec` parses lines; codecs of
+    the same codec type read and write files the same way."""
+    for cls in type(codec).__mro__:
+        if 'config_line_processor' in vars(cls):
+            return cls
+    return type(codec)
+
+
+class PreferenceFile:
+    def __init__(self, lines: Iterable[str], codec: "Configurator") -> \
+            "PreferenceFile":
+        """
+        Create a model of a configuration file from its `lines`, which
+        must include their line endings. Lines are parsed with the
+        config_line_processor and written with the config_line_formatter
+        of `codec` (a Configurator or subclass). Lines are kept exactly
+        as read, including blank lines and comments, and only the lines
+        for keys that are set or deleted are ever rewritten.
+        """
+        self._codec = codec
+        self._lines: List[Union[None, str]] = []  # None marks deleted lines
+        self._index: Dict[str, List[int]] = {}
+        self._eol = None
+        self._modified = False
+        for line in lines:
+            self._add_line(line)
+        if self._eol is None:
+            self._eol = os.linesep
+
+    @classmethod
+    def load(cls, path: str, codec: "Configurator") -> "PreferenceFile":
+        """Returns a PreferenceFile for the file at `path`."""
+        with open(path, newline='') as fo:
+            return cls(fo, codec)
+
+    def _add_line(self, line: str) -> NoReturn:
+        if self._eol is None and line_ending(line):
+            self._eol = line_ending(line)
+        entry = self._codec.config_line_processor(line)
+        if entry is not None:
+            self._index.setdefault(entry[0], []).append(len(self._lines))
+        self._lines.append(line)
+
+    def _value_at(self, i: int) -> str:
+        return self._codec.config_line_processor(self._lines[i])[1]
+
+    def copy(self) -> "PreferenceFile":
+        """Returns an unmodified copy of this PreferenceFile in its
+        current state."""
+        other = PreferenceFile.__new__(PreferenceFile)
+        other._codec = self._codec
+        other._lines = list(self._lines)
+        other._index = {key: list(i) for key, i in self._index.items()}
+        other._eol = self._eol
+        other._modified = False
+        return other
+
+    @property
+    def modified(self) -> bool:
+        """True if any key has been set or deleted since loading."""
+        return self._modified
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get(self, key: str, default: Any = None) -> Union[Any, str]:
+        """Returns the value of `key`. If `key` occurs more than once,
+        the value of the last occurrence (the one Workflows uses) is
+        returned."""
+        if key not in self._index:
+            return default
+        return self._value_at(self._index[key][-1])
+
+    def get_all(self, key: str) -> List[str]:
+        """Returns the values of every occurrence of `key`, in file
+        order."""
+        return [self._value_at(i) for i in self._index.get(key, [])]
+
+    def keys(self) -> Iterator[str]:
+        """Yields keys in order of their first occurrence."""
+        return iter(self._index)
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        """Yields (key, value) pairs in order of first occurrence."""
+        for key in self._index:
+            yield key, self.get(key)
+
+    def duplicates(self) -> Dict[str, int]:
+        """Returns the number of occurrences of each key that occurs
+        more than once."""
+        return {key: len(i) for key, i in self._index.items() if len(i) > 1}
+
+    def set(self, key: str, value: str) -> NoReturn:
+        """Sets every occurrence of `key` to `value`, or appends `key` if
+        it is not present. Lines already holding `value` are untouched."""
+        if key not in self._index:
+            self._append(key, value)
+            return None
+        for i in self._index[key]:
+            if self._value_at(i) != value:
+                line = self._codec.config_line_formatter(key, value)
+                self._lines[i] = line + line_ending(self._lines[i])
+                self._modified = True
+
+    def _append(self, key: str, value: str) -> NoReturn:
+        # make sure the current last line is terminated
+        for i in range(len(self._lines) - 1, -1, -1):
+            if self._lines[i] is not None:
+                if not line_ending(self._lines[i]):
+                    self._lines[i] += self._eol
+                break
+        line = self._codec.config_line_formatter(key, value) + self._eol
+        self._index[key] = [len(self._lines)]
+        self._lines.append(line)
+        self._modified = True
+
+    def delete(self, key: str) -> bool:
+        """Deletes every occurrence of `key`. Returns True if `key` was
+        present."""
+        if key not in self._index:
+            return False
+        for i in self._index.pop(key):
+            self._lines[i] = None
+        self._modified = True
+        return True
+
+    def lines(self) -> Iterator[str]:
+        """Yields the current lines of the file, with line endings."""
+        return (line for line in self._lines if line is not None)
+
+    def __str__(self) -> str:
+        return ''.join(self.lines())
+
+
+class ParseCache:
+    def __init__(self) -> "ParseCache":
+        """
+        A thread-safe cache of parsed configuration files, keyed by path
+        and codec. An entry is reused only while the file's modification
+        time and size are the same as when it was parsed.
+        """
+        self._entries: Dict[Tuple[str, type], Tuple[Tuple[int, int],
+                                                    "PreferenceFile"]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stat(path: str) -> Tuple[int, int]:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+
+    def get(self, path: str, codec: "Configurator") -> \
+            Tuple[Tuple[int, int], "PreferenceFile"]:
+        """Returns a (stat, PreferenceFile) tuple for `path`, where `stat`
+        is the (mtime, size) of the file that was parsed. The
+        PreferenceFile is a private copy that the caller may modify."""
+        key = (path, codec_type(codec))
+        stat = self._stat(path)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[0] != stat:
+            preferences = PreferenceFile.load(path, codec)
+            # the file may have changed while it was read
+            if self._stat(path) == stat:
+                with self._lock:
+                    self._entries[key] = (stat, preferences.copy())
+            return stat, preferences
+        return stat, entry[1].copy()
+
+    def put(self, path: str, preferences: "PreferenceFile") -> NoReturn:
+        """Caches `preferences` as the current content of `path`."""
+        stat = self._stat(path)
+        with self._lock:
+            self._entries[(path, codec_type(preferences._codec))] = \
+                (stat, preferences.copy())
+
+    def forget(self, path: str) -> NoReturn:
+        """Drops every cached entry for `path`."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == path]:
+                del self._entries[key]
@@ -0,0 +1,174 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# By: Jason Ferrell, Sep. 2023
+# https://github.com/jgferrell/
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+"""The printers installed on this machine, listed once per process
+(and optionally cached on disk for a short while) and indexed by
+lowercase name."""
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+from typing import NoReturn, Any, Set, Tuple, List, Union, Dict, Iterable
+import json, os, time
+from .os import data_path, write_atomically
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+# seconds a cached printer list is trusted
+DEFAULT_TTL = 60.0
+
+def default_cache_path() -> str:
+    """Returns the default location of the printer cache."""
+    return data_path('printers.json')
+
+
+class RegistryProvider:
+    KEY_PATH = r'SYSTEM\CurrentControlSet\Control\Print\Printers'
+
+    @property
+    def source(self) -> str:
+        """Identifies where the names come from, for the cache."""
+        return 'registry'
+
+    def names(self) -> List[str]:
+        """Returns the names of the printers installed on this machine
+        (i.e., keys in HKLM\\SYSTEM\\CurrentControlSet\\Control\\Print\\
+        Printers)."""
+        if os.name != 'nt':
+            raise NotImplementedError
+        import winreg
+        names = []
+        with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE,
+                            RegistryProvider.KEY_PATH) as printers:
+            # the number of subkeys is known up front, so there is no
+            # need to enumerate until EnumKey fails
+            for i in range(winreg.QueryInfoKey(printers)[0]):
+                names.append(winreg.EnumKey(printers, i))
+        return names
+
+
+class StaticProvider:
+    def __init__(self, names: Iterable[str]) -> "StaticProvider":
+        """Provide a fixed list of printer names, e.g. for tests."""
+        self._names = list(names)
+
+    @property
+    def source(self) -> str:
+        return 'static'
+
+    def names(self) -> List[str]:
+        return list(self._names)
+
+
+class JsonProvider:
+    def __init__(self, path: str) -> "JsonProvider":
+        """Provide the printer names listed in the JSON file at `path`
+        (a list of strings), so that printer lookups can be tested and
+        benchmarked without Windows."""
+        self.path = path
+
+    @property
+    def source(self) -> str:
+        return 'json:' + os.path.abspath(self.path)
+
+    def names(self) -> List[str]:
+        with open(self.path, 'r') as fo:
+            names = json.load(fo)
+        if not isinstance(names, list) or \
+           not all(isinstance(name, str) for name in names):
+            raise ValueError("%s does not contain a list of printer names."
+                             % self.path)
+        return names
+
+
+class PrinterInventory:
+    def __init__(self, provider: Any = None,
+                 cache_path: Union[None, str] = None,
+                 ttl: float = DEFAULT_TTL) -> "PrinterInventory":
+        """
+        Create an inventory of the printers listed by `provider` (by
+        default, a RegistryProvider). Printers are listed the first
+        time they are needed and then indexed by lowercase name. If
+        `cache_path` is provided, the list is also saved there, and a
+        list saved by any process within the last `ttl` seconds is used
+        instead of asking the provider again.
+        """
+        self.provider = RegistryProvider() if provider is None else provider
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self._index: Union[None, Dict[str, str]] = None
+
+    def _read_cache(self) -> Union[None, List[str]]:
+        try:
+            with open(self.cache_path, 'r') as fo:
+                cached = json.load(fo)
+            if cached['source'] == self.provider.source and \
+               0 <= time.time() - cached['time'] <= self.ttl:
+                return cached['printers']
+        except (OSError, ValueError, KeyError, TypeError):
+            # missing, unreadable, or stale
+            pass
+        return None
+
+    def _write_cache(self, names: List[str]) -> NoReturn:
+        try:
+            write_atomically(self.cache_path, json.dumps(
+                {'source': self.provider.source, 'time': time.time(),
+                 'printers': names}))
+        except OSError:
+            # the list is simply not cached
+            pass
+
+    @property
+    def index(self) -> Dict[str, str]:
+        """Installed printer names, keyed by their lowercase form."""
+        if self._index is None:
+            names = None
+            if self.cache_path is not None:
+                names = self._read_cache()
+            if names is None:
+                names = self.provider.names()
+                if self.cache_path is not None:
+                    self._write_cache(names)
+            self._index = {name.lower(): name for name in names}
+        return self._index
+
+    def names(self) -> Set[str]:
+        """Returns the names of all installed printers."""
+        return set(self.index.values())
+
+    def find(self, printers_sought: Iterable[str]) -> Set[str]:
+        """Returns the installed printers among `printers_sought`,
+        matched regardless of case, as named on this machine."""
+        index = self.index
+        return {index[name.lower()] for name in printers_sought
+                if name.lower() in index}
+
+    def refresh(self) -> NoReturn:
+        """Forgets the printers listed so far; they are listed again
+        (ignoring the cache) when next needed."""
+        self._index = None
+        if self.cache_path is not None:
+            try:
+                os.remove(self.cache_path)
+            except OSError:
+                pass
+
+
+# the inventory used by this process; see inventory() and configure()
+_inventory = None
+
+def inventory() -> "PrinterInventory":
+    """Returns this process's PrinterInventory, creating one that reads
+    the registry (without a disk cache) if none has been configured."""
+    global _inventory
+    if _inventory is None:
+        _inventory = PrinterInventory()
+    return _inventory
+
+def configure(provider: Any = None, cache_path: Union[None, str] = None,
+              ttl: float = DEFAULT_TTL) -> "PrinterInventory":
+    """Replaces this process's PrinterInventory with a new one; see
+    PrinterInventory for the arguments. Returns the new inventory."""
+    global _inventory
+    _inventory = PrinterInventory(provider, cache_path, ttl)
+    return _inventory
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# By: Jason Ferrell, Sep. 2023
+# https://github.com/jgferrell/
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+"""Per-phase and per-file timings of a run, for finding out why a
+run is slow on a particular machine."""
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+from typing import NoReturn, Any, Set, Tuple, List, Union, Dict, Iterable, \
+    Iterator, Callable
+import os, threading, time
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+# the Profile being recorded, if any; code that records timings checks
+# for None first, so that runs without --profile pay nothing
+active = None
+
+# phases reported, in order
+phases = ['discovery', 'printer lookup', 'read', 'parse', 'transform',
+          'lock wait', 'write']
+
+def default_dump_dir() -> str:
+    """Returns the folder holding wfcfg.log (see wfcfg.bat), where
+    cProfile and tracemalloc output is written by default."""
+    if os.name == 'nt':
+        return os.path.join(os.environ.get('windir', 'C:\\Windows'), 'temp')
+    import tempfile
+    return tempfile.gettempdir()
+
+
+class Profile:
+    def __init__(self) -> "Profile":
+        """
+        Create an empty profile. Wall time is accumulated per phase
+        (see `phases`) and, for phases spent on a subject file, per
+        file, along with the bytes read from and written to each file.
+        Timings from worker threads are added together, so phase totals
+        can exceed the wall time of a run made with several workers.
+        """
+        self.phases: Dict[str, float] = {}
+        self.files: Dict[str, Dict[str, float]] = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+
+    def add(self, phase: str, seconds: float,
+            path: Union[None, str] = None) -> NoReturn:
+        """Adds `seconds` to `phase`, and to `phase` of `path` if given."""
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+            if path is not None:
+                timings = self.files.setdefault(path, {})
+                timings[phase] = timings.get(phase, 0.0) + seconds
+
+    def add_bytes(self, path: str, read: int = 0,
+                  written: int = 0) -> NoReturn:
+        with self._lock:
+            self.bytes_read += read
+            self.bytes_written += written
+            timings = self.files.setdefault(path, {})
+            timings['bytes read'] = timings.get('bytes read', 0) + read
+            timings['bytes written'] = \
+                timings.get('bytes written', 0) + written
+
+    def phase(self, phase: str, path: Union[None, str] = None) -> "_Timer":
+        """Returns a context manager adding the time spent in its block
+        to `phase` (and to `path`, if given)."""
+        return _Timer(self, phase, path)
+
+    def timed_lines(self, lines: Iterable[str], path: str) -> Iterator[str]:
+        """Yields from `lines`, a file being read, adding the time spent
+        waiting for each line to the 'read' phase of `path`."""
+        lines = iter(lines)
+        clock = time.perf_counter
+        spent = 0.0
+        try:
+            while True:
+                start = clock()
+                try:
+                    line = next(lines)
+                except StopIteration:
+                    return
+                finally:
+                    spent += clock() - start
+                yield line
+        finally:
+            self.add('read', spent, path)
+
+    def timed(self, func: Callable, phase: str, path: str) -> Callable:
+        """Returns `func` wrapped to add the time spent in it to `phase`
+        of `path`. Time is added once the wrapper's `flush` is called."""
+        clock = time.perf_counter
+        spent = [0.0]
+        def wrapper(*args):
+            start = clock()
+            try:
+                return func(*args)
+            finally:
+                spent[0] += clock() - start
+        def flush():
+            self.add(phase, spent[0], path)
+            spent[0] = 0.0
+        wrapper.flush = flush
+        return wrapper
+
+    def per_file(self, apply: Callable[[str], Any]) -> Callable[[str], Any]:
+        """Returns `apply`, a function processing one subject file,
+        wrapped to add the time it takes that is not recorded as another
+        phase to the 'transform' phase of the file."""
+        clock = time.perf_counter
+        def wrapper(path):
+            start = clock()
+            try:
+                return apply(path)
+            finally:
+                elapsed = clock() - start
+                with self._lock:
+                    recorded = sum(seconds for phase, seconds in
+                                   self.files.get(path, {}).items()
+                                   if phase in phases)
+                self.add('transform', max(0.0, elapsed - recorded), path)
+        return wrapper
+
+    def report(self, slowest: int = 10) -> str:
+        """Returns a summary: the time spent in each phase, the bytes
+        read and written, and the `slowest` files by total time."""
+        lines = ['Profile:']
+        for phase in phases + sorted(set(self.phases) - set(phases)):
+            if phase in self.phases:
+                lines.append('  %-15s %9.3fs' % (phase, self.phases[phase]))
+        lines.append('  %d bytes read, %d bytes written' %
+                     (self.bytes_read, self.bytes_written))
+        total = lambda timings: sum(seconds for phase, seconds in
+                                    timings.items() if not
+                                    phase.startswith('bytes'))
+        ranked = sorted(self.files.items(), key=lambda f: total(f[1]),
+                        reverse=True)[:slowest]
+        if ranked:
+            lines.append('  Slowest files:')
+        for path, timings in ranked:
+            detail = ', '.join('%s %.3fs' % (phase, timings[phase])
+                               for phase in phases if phase in timings)
+            lines.append('  %9.3fs %s (%s)' % (total(timings), path, detail))
+        return '\n'.join(lines)
+
+
+class _Timer:
+    def __init__(self, profile: Profile, phase: str,
+                 path: Union[None, str]) -> "_Timer":
+        self._profile, self._phase, self._path = profile, phase, path
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed = time.perf_counter() - self._start
+        self._profile.add(self._phase, self.elapsed, self._path)
+
+
+class _NullTimer:
+    """Stands in for _Timer when nothing is being profiled."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_null_timer = _NullTimer()
+
+def phase(name: str, path: Union[None, str] = None) -> "_Timer":
+    """Times a block as `name` in the active profile, if any."""
+    if active is None:
+        return _null_timer
+    return active.phase(name, path)
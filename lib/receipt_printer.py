@@ -49,10 +49,10 @@ class ReceiptFont(CfgSetting):
     
     def __init__(self) -> object:
         """An object to store font data. Defaults to 11pt Verdana Bold."""
+        super().__init__(str)
         self._name='Verdana'
         self._style='1'
         self._size='11'
-        self._modified = False
         
     @property
     def modified(self) -> bool:
@@ -65,7 +65,7 @@ class ReceiptFont(CfgSetting):
         return self._name
     @name.setter
     def name(self, new_name: str) -> NoReturn:
-        self._modified = True
+        self._mark_modified()
         self._name = new_name
 
     @property
@@ -74,7 +74,7 @@ class ReceiptFont(CfgSetting):
         return self._size
     @size.setter
     def size(self, new_size: int) -> NoReturn:
-        self._modified = True
+        self._mark_modified()
         self._size = new_size
 
     @property
@@ -92,23 +92,23 @@ class ReceiptFont(CfgSetting):
             raise ValueError("Value '%s' is not a valid style. "
                              "Valid styles are: " +\
                              ', '.join([k for k in available_styles]))
-        self._modified = True
+        self._mark_modified()
         self._style = available_styles[new_style]
 
 
     def make_regular(self) -> NoReturn:
         """Sets the font to regular style."""
-        self._modified = True
+        self._mark_modified()
         self.style = 'regular'
 
     def make_bold(self) -> NoReturn:
         """Sets the font to bold style."""
-        self._modified = True
+        self._mark_modified()
         self.style = 'bold'
 
     def make_italic(self) -> NoReturn:
         """Sets the font to italic style."""
-        self._modified = True
+        self._mark_modified()
         self.style = 'italic'
 
     @property
@@ -122,8 +122,8 @@ class ReceiptFont(CfgSetting):
 
         
 class ReceiptPrinter(Configurator, SettingsGroup):
-    def __init__(self, config_files: Set[str]) -> "ReceiptPrinter":
-        Configurator.__init__(self, config_files)
+    def __init__(self, config_files: Set[str], **kwargs) -> "ReceiptPrinter":
+        Configurator.__init__(self, config_files, **kwargs)
         SettingsGroup.__init__(self, 'peripherals.receipt.')
         self.paper = ReceiptPaper()
 
@@ -140,7 +140,11 @@ class ReceiptPrinter(Configurator, SettingsGroup):
     @property
     def changes_staged(self) -> bool:
         """Boolean indicating if changes have been staged."""
-        return super().changes_staged or super().modified
+        return super().changes_staged or self.modified
+
+    @property
+    def modified(self) -> bool:
+        return super().modified or self.paper.modified
 
     @property
     def settings(self) -> List[Tuple[str, str]]:
@@ -160,6 +164,6 @@ class ReceiptPrinter(Configurator, SettingsGroup):
         """Workflows will not use a receipt printer."""
         self.get_setting('enabled').value = 'N'
 
-    def run(self, test_run: bool = False) -> NoReturn:
+    def _stage(self) -> NoReturn:
+        """Stages the receipt printer, paper, and font settings."""
         self.batch_update(self.settings)
-        super().run(test_run)
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# By: Jason Ferrell, Sep. 2023
+# https://github.com/jgferrell/
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+"""Machine-readable run reports: one JSON object per line, for each
+subject file and for the run as a whole, in a size-capped file."""
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+from typing import NoReturn, Any, Set, Tuple, List, Union, Dict
+import json, os, time
+from .os import LockedFile
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+MAX_BYTES = 5 * 1024 * 1024
+BACKUPS = 3
+
+def default_report_path() -> str:
+    """Returns the default location of the report: next to wfcfg.log
+    (see wfcfg.bat) on Windows, or in the temporary directory
+    elsewhere."""
+    if os.name == 'nt':
+        return os.path.join(os.environ.get('windir', 'C:\\Windows'), 'temp',
+                            'wfcfg.jsonl')
+    import tempfile
+    return os.path.join(tempfile.gettempdir(), 'wfcfg.jsonl')
+
+def rotate(path: str, max_bytes: int = MAX_BYTES,
+           backups: int = BACKUPS) -> bool:
+    """If the file at `path` has reached `max_bytes`, renames it to
+    `path`.1 (after renaming `path`.1 to `path`.2, and so on, dropping
+    the oldest beyond `backups`). Returns True if it was rotated."""
+    try:
+        if os.path.getsize(path) < max_bytes:
+            return False
+    except FileNotFoundError:
+        return False
+    for n in range(backups, 0, -1):
+        older = '%s.%d' % (path, n)
+        newer = path if n == 1 else '%s.%d' % (path, n - 1)
+        if os.path.exists(newer):
+            os.replace(newer, older)
+    if backups < 1:
+        os.remove(path)
+    return True
+
+def run_record(results: List["FileResult"], command: List[str],
+               started: float) -> Dict[str, Any]:
+    """Returns the summary record of a run that began at `started` (a
+    time.time() value) and produced `results`."""
+    import socket
+    counts = {}
+    for result in results:
+        counts[result.status] = counts.get(result.status, 0) + 1
+    return {
+        'type': 'run',
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+        'command': command,
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                 time.localtime(started)),
+        'duration': round(time.time() - started, 6),
+        'files': len(results),
+        'counts': counts,
+        'bytes': sum(r.size or 0 for r in results),
+        'bytes_written': sum(r.size or 0 for r in results
+                             if r.status == 'updated'),
+        'lock_wait': round(sum(r.lock_wait for r in results), 6),
+        'errors': counts.get('error', 0),
+    }
+
+def write_report(path: str, results: List["FileResult"],
+                 command: List[str], started: float,
+                 max_bytes: int = MAX_BYTES,
+                 backups: int = BACKUPS) -> NoReturn:
+    """Appends a record for each of `results` and then a summary record
+    of the run to the report at `path`, rotating the report first if it
+    has reached `max_bytes`. The report is locked while it is written,
+    so several runs can share it."""
+    summary = run_record(results, command, started)
+    lines = []
+    for result in results:
+        record = {'type': 'file', 'host': summary['host'],
+                  'pid': summary['pid']}
+        record.update(result.to_dict())
+        lines.append(json.dumps(record) + '\n')
+    lines.append(json.dumps(summary) + '\n')
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    open(path, 'a').close()
+    lock = LockedFile(path, 'a')
+    lock.get_lock()
+    try:
+        rotate(path, max_bytes, backups)
+        with open(path, 'a') as fo:
+            fo.write(''.join(lines))
+    finally:
+        lock.release_lock()
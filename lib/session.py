@@ -0,0 +1,266 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# By: Jason Ferrell, Sep. 2023
+# https://github.com/jgferrell/
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+"""A class to apply the changes staged by several configurators in a
+single read and write of each subject file."""
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+from typing import NoReturn, Any, Set, Tuple, List, Union, Dict
+import hashlib, io, os
+from . import profiling
+from .configurator import Configurator, FileResult, map_in_order, \
+    measured, summarize, report_backup
+from .os import LockedFile
+from .preference_file import ParseCache, PreferenceFile, codec_type
+from .inventory import profile_of
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+class ApplySession:
+    def __init__(self, workers: int = 1, state_cache: "StateCache" = None,
+                 parse_cache: "ParseCache" = None,
+                 inventory: "ProfileInventory" = None,
+                 durability: str = 'file',
+                 backup: "BackupStore" = None,
+                 transform_cache: "TransformCache" = None) -> \
+            "ApplySession":
+        """
+        Create a session that collects the changes staged by several
+        Configurator objects (including FontConfigurator and
+        ReceiptPrinter) and SettingsGroup objects, and then applies all
+        of them with one pass over each subject file. Changes are
+        applied in the order they were added, so the result is the same
+        as running each configurator in turn. For a ProfileInventory,
+        the changes of the whole session are identified by a single
+        fingerprint. Files are backed up in `backup`, if provided,
+        before they are rewritten. When a TransformCache is provided,
+        content seen before is not parsed again while it remembers it;
+        see Configurator.
+        """
+        self._contributors: List["Configurator"] = []
+        self._files: Dict[str, List["Configurator"]] = {}
+        self.workers = workers
+        self.state_cache = state_cache
+        self.inventory = inventory
+        self.durability = durability
+        self.backup = backup
+        self.transform_cache = transform_cache
+        # print only errors and the summary line
+        self.quiet = False
+        self.parse_cache = ParseCache() if parse_cache is None else parse_cache
+
+    @property
+    def config_files(self) -> Set[str]:
+        """A set containing paths to all files affected by the session."""
+        return set(self._files)
+
+    def add(self, configurator: "Configurator") -> NoReturn:
+        """Adds the changes staged by `configurator` to the session."""
+        if not configurator.changes_staged:
+            return None
+        configurator._stage()
+        codec = codec_type(configurator)
+        for path in configurator.config_files:
+            contributors = self._files.setdefault(path, [])
+            if contributors and codec_type(contributors[0]) is not codec:
+                raise ValueError("%s cannot be updated by both %s and %s." %
+                                 (path, codec_type(contributors[0]).__name__,
+                                  codec.__name__))
+            contributors.append(configurator)
+        self._contributors.append(configurator)
+
+    def add_settings(self, group: "SettingsGroup",
+                     config_files: Set[str]) -> NoReturn:
+        """Adds the modified settings of `group` (such as Paper) as
+        updates to the preference files in `config_files`."""
+        configurator = Configurator(config_files)
+        configurator.batch_update(group.settings)
+        self.add(configurator)
+
+    @staticmethod
+    def _fingerprint(contributors: List["Configurator"]) -> str:
+        fingerprints = ' '.join(c.fingerprint for c in contributors)
+        return hashlib.sha256(fingerprints.encode('utf-8')).hexdigest()
+
+    def _apply(self, path: str, contributors: List["Configurator"]) -> \
+            Tuple[Tuple[int, int], "PreferenceFile"]:
+        # reading and parsing are one step here
+        with profiling.phase('parse', path):
+            stat, preferences = self.parse_cache.get(path, contributors[0])
+        if profiling.active is not None:
+            profiling.active.add_bytes(path, read=stat[1])
+        for configurator in contributors:
+            configurator.apply_to(preferences)
+        return stat, preferences
+
+    @staticmethod
+    def _transform(content: str, contributors: List["Configurator"]) -> str:
+        """Returns the content the contributions make of `content`."""
+        preferences = PreferenceFile(io.StringIO(content, newline=''),
+                                     contributors[0])
+        for configurator in contributors:
+            configurator.apply_to(preferences)
+        return str(preferences)
+
+    def _apply_file(self, path: str, test_run: bool,
+                    session_fingerprint: str) -> "FileResult":
+        """Applies every contribution to one subject file; see
+        Configurator._apply_file."""
+        cache = self.state_cache
+        contributors = self._files[path]
+        fingerprint = self._fingerprint(contributors)
+        transform = lambda content: self._transform(content, contributors)
+        lock = None
+        try:
+            if self.inventory is not None and self.inventory.is_current(
+                    profile_of(path), session_fingerprint):
+                return FileResult(path, FileResult.CACHED)
+            if cache is not None and cache.is_current(path, fingerprint):
+                return FileResult(path, FileResult.CACHED)
+            memoized = self.transform_cache is not None and \
+                self.transform_cache.fits(os.path.getsize(path))
+            if memoized:
+                content, updated = self.transform_cache.transform_file(
+                    path, fingerprint, transform)
+                unchanged = updated is None
+            else:
+                stat, preferences = self._apply(path, contributors)
+                content, unchanged = preferences, not preferences.modified
+            if unchanged:
+                if cache is not None:
+                    digest = hashlib.sha256(str(content).encode('utf-8'))
+                    cache.record(path, fingerprint, digest.hexdigest())
+                return FileResult(path, FileResult.UNCHANGED)
+            if test_run:
+                # if we're in test mode, don't write staged changes
+                return FileResult(path, FileResult.SIMULATED)
+            digest = hashlib.sha256()
+            lock = LockedFile(path, 'w', newline='',
+                              durability=self.durability)
+            with lock as fo:
+                if memoized:
+                    # read again under the lock, in case the file has
+                    # changed
+                    content, updated = self.transform_cache.transform_file(
+                        path, fingerprint, transform)
+                    lines = [content if updated is None else updated]
+                else:
+                    if ParseCache._stat(path) != stat:
+                        # changed since it was parsed; start over under
+                        # lock
+                        stat, preferences = self._apply(path, contributors)
+                    lines = preferences.lines()
+                if self.backup is not None:
+                    self.backup.add(path)
+                with profiling.phase('write', path):
+                    for line in lines:
+                        digest.update(line.encode('utf-8'))
+                        fo.write(line)
+            if profiling.active is not None:
+                profiling.active.add('write', lock.commit_time, path)
+                profiling.active.add('lock wait', lock.lock_wait, path)
+                profiling.active.add_bytes(path,
+                                           written=os.path.getsize(path))
+            if not memoized:
+                self.parse_cache.put(path, preferences)
+            if cache is not None:
+                cache.record(path, fingerprint, digest.hexdigest())
+        except Exception as e:
+            return FileResult(path, FileResult.ERROR, e,
+                              lock.lock_wait if lock is not None else 0.0)
+        return FileResult(path, FileResult.UPDATED, lock_wait=lock.lock_wait)
+
+    def _staged_keys(self, contributors: List["Configurator"]) -> List[str]:
+        """Returns the keys updated or deleted by `contributors`, in the
+        order they were staged."""
+        keys = {}
+        for configurator in contributors:
+            keys.update(dict.fromkeys(configurator._update_items))
+            keys.update(dict.fromkeys(sorted(configurator._delete_items)))
+        return list(keys)
+
+    def _check_file(self, path: str) -> "FileResult":
+        """Compares one subject file with the result of applying every
+        contribution to it, without locking or writing it."""
+        contributors = self._files[path]
+        try:
+            with profiling.phase('parse', path):
+                stat, current = self.parse_cache.get(path, contributors[0])
+            if profiling.active is not None:
+                profiling.active.add_bytes(path, read=stat[1])
+            expected = current.copy()
+            for configurator in contributors:
+                configurator.apply_to(expected)
+        except Exception as e:
+            return FileResult(path, FileResult.ERROR, e)
+        if not expected.modified:
+            return FileResult(path, FileResult.COMPLIANT)
+        result = FileResult(path, FileResult.NONCOMPLIANT)
+        for key in self._staged_keys(contributors):
+            if current.get_all(key) != expected.get_all(key):
+                result.deviations.append((key, expected.get(key),
+                                          current.get(key)))
+        return result
+
+    def check(self) -> List["FileResult"]:
+        """Reports whether each subject file already complies with the
+        contributions: whether applying them would leave it as it is.
+        Files are only read, never locked or written, and neither the
+        state cache nor the inventory is consulted. Returns a list of
+        FileResult objects, one per subject file; the deviations of
+        non-compliant files are listed in their `deviations`."""
+        if not self._contributors:
+            print("No changes staged. Not executing check.")
+            return []
+        if not self.quiet:
+            for configurator in self._contributors:
+                configurator._print_staged()
+            print('Checking files:')
+        check = measured(self._check_file)
+        if profiling.active is not None:
+            check = profiling.active.per_file(check)
+        results = []
+        for result in map_in_order(check, sorted(self._files), self.workers):
+            if not self.quiet or result.status != FileResult.COMPLIANT:
+                print(' *', result)
+            for key, expected, actual in result.deviations:
+                print('    %s: %s (expected %s)' % (
+                    key, 'absent' if actual is None else repr(actual),
+                    'absent' if expected is None else repr(expected)))
+            results.append(result)
+        print(('' if self.quiet else '\n') + summarize(results))
+        return results
+
+    def run(self, test_run: bool = False) -> List["FileResult"]:
+        """Applies all contributions to their subject files. Returns a
+        list of FileResult objects, one per subject file."""
+        if not self._contributors:
+            print("No changes staged. Not executing run.")
+            return []
+        if not self.quiet:
+            for configurator in self._contributors:
+                configurator._print_staged()
+            print('Updating files:')
+        results = []
+        session_fingerprint = self._fingerprint(self._contributors)
+        apply = measured(lambda path: self._apply_file(path, test_run,
+                                                       session_fingerprint))
+        if profiling.active is not None:
+            apply = profiling.active.per_file(apply)
+        for result in map_in_order(apply, sorted(self._files), self.workers):
+            if not self.quiet or result.status == FileResult.ERROR:
+                print(' *', result)
+            results.append(result)
+        if self.state_cache is not None:
+            self.state_cache.save()
+        if self.inventory is not None:
+            self.inventory.record_results(results, session_fingerprint)
+            self.inventory.save()
+        print(('' if self.quiet else '\n') + summarize(results))
+        if self.backup is not None:
+            report_backup(self.backup)
+        for configurator in self._contributors:
+            configurator._changes_staged = False
+        self._contributors, self._files = [], {}
+        return results
@@ -8,25 +8,34 @@
 configuration files determined by their 'key path' (e.g.,
 'peripherals.receipt.')"""
 #:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
-from typing import NoReturn, Any, Set, Tuple, List, Union, Dict
+from typing import NoReturn, Any, Set, Tuple, List, Union, Dict, FrozenSet
 #:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
 
 class CfgSetting:
+    __slots__ = ('_modified', '_type', '_getter', '_valids', '_normalized',
+                 '_value', '_group', '_key')
+
     def __init__(self, _type: type, valids: Union[Set[Any], None] = None,
                  value: Any = None, getter = None) -> "CfgSetting":
         self._modified: bool = False
         self._type: type = _type
         self._getter = getter
+        # the SettingsGroup told of modifications, and the key it uses
+        self._group: Union[None, "SettingsGroup"] = None
+        self._key: Union[None, str] = None
 
         if valids is None:
             self._valids = None
+            self._normalized = None
         else:        
-            self._valids: Set[Any] = set()
             for valid in valids:
                 if type(valid) is not _type:
                     raise TypeError("Mismatch between declared type "
                                     "and declared valid value.")
-                self._valids.add(valid)
+            self._valids: FrozenSet[Any] = frozenset(valids)
+            # strings are validated regardless of case
+            self._normalized: FrozenSet[Any] = self._valids if \
+                _type is not str else frozenset(v.lower() for v in valids)
 
         if value is not None:
             self._set_value(value)
@@ -44,15 +53,21 @@ class CfgSetting:
                             (self._type, type(value)))
 
         # if we're validating, make sure value is valid
-        if ( self._valids is not None ) and \
-           ( value not in self._valids ) and not \
-           ( self._type is str and value.lower() in self._valids ):
+        if ( self._normalized is not None ) and \
+           ( value not in self._normalized ) and not \
+           ( self._type is str and value.lower() in self._normalized ):
             raise ValueError("Received value '%s'. Valid values are %s." %\
-                             (value, self._valids))
+                             (value, set(self._valids)))
 
         # stage the validated value
         self._value = self._type(value)
+        self._mark_modified()
+
+    def _mark_modified(self) -> NoReturn:
+        """Flags the setting as modified, and tells its group."""
         self._modified = True
+        if self._group is not None:
+            self._group._dirty.add(self._key)
             
     @property
     def value(self) -> Any:
@@ -73,7 +88,7 @@ class CfgSetting:
         return self._modified
 
     @property
-    def valids(self) -> Set[Any]:
+    def valids(self) -> FrozenSet[Any]:
         """Returns a set of valid values."""
         return self._valids
 
@@ -83,9 +98,21 @@ class CfgSetting:
 
 class SettingsGroup:
     def __init__(self, keypath) -> "SettingGroup":
+        """
+        Create a group of settings sharing a key path. Each setting's
+        full key (key path plus key, or its override) is worked out when
+        the setting is added or its key overridden, and settings report
+        their modifications to the group, so `settings` and `modified`
+        only look at the settings that were modified.
+        """
         self._settings: Dict[str, CfgSetting] = {}
         self._overrides: Dict[str, str] = {}
         self._keypath = keypath
+        # full key and definition order of each setting
+        self._full_keys: Dict[str, str] = {}
+        self._order: Dict[str, int] = {}
+        # keys of modified settings
+        self._dirty: Set[str] = set()
 
     @property
     def keypath(self) -> str:
@@ -96,33 +123,43 @@ class SettingsGroup:
         """Returns key/value pairs of modified settings. The key value
         is the full keypath expected by Workflows config files. Both
         key and value are strings."""
-        out = []
-        for key, obj in self._settings.items():
-            if key in self._overrides:
-                key = self._overrides[key]
-            if obj.modified:
-                key, value = self.keypath + key, str(obj.value)
-                out.append((key, value))
-        return out
+        return [(self._full_keys[key], str(self._settings[key].value))
+                for key in sorted(self._dirty, key=self._order.__getitem__)]
 
     @property
     def modified(self) -> bool:
-        return len(self.settings) > 0
+        return bool(self._dirty)
+
+    def _bind(self, key: str, setting: "CfgSetting") -> NoReturn:
+        """Makes `setting` the setting for `key`."""
+        self._settings[key] = setting
+        if key not in self._order:
+            self._order[key] = len(self._order)
+        self._full_keys[key] = self.keypath + self._overrides.get(key, key)
+        setting._group, setting._key = self, key
+        if setting.modified:
+            self._dirty.add(key)
+        else:
+            self._dirty.discard(key)
     
     def add_setting(self, key, _type, **kwargs) -> NoReturn:
         if key not in self._settings:
-            self._settings[key] = CfgSetting(_type, **kwargs)
+            self._bind(key, CfgSetting(_type, **kwargs))
 
     def override_key(self, old_key: str, new_key: str) -> NoReturn:
         if old_key not in self._settings:
             raise KeyError("Setting with key '%s' not found." % old_key)
         self._overrides[old_key] = new_key
+        self._full_keys[old_key] = self.keypath + new_key
 
     def override_setting(self, key: str, setting: "CfgSetting") -> NoReturn:
-        self._settings[key] = setting
+        self._bind(key, setting)
 
     def get_setting(self, key) -> "CfgSetting":
         return self._settings[key]
 
     def delete_setting(self, key) -> NoReturn:
-        del self._settings[key]
+        setting = self._settings.pop(key)
+        setting._group = None
+        del self._full_keys[key]
+        self._dirty.discard(key)
@@ -0,0 +1,54 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# By: Jason Ferrell, Sep. 2023
+# https://github.com/jgferrell/
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+"""An on-disk record of the state in which WfCfg left each subject
+file, so that files nobody has touched since can be skipped."""
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+from typing import NoReturn, Any, Set, Tuple, List, Union, Dict
+import os
+from .os import JsonIndex, data_path
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+def default_cache_path() -> str:
+    """Returns the default location of the state cache."""
+    return data_path('state.json')
+
+
+class StateCache(JsonIndex):
+    SECTION = 'files'
+
+    def __init__(self, path: str) -> "StateCache":
+        """
+        Create a cache backed by the index file at `path`. For each
+        subject file and change fingerprint, the cache records the size,
+        modification time, and content digest of the file as WfCfg left
+        it. The index file is read on first use.
+        """
+        super().__init__(path)
+
+    def is_current(self, filepath: str, fingerprint: str) -> bool:
+        """True if `filepath` has the same size and modification time
+        as when it was last recorded with `fingerprint`."""
+        entry = self._get(filepath, fingerprint)
+        if entry is None:
+            return False
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return False
+        return [st.st_size, st.st_mtime_ns] == entry[:2]
+
+    def digest(self, filepath: str, fingerprint: str) -> Union[None, str]:
+        """Returns the recorded content digest of `filepath`, if any."""
+        entry = self._get(filepath, fingerprint)
+        return None if entry is None else entry[2]
+
+    def record(self, filepath: str, fingerprint: str, digest: str) -> NoReturn:
+        """Records the current size and modification time of `filepath`
+        along with `digest`, the digest of its content, as the state
+        left by applying the changes identified by `fingerprint`."""
+        st = os.stat(filepath)
+        self._put(filepath, fingerprint, [st.st_size, st.st_mtime_ns, digest])
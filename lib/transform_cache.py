@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# By: Jason Ferrell, Sep. 2023
+# https://github.com/jgferrell/
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+"""An in-memory record of what staged changes made of file content
+already seen, so that profiles sharing the same content are parsed
+and transformed once."""
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+from typing import NoReturn, Any, Set, Tuple, List, Union, Dict, Callable
+from collections import OrderedDict
+import hashlib, sys, threading
+from . import profiling
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+MAX_BYTES = 64 * 1024 * 1024
+
+# stands for output identical to the input, which need not be kept
+_SAME = object()
+# approximate bytes taken by an entry's key and bookkeeping
+_ENTRY_OVERHEAD = 200
+
+
+class TransformCache:
+    def __init__(self, max_bytes: int = MAX_BYTES) -> "TransformCache":
+        """
+        Create a cache of transformed file content, keyed by a digest of
+        the input content and the fingerprint of the staged changes.
+        Entries are evicted, least recently used first, to keep the
+        memory they take under `max_bytes`. Content larger than
+        `max_entry` (an eighth of `max_bytes`) is neither cached nor
+        meant to be read whole; see fits().
+        """
+        self.max_bytes = max_bytes
+        self.max_entry = max_bytes // 8
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[bytes, str], Any]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def fits(self, size: int) -> bool:
+        """True if a file of `size` bytes is small enough to be cached."""
+        return size <= self.max_entry
+
+    @staticmethod
+    def _sizeof(output: Any) -> int:
+        return _ENTRY_OVERHEAD + (0 if output is _SAME else
+                                  sys.getsizeof(output))
+
+    def transform(self, content: str, fingerprint: str,
+                  func: Callable[[str], str]) -> Union[None, str]:
+        """Returns func(`content`), the content that the changes
+        identified by `fingerprint` make of `content`, or None if they
+        leave it as it is. func is only called if no earlier call had
+        the same content and fingerprint."""
+        key = (hashlib.sha256(content.encode('utf-8')).digest(), fingerprint)
+        with self._lock:
+            output = self._entries.get(key)
+            if output is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if output is None:
+            output = func(content)
+            if output == content:
+                output = _SAME
+            self._put(key, output)
+        return None if output is _SAME else output
+
+    def transform_file(self, path: str, fingerprint: str,
+                       func: Callable[[str], str]) -> \
+            Tuple[str, Union[None, str]]:
+        """Returns the content of the file at `path`, read whole, and
+        what transform() makes of it: the content the changes identified
+        by `fingerprint` make of it, or None if they leave it as it is."""
+        with profiling.phase('read', path):
+            with open(path, newline='') as fo:
+                content = fo.read()
+        if profiling.active is not None:
+            profiling.active.add_bytes(path, read=len(content))
+        with profiling.phase('parse', path):
+            return content, self.transform(content, fingerprint, func)
+
+    def _put(self, key: Tuple[bytes, str], output: Any) -> NoReturn:
+        size = self._sizeof(output)
+        if size > self.max_entry:
+            return None
+        with self._lock:
+            if key in self._entries:
+                return None
+            self._entries[key] = output
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= self._sizeof(evicted)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> NoReturn:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
@@ -0,0 +1,308 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+# By: Jason Ferrell, Sep. 2023
+# https://github.com/jgferrell/
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+"""Keeps a policy enforced between reboots: watches Property folders
+and reapplies the policy to files that drift from it."""
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+from typing import NoReturn, Any, Set, Tuple, List, Union, Dict, Iterable
+import json, os, time
+from .configurator import FileResult
+from .policy import load_plan_sources, stage_plan, _mtimes
+from .os import data_path, write_atomically
+from .session import ApplySession
+#:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+
+def default_status_path() -> str:
+    """Returns the default location of the watch status file."""
+    return data_path('watch.json')
+
+
+class PollingWatcher:
+    def __init__(self, directories: Iterable[str],
+                 interval: float = 1.0) -> "PollingWatcher":
+        """
+        Watch `directories` by comparing the size and modification time
+        of the files in them every `interval` seconds. Works anywhere,
+        at the cost of one directory listing per directory per interval.
+        """
+        self.interval = interval
+        self._snapshots = {d: self._scan(d) for d in directories}
+
+    @staticmethod
+    def _scan(directory: str) -> Union[None, Dict[str, Tuple[int, int]]]:
+        try:
+            with os.scandir(directory) as entries:
+                return {e.name: (e.stat().st_mtime_ns, e.stat().st_size)
+                        for e in entries}
+        except OSError:
+            return None
+
+    def changes(self) -> Set[str]:
+        """Returns the directories changed since the last check."""
+        changed = set()
+        for directory, snapshot in self._snapshots.items():
+            current = self._scan(directory)
+            if current != snapshot:
+                self._snapshots[directory] = current
+                changed.add(directory)
+        return changed
+
+    def ignore(self, directories: Set[str]) -> NoReturn:
+        """Forgets changes made so far to `directories`, such as WfCfg's
+        own writes."""
+        for directory in directories & set(self._snapshots):
+            self._snapshots[directory] = self._scan(directory)
+
+    def wait(self, timeout: float) -> Set[str]:
+        """Returns the directories changed within `timeout` seconds, as
+        soon as there are any."""
+        deadline = time.monotonic() + timeout
+        while True:
+            changed = self.changes()
+            remaining = deadline - time.monotonic()
+            if changed or remaining <= 0:
+                return changed
+            time.sleep(min(self.interval, remaining))
+
+    def close(self) -> NoReturn:
+        self._snapshots = {}
+
+
+class NotificationWatcher:
+    # FILE_NOTIFY_CHANGE_FILE_NAME | FILE_NOTIFY_CHANGE_SIZE |
+    # FILE_NOTIFY_CHANGE_LAST_WRITE
+    FILTER = 0x01 | 0x08 | 0x10
+    # objects a single WaitForMultipleObjects call can wait on
+    MAX_WAIT = 64
+
+    def __init__(self, directories: Iterable[str]) -> "NotificationWatcher":
+        """
+        Watch `directories` with Windows change notifications, so that
+        nothing is read until Windows reports a change. Directories
+        that cannot be watched are ignored.
+        """
+        import ctypes
+        from ctypes import wintypes
+        self._kernel32 = kernel32 = ctypes.WinDLL('kernel32',
+                                                  use_last_error=True)
+        kernel32.FindFirstChangeNotificationW.restype = wintypes.HANDLE
+        kernel32.FindFirstChangeNotificationW.argtypes = [
+            wintypes.LPCWSTR, wintypes.BOOL, wintypes.DWORD]
+        for function in [kernel32.FindNextChangeNotification,
+                         kernel32.FindCloseChangeNotification]:
+            function.restype = wintypes.BOOL
+            function.argtypes = [wintypes.HANDLE]
+        kernel32.WaitForMultipleObjects.restype = wintypes.DWORD
+        kernel32.WaitForMultipleObjects.argtypes = [
+            wintypes.DWORD, ctypes.POINTER(wintypes.HANDLE), wintypes.BOOL,
+            wintypes.DWORD]
+        invalid = wintypes.HANDLE(-1).value
+        self._handles = {}
+        for directory in directories:
+            handle = kernel32.FindFirstChangeNotificationW(
+                directory, False, NotificationWatcher.FILTER)
+            if handle and handle != invalid:
+                self._handles[handle] = directory
+        self._pending = set()
+        handles = list(self._handles)
+        self._groups = [
+            (wintypes.HANDLE * len(group))(*group) for group in
+            [handles[i:i + NotificationWatcher.MAX_WAIT]
+             for i in range(0, len(handles), NotificationWatcher.MAX_WAIT)]]
+
+    def _signaled(self, group, timeout_ms: int) -> Set[str]:
+        """Returns the directories of signaled handles in `group`,
+        re-arming each handle."""
+        changed = set()
+        while True:
+            index = self._kernel32.WaitForMultipleObjects(
+                len(group), group, False, timeout_ms)
+            if index >= len(group):  # WAIT_TIMEOUT or WAIT_FAILED
+                return changed
+            handle = group[index]
+            changed.add(self._handles[handle])
+            self._kernel32.FindNextChangeNotification(handle)
+            # collect any other signaled handles without waiting
+            timeout_ms = 0
+
+    def ignore(self, directories: Set[str]) -> NoReturn:
+        """Forgets changes made so far to `directories`, such as WfCfg's
+        own writes."""
+        for group in self._groups:
+            self._pending |= self._signaled(group, 0)
+        self._pending -= directories
+
+    def wait(self, timeout: float) -> Set[str]:
+        """Returns the directories changed within `timeout` seconds, as
+        soon as there are any."""
+        if self._pending:
+            changed, self._pending = self._pending, set()
+            return changed
+        if not self._groups:
+            time.sleep(timeout)
+            return set()
+        # groups of more than MAX_WAIT handles share the timeout
+        timeout_ms = max(1, int(timeout * 1000) // len(self._groups))
+        deadline = time.monotonic() + timeout
+        while True:
+            changed = set()
+            for group in self._groups:
+                changed |= self._signaled(group, timeout_ms)
+            if changed or time.monotonic() >= deadline:
+                return changed
+
+    def close(self) -> NoReturn:
+        for handle in self._handles:
+            self._kernel32.FindCloseChangeNotification(handle)
+        self._handles, self._groups = {}, []
+
+
+def make_watcher(directories: Iterable[str], poll: bool = False,
+                 interval: float = 1.0) -> Union[PollingWatcher,
+                                                 NotificationWatcher]:
+    """Returns a NotificationWatcher on Windows, or a PollingWatcher
+    elsewhere or if `poll` is True."""
+    if os.name == 'nt' and not poll:
+        return NotificationWatcher(directories)
+    return PollingWatcher(directories, interval)
+
+
+class Enforcer:
+    def __init__(self, policy_path: str, pref_files: Set[str],
+                 font_files: Set[str], debounce: float = 2.0,
+                 poll: bool = False, interval: float = 1.0,
+                 status_path: Union[None, str] = None,
+                 use_plan_cache: bool = True, workers: int = 1,
+                 test_run: bool = False, durability: str = 'file',
+                 quiet: bool = False) -> "Enforcer":
+        """
+        Create a daemon enforcing the policy at `policy_path` on the
+        given preference and font files. Changes to the files are
+        collected until none have arrived for `debounce` seconds; then
+        the policy is reapplied to the files in the folders that changed,
+        which rewrites only files whose enforced keys have drifted. (A
+        change made to one of those folders while the policy is being
+        applied to it goes unnoticed until the folder changes again.)
+        The policy is reloaded, and applied everywhere, whenever it (or
+        a file it includes) is modified; a policy that cannot be loaded
+        (e.g. one saved halfway) is retried at every step, while the one
+        loaded before it stays enforced. Counters describing the daemon
+        are kept in `status` and written to `status_path`, if provided.
+        """
+        self.policy_path = policy_path
+        self.pref_files = set(pref_files)
+        self.font_files = set(font_files)
+        self.debounce = debounce
+        self.status_path = status_path
+        self.use_plan_cache = use_plan_cache
+        self.workers = workers
+        self.test_run = test_run
+        self.durability = durability
+        self.quiet = quiet
+        self.watcher = make_watcher({os.path.dirname(f) for f in
+                                     self.pref_files | self.font_files},
+                                    poll, interval)
+        self.plan = None
+        self._policy_mtimes = None
+        self.status = {'pid': os.getpid(), 'policy': policy_path,
+                       'started': time.time(),
+                       'watcher': type(self.watcher).__name__,
+                       'files': len(self.pref_files | self.font_files),
+                       'policy_loads': 0, 'policy_errors': 0,
+                       'passes': 0, 'files_checked': 0,
+                       'files_updated': 0, 'errors': 0, 'last_pass': None,
+                       'last_error': None}
+
+    def _policy_changed(self) -> bool:
+        try:
+            return _mtimes([s for s, _ in self._policy_mtimes]) != \
+                self._policy_mtimes
+        except OSError:
+            # mid-edit or removed; keep enforcing the loaded policy
+            return False
+
+    def reload(self) -> bool:
+        """(Re)loads the policy. Returns False, keeping the policy loaded
+        before (if any), if the policy cannot be loaded."""
+        try:
+            plan, sources = load_plan_sources(self.policy_path,
+                                              self.use_plan_cache)
+            mtimes = _mtimes(sources)
+        except (OSError, ValueError, TypeError) as e:
+            # mid-edit, removed, or invalid
+            error = 'Policy %s not loaded: %s' % (self.policy_path, e)
+            print(error)
+            self.status['policy_errors'] += 1
+            self.status['last_error'] = error
+            self.write_status()
+            return False
+        self.plan, self._policy_mtimes = plan, mtimes
+        self.status['policy_loads'] += 1
+        return True
+
+    def enforce(self, directories: Union[None, Set[str]] = None) -> \
+            List["FileResult"]:
+        """Applies the policy to the files in `directories`, or to every
+        file if no directories are given."""
+        in_scope = lambda files: files if directories is None else \
+            {f for f in files if os.path.dirname(f) in directories}
+        session = ApplySession(self.workers, durability=self.durability)
+        session.quiet = self.quiet
+        stage_plan(self.plan, session, in_scope(self.pref_files),
+                   in_scope(self.font_files))
+        results = session.run(self.test_run)
+        self.watcher.ignore({os.path.dirname(r.path) for r in results
+                             if r.status == FileResult.UPDATED})
+        status = self.status
+        status['passes'] += 1
+        status['last_pass'] = time.time()
+        status['files_checked'] += len(results)
+        for result in results:
+            if result.status == FileResult.UPDATED:
+                status['files_updated'] += 1
+            elif result.status == FileResult.ERROR:
+                status['errors'] += 1
+                status['last_error'] = str(result)
+        self.write_status()
+        return results
+
+    def write_status(self) -> NoReturn:
+        """Writes `status` to the status file, if there is one."""
+        if self.status_path is None:
+            return None
+        write_atomically(self.status_path, json.dumps(self.status, indent=1))
+
+    def step(self, timeout: float) -> Union[None, List["FileResult"]]:
+        """Waits up to `timeout` seconds for changes and handles them.
+        Returns the results of the resulting pass, if there was one."""
+        if self.plan is None or self._policy_changed():
+            if self.reload():
+                return self.enforce()
+            if self.plan is None:
+                # nothing to enforce until the policy can be loaded
+                time.sleep(timeout)
+                return None
+        changed = self.watcher.wait(timeout)
+        if not changed:
+            return None
+        # let the burst of changes (e.g. Workflows exiting) settle
+        while True:
+            more = self.watcher.wait(self.debounce)
+            if not more:
+                break
+            changed |= more
+        return self.enforce(changed)
+
+    def run(self, timeout: float = 5.0) -> NoReturn:
+        """Enforces the policy until interrupted (Ctrl+C). The policy
+        file is checked for changes at least every `timeout` seconds."""
+        try:
+            while True:
+                self.step(timeout)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.watcher.close()
@@ -1,11 +1,24 @@
-import unittest, random, os, tempfile
-from lib.configurator import Configurator
+import unittest, random, os, tempfile, shutil, subprocess, sys, time, json, \
+    socket, io, contextlib
+from lib.configurator import Configurator, FileResult
 from lib.paper import Paper, paper_units, paper_sizes, paper_orientation
 from lib.receipt_printer import ReceiptFont, ReceiptPrinter, ReceiptPaper
 from lib.settings_group import CfgSetting, SettingsGroup
 from lib.font import FontConfigurator, Font, gui_components
 from lib.cli import WfCfgParser
-from lib.os import get_property_files, LOCKFILE
+from lib.state_cache import StateCache
+from lib.inventory import ProfileInventory, profile_of
+from lib.watch import Enforcer
+import benchmark, filediff
+from lib import profiling, printers
+from lib.preference_file import PreferenceFile
+from lib.session import ApplySession
+from lib.transform_cache import TransformCache
+from lib.policy import load_plan, load_policy, compile_policy, PLANFILE
+import lib.os, lib.backup
+from lib.backup import BackupStore
+from lib.os import get_property_files, iter_sirsi_dirs, SYSTEM_PROFILES, \
+    LockedFile, LockTimeout, LOCKFILE, SCRATCHFILE
 
 dummy_files = set([ 'testA.txt', 'testB.txt' ])
 default_settings = [('menu.burger.cheese', 'Y'),
@@ -29,7 +42,7 @@ def fileDict(Configurator_obj, filepath):
     with open(filepath, 'r') as fo:
         text = [_ for _ in fo.read().split('\n') if _.strip()]
     configs = [Configurator_obj.config_line_processor(line) for line in text]
-    page_dict = {key:val for key, val in configs}
+    page_dict = {key:val for key, val in filter(None, configs)}
     return page_dict
         
 def checkFiles(TestCase_obj, Configurator_obj, keypath, expected_value,
@@ -166,6 +179,24 @@ class TestSettingsGroup(unittest.TestCase):
         self.sg.delete_setting(key)
         self.assertFalse(self.sg.modified)
 
+    def test_dirty_tracking(self):
+        for key in ['a', 'b', 'c']:
+            self.sg.add_setting(key, str, valids={'x', 'Y'})
+        self.sg.override_key('c', 'see')
+        # reported in definition order, whatever the order of changes
+        self.sg.get_setting('c').value = 'X'
+        self.sg.get_setting('a').value = 'y'
+        self.assertEqual([(self.keypath + 'a', 'y'),
+                          (self.keypath + 'see', 'X')], self.sg.settings)
+        with self.assertRaises(ValueError):
+            self.sg.get_setting('b').value = 'z'
+        self.assertEqual(2, len(self.sg.settings))
+        # a replacement setting takes over the key's place and state
+        self.sg.override_setting('a', CfgSetting(str))
+        self.assertEqual([(self.keypath + 'see', 'X')], self.sg.settings)
+        with self.assertRaises(AttributeError):
+            self.sg.get_setting('b').extra = 1
+
 class TestConfiguratorClass(unittest.TestCase):
     def setUp(self):
         makeDummyFiles()
@@ -267,6 +298,425 @@ class TestConfiguratorClass(unittest.TestCase):
         # reset files to default values
         self.reset()
 
+    def test_rewrite(self):
+        fmt = self.c.config_line_formatter
+        lines = [fmt('a', '1') + '\r\n', '\r\n', fmt('b', '2') + '\r\n',
+                 fmt('a', '3') + '\r\n', fmt('c', '4')]
+        # stage through the base class; subclasses wrap update/delete
+        Configurator.update(self.c, 'a', '5')
+        Configurator.update(self.c, 'c', '4')
+        Configurator.update(self.c, 'd', '6')
+        Configurator.delete(self.c, 'b')
+        # untouched lines and line endings are preserved
+        expected = ''.join([fmt('a', '5') + '\r\n', '\r\n',
+                            fmt('a', '5') + '\r\n', fmt('c', '4') + '\r\n',
+                            fmt('d', '6') + '\r\n'])
+        self.assertEqual(expected, ''.join(self.c._rewrite(lines)))
+        # the PreferenceFile model produces the same result
+        pf = PreferenceFile(lines, self.c)
+        self.assertTrue(self.c.apply_to(pf))
+        self.assertEqual(expected, str(pf))
+
+    def test_no_scratch_files(self):
+        Configurator.update(self.c, 'menu.burger.cheese', 'N')
+        self.c.run()
+        for f in self.c.config_files:
+            self.assertFalse(os.path.exists(f + SCRATCHFILE))
+
+    def test_workers(self):
+        # one unreadable file must not stop the others from updating
+        missing = 'testMissing.txt'
+        self.c._config_files = dummy_files | {missing}
+        self.c.workers = 4
+        Configurator.update(self.c, 'menu.burger.cheese', 'N')
+        results = self.c.run()
+        self.c._config_files = dummy_files
+        self.assertEqual(sorted(dummy_files | {missing}),
+                         [r.path for r in results])
+        for r in results:
+            expected = 'error' if r.path == missing else 'updated'
+            self.assertEqual(expected, r.status)
+        self.checkFiles('menu.burger.cheese', 'N')
+        with self.assertRaises(ValueError):
+            self.c.workers = 0
+
+
+    def test_unchanged(self):
+        # the first run normalizes the files; the second one is a no-op
+        for status in ['updated', 'unchanged']:
+            Configurator.update(self.c, 'menu.burger.cheese', 'N')
+            mtimes = [os.stat(f).st_mtime_ns for f in sorted(dummy_files)]
+            results = self.c.run()
+            self.assertEqual([status] * len(dummy_files),
+                             [r.status for r in results])
+        self.assertEqual(mtimes,
+                         [os.stat(f).st_mtime_ns for f in sorted(dummy_files)])
+
+
+    def test_state_cache(self):
+        cache_path = os.path.join(tempfile.gettempdir(), 'test_state.json')
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        self.c.state_cache = StateCache(cache_path)
+        for status in ['updated', 'cached']:
+            Configurator.update(self.c, 'menu.burger.cheese', 'N')
+            results = self.c.run()
+            self.assertEqual([status] * len(dummy_files),
+                             [r.status for r in results])
+        # a new cache instance reads the saved index
+        self.c.state_cache = StateCache(cache_path)
+        Configurator.update(self.c, 'menu.burger.cheese', 'N')
+        self.assertEqual(['cached'] * len(dummy_files),
+                         [r.status for r in self.c.run()])
+        # different staged changes are not covered by the cache
+        Configurator.update(self.c, 'menu.burger.cheese', 'Y')
+        self.assertEqual(['updated'] * len(dummy_files),
+                         [r.status for r in self.c.run()])
+        os.remove(cache_path)
+
+
+class TestPreferenceFile(unittest.TestCase):
+    def setUp(self):
+        self.text = ('# comment\n'
+                     'a=1\n'
+                     '\n'
+                     'url=http://host/?x=1&y=2\n'
+                     'esc\\=key=v\n'
+                     'a=2\n'
+                     'b=3')
+        self.pf = PreferenceFile(self.text.splitlines(True), Configurator(set()))
+
+    def test_lossless(self):
+        self.assertEqual(self.text, str(self.pf))
+        self.assertFalse(self.pf.modified)
+
+    def test_get(self):
+        self.assertEqual('http://host/?x=1&y=2', self.pf.get('url'))
+        self.assertEqual('v', self.pf.get('esc\\=key'))
+        # the last occurrence of a key wins, as in Workflows
+        self.assertEqual('2', self.pf.get('a'))
+        self.assertEqual({'a': 2}, self.pf.duplicates())
+        self.assertIsNone(self.pf.get('missing'))
+        self.assertEqual(['a', 'url', 'esc\\=key', 'b'], list(self.pf.keys()))
+
+    def test_set_delete(self):
+        self.pf.set('b', '3')
+        self.assertFalse(self.pf.modified)
+        self.pf.set('a', '4')
+        self.pf.set('c', '5')
+        self.assertTrue(self.pf.delete('url'))
+        self.assertFalse(self.pf.delete('url'))
+        self.assertTrue(self.pf.modified)
+        self.assertEqual('# comment\na=4\n\nesc\\=key=v\na=4\nb=3\nc=5\n',
+                         str(self.pf))
+
+    def test_font_codec(self):
+        lines = ['LabelFont|Arial|bold|12|\n', 'garbage\n']
+        pf = PreferenceFile(lines, FontConfigurator(set()))
+        self.assertEqual('Arial|bold|12', pf.get('LabelFont'))
+        self.assertEqual(1, len(pf))
+
+
+class TestApplySession(unittest.TestCase):
+    def setUp(self):
+        makeDummyFiles()
+        self.session = ApplySession()
+
+    def tearDown(self):
+        deleteDummyFiles()
+
+    def test_run(self):
+        main = Configurator(dummy_files)
+        main.update('menu.burger.cheese', 'N')
+        main.delete('menu.burger.pickles')
+        paper = Paper()
+        paper.units = 'inch'
+        receipt = ReceiptPrinter(dummy_files)
+        receipt.add('Some Receipt Printer')
+        later = Configurator(dummy_files)
+        later.update('menu.burger.pickles', '3')
+        for configurator in [main, receipt, later]:
+            self.session.add(configurator)
+        self.session.add_settings(paper, dummy_files)
+        self.assertEqual(dummy_files, self.session.config_files)
+        results = self.session.run()
+        self.assertEqual(['updated'] * len(dummy_files),
+                         [r.status for r in results])
+        self.assertFalse(main.changes_staged)
+        for f in dummy_files:
+            cfg = fileDict(main, f)
+            self.assertEqual('N', cfg['menu.burger.cheese'])
+            # applied in order: deleted, then added again
+            self.assertEqual('3', cfg['menu.burger.pickles'])
+            self.assertEqual('INCH', cfg['peripherals.page.margin_unit'])
+            self.assertEqual('Y', cfg['peripherals.receipt.enabled'])
+        # the parse cache follows the written content
+        later.update('menu.burger.pickles', '3')
+        self.session.add(later)
+        self.assertEqual(['unchanged'] * len(dummy_files),
+                         [r.status for r in self.session.run()])
+
+    def test_same_result_as_run(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        contents = ['a=1\nb=2\n', 'a=1\nb=2', 'b=2\r\na=1\r\nb=3\r\n',
+                    '', '# c\n\nc=0\nd=1']
+        files = {}
+        for n, content in enumerate(contents):
+            for engine in ['run', 'session']:
+                path = os.path.join(tempdir, '%s%d' % (engine, n))
+                with open(path, 'w', newline='') as fo:
+                    fo.write(content)
+                files.setdefault(engine, set()).add(path)
+        def stage(files):
+            c = Configurator(files, transform_cache=None)
+            c.update('a', '1')
+            # updated and deleted: deleted if present, added otherwise
+            c.update('b', '5')
+            c.delete('b')
+            c.update('d', '4')
+            c.delete('d')
+            c.update('e', '6')
+            c.delete('c')
+            return c
+        session = ApplySession(transform_cache=None)
+        session.add(stage(files['session']))
+        with contextlib.redirect_stdout(io.StringIO()):
+            stage(files['run']).run()
+            session.run()
+        for n in range(len(contents)):
+            with open(os.path.join(tempdir, 'run%d' % n), newline='') as fo:
+                expected = fo.read()
+            with open(os.path.join(tempdir, 'session%d' % n),
+                      newline='') as fo:
+                self.assertEqual(expected, fo.read())
+        with open(os.path.join(tempdir, 'run0'), newline='') as fo:
+            self.assertEqual('a=1\nd=4\ne=6\n', fo.read())
+
+    def test_check(self):
+        main = Configurator(dummy_files)
+        main.update('menu.burger.cheese', 'Y')
+        main.update('menu.burger.onion', 'N')
+        main.delete('menu.burger.pickles')
+        self.session.add(main)
+        self.session.workers = 2
+        mtimes = {f: os.stat(f).st_mtime_ns for f in dummy_files}
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = self.session.check()
+        self.assertEqual(['noncompliant'] * len(dummy_files),
+                         [r.status for r in results])
+        self.assertEqual([('menu.burger.onion', 'N', None),
+                          ('menu.burger.pickles', None, '2')],
+                         results[0].deviations)
+        # nothing was written or locked
+        self.assertEqual(mtimes, {f: os.stat(f).st_mtime_ns
+                                  for f in dummy_files})
+        self.assertFalse(any(os.path.exists(f + LOCKFILE)
+                             for f in dummy_files))
+        parser = WfCfgParser(set(dummy_files), set())
+        check = ['--check', 'main', '--update', 'menu.burger.cheese=Y']
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(0, parser.run(check))
+            self.assertEqual(3, parser.run(check + ['menu.burger.onion=N']))
+
+    def test_codec_conflict(self):
+        main = Configurator(dummy_files)
+        main.update('menu.burger.cheese', 'N')
+        font = FontConfigurator(dummy_files)
+        font.update('LabelFont', 'Arial', 'bold', 12)
+        self.session.add(main)
+        with self.assertRaises(ValueError):
+            self.session.add(font)
+
+
+class TestTransformCache(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_transform(self):
+        cache = TransformCache(4096)
+        calls = []
+        upper = lambda content: calls.append(content) or content.upper()
+        self.assertEqual('A=1\n', cache.transform('a=1\n', 'f', upper))
+        self.assertEqual('A=1\n', cache.transform('a=1\n', 'f', upper))
+        self.assertEqual(1, len(calls))
+        # a different fingerprint is a different transform
+        cache.transform('a=1\n', 'g', upper)
+        self.assertEqual(2, len(calls))
+        # unchanged content is reported as None
+        self.assertIsNone(cache.transform('A=1\n', 'f', upper))
+        self.assertIsNone(cache.transform('A=1\n', 'f', upper))
+        self.assertEqual((2, 3), (cache.hits, cache.misses))
+        # the least recently used entries are evicted to fit
+        for n in range(100):
+            cache.transform('key%d=%s\n' % (n, 'x' * 100), 'f', upper)
+        self.assertLess(len(cache), 100)
+        self.assertLessEqual(cache._size, cache.max_bytes)
+        calls.clear()
+        cache.transform('a=1\n', 'f', upper)
+        self.assertEqual(1, len(calls))
+
+    def test_shared_content(self):
+        files = set()
+        for n, eol in enumerate(['\n', '\n', '\r\n']):
+            path = os.path.join(self.tempdir, 'preference%d' % n)
+            with open(path, 'w', newline='') as fo:
+                fo.write('a=1%sb=2%s' % (eol, eol))
+            files.add(path)
+        for make in [Configurator, lambda files, **kwargs: ApplySession(
+                **kwargs)]:
+            cache = TransformCache()
+            configurator = Configurator(files, transform_cache=cache)
+            configurator.update('b', '3')
+            configurator.update('c', '4')
+            if make is not Configurator:
+                session = make(files, transform_cache=cache)
+                session.add(configurator)
+                configurator = session
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = configurator.run()
+            self.assertEqual(['updated'] * 3, [r.status for r in results])
+            # each distinct content was transformed once
+            self.assertEqual(2, cache.misses)
+            self.assertGreater(cache.hits, 0)
+            for path in files:
+                eol = '\r\n' if path.endswith('2') else '\n'
+                with open(path, 'r', newline='') as fo:
+                    self.assertEqual('a=1%sb=3%sc=4%s' % (eol, eol, eol),
+                                     fo.read())
+            for path in files:
+                with open(path, 'w', newline='') as fo:
+                    fo.write('a=1\nb=2\n' if not path.endswith('2')
+                             else 'a=1\r\nb=2\r\n')
+
+
+    def test_cli(self):
+        for args, max_bytes in [([], None), (['--transform-cache', '64'],
+                                             64 * 1024 * 1024)]:
+            parser = WfCfgParser(set(), set())
+            with contextlib.redirect_stdout(io.StringIO()):
+                parser.run(args + ['main', '--update', 'a=b'])
+            cache = parser.main_cfg.transform_cache
+            self.assertEqual(max_bytes, None if cache is None else
+                             cache.max_bytes)
+
+
+class TestPolicy(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.base = os.path.join(self.tempdir, 'base.toml')
+        self.ou = os.path.join(self.tempdir, 'ou.toml')
+        with open(self.base, 'w') as fo:
+            fo.write('[main]\n'
+                     'update = {"desktop.frame.laf.theme" = "fall", '
+                     '"menu.burger.cheese" = "N"}\n'
+                     'delete = ["menu.burger.pickles"]\n'
+                     '[font.ALL]\n'
+                     'type = "Arial"\nsize = 12\nstyle = "plain"\n')
+        with open(self.ou, 'w') as fo:
+            fo.write('include = ["base.toml"]\n'
+                     '[main]\n'
+                     'update = {"desktop.frame.laf.theme" = "purple"}\n'
+                     '[paper]\nunits = "inch"\n'
+                     '[receipt_printer]\nadd = "ReceiptBoss 5000"\n'
+                     '[font.LabelFont]\n'
+                     'type = "Arial"\nsize = 14\nstyle = "bold"\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_layering(self):
+        policy, sources = load_policy(self.ou)
+        self.assertEqual([self.base, self.ou], sources)
+        plan = compile_policy(policy)
+        updates = dict(plan['main']['update'])
+        self.assertEqual('purple', updates['desktop.frame.laf.theme'])
+        self.assertEqual('N', updates['menu.burger.cheese'])
+        self.assertEqual('INCH', updates['peripherals.page.margin_unit'])
+        self.assertEqual(['menu.burger.pickles'], plan['main']['delete'])
+        fonts = dict(plan['font']['update'])
+        self.assertEqual('Arial|bold|14', fonts['LabelFont'])
+        self.assertEqual('Arial|plain|12', fonts['ButtonFont'])
+
+    def test_override_delete(self):
+        # the including policy wins over the included one either way
+        with open(self.ou, 'w') as fo:
+            fo.write('include = ["base.toml"]\n'
+                     '[main]\n'
+                     'update = {"menu.burger.pickles" = "Y"}\n'
+                     'delete = ["menu.burger.cheese"]\n')
+        plan = compile_policy(load_policy(self.ou)[0])
+        updates = dict(plan['main']['update'])
+        self.assertEqual('Y', updates['menu.burger.pickles'])
+        self.assertNotIn('menu.burger.cheese', updates)
+        self.assertEqual(['menu.burger.cheese'], plan['main']['delete'])
+
+    def test_invalid(self):
+        for policy in [{'bogus': {}}, {'main': {'bogus': 1}},
+                       {'paper': {'units': 'furlong'}},
+                       {'font': {'NoSuchFont': {}}}]:
+            with self.assertRaises(ValueError):
+                compile_policy(policy)
+
+    def test_plan_cache(self):
+        plan = load_plan(self.ou)
+        self.assertTrue(os.path.exists(self.ou + PLANFILE))
+        self.assertEqual(plan, load_plan(self.ou))
+        # editing an included file invalidates the cached plan
+        with open(self.base, 'a') as fo:
+            fo.write('[receipt_printer]\nremove = true\n')
+        os.utime(self.base, ns=(0, 0))
+        with self.assertRaises(ValueError):
+            load_plan(self.ou)
+
+    def test_apply(self):
+        pref_files = get_property_files('preference', {self.tempdir}, True)
+        font_files = get_property_files('font', {self.tempdir}, True)
+        parser = WfCfgParser(pref_files, font_files)
+        self.assertEqual(0, parser.run(['apply', self.ou]))
+        for f in pref_files:
+            cfg = fileDict(parser.main_cfg, f)
+            self.assertEqual('purple', cfg['desktop.frame.laf.theme'])
+            self.assertEqual('ReceiptBoss 5000',
+                             cfg['peripherals.receipt.name'])
+        for f in font_files:
+            self.assertEqual('Arial|bold|14',
+                             fileDict(parser.font_cfg, f)['LabelFont'])
+
+
+class TestStateCache(unittest.TestCase):
+    def setUp(self):
+        makeDummyFiles()
+        self.path = os.path.join(tempfile.gettempdir(), 'test_state.json')
+        self.cache = StateCache(self.path)
+
+    def tearDown(self):
+        deleteDummyFiles()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_record(self):
+        f = sorted(dummy_files)[0]
+        self.assertFalse(self.cache.is_current(f, 'fp'))
+        self.cache.record(f, 'fp', 'digest')
+        self.assertTrue(self.cache.is_current(f, 'fp'))
+        self.assertFalse(self.cache.is_current(f, 'other'))
+        self.assertEqual('digest', self.cache.digest(f, 'fp'))
+        self.cache.save()
+        self.assertTrue(StateCache(self.path).is_current(f, 'fp'))
+        # changing the file invalidates its entries
+        with open(f, 'a') as fo:
+            fo.write('menu.burger.onion=Y\n')
+        self.assertFalse(StateCache(self.path).is_current(f, 'fp'))
+
+    def test_bad_index(self):
+        with open(self.path, 'w') as fo:
+            fo.write('not json')
+        self.assertFalse(self.cache.is_current(sorted(dummy_files)[0], 'fp'))
+
 
 class TestReceiptFont(unittest.TestCase):
     def test_name(self):
@@ -655,14 +1105,32 @@ class TestFontConfigurator(TestConfiguratorClass):
             self.checkFiles(key, value)
 
     def test_batch_update(self):
-        updates = [(str(), str())]
-        with self.assertRaises(NotImplementedError):
-            self.fc.batch_update(updates)
+        makeDummyFiles()
+        plain = Font('Arbitrary Sans', 'plain', 12)
+        self.fc.batch_update([('LabelFont', Font('Other', 'bold', 14)),
+                              ('ALL', plain),
+                              ('ButtonFont', 'Other|italic|9')])
+        self.fc.run()
+        for key in gui_components:
+            self.checkFiles(key, 'Other|italic|9' if key == 'ButtonFont'
+                            else str(plain))
 
     def test_delete(self):
-        key = 'key'
-        with self.assertRaises(NotImplementedError):
-            self.fc.delete(key)
+        makeDummyFiles()
+        self.fc.update('ALL', 'Arbitrary Sans', 'plain', 12)
+        self.fc.delete('LabelFont')
+        self.fc.run()
+        for f in dummy_files:
+            cfg = fileDict(self.fc, f)
+            self.assertNotIn('LabelFont', cfg)
+            self.assertIn('ButtonFont', cfg)
+        # a later update replaces the deletion
+        self.fc.delete('ALL')
+        self.fc.update('LabelFont', 'Arbitrary Sans', 'bold', 12)
+        self.fc.run()
+        for f in dummy_files:
+            self.assertEqual({'LabelFont': 'Arbitrary Sans|bold|12'},
+                             fileDict(self.fc, f))
         
 
 class TestCliParser(unittest.TestCase):
@@ -742,6 +1210,12 @@ class TestCliParser(unittest.TestCase):
             cfg = fileDict(self.parser.main_cfg, f)
             self.assertFalse('bar' in cfg)
 
+    def test_main_update_with_equals(self):
+        args = ['main', '--update', 'url=http://host/?a=1']
+        self.parser.run(args)
+        self.checkFiles(self.parser.main_cfg, 'url', 'http://host/?a=1')
+        self.parser.run(['main', '--delete', 'url'])
+
     def test_tabbed_windows(self):
         args = ['main', '--tabbed-windows']
         self.parser.run(args)
@@ -809,6 +1283,53 @@ class TestCliParser(unittest.TestCase):
                     expected_value = str(font)
                 self.checkFiles(self.parser.font_cfg, gc, expected_value)
 
+    def test_font_parser_batch(self):
+        self.parser.run(['font', 'ALL', 'Arial', '12', 'plain',
+                         'LabelFont', 'Verdana', '14', 'bold',
+                         '--delete', 'StatusFont'])
+        for f in self.font_files:
+            cfg = fileDict(self.parser.font_cfg, f)
+            self.assertEqual('Verdana|bold|14', cfg['LabelFont'])
+            self.assertEqual('Arial|plain|12', cfg['ButtonFont'])
+            self.assertNotIn('StatusFont', cfg)
+        # invalid specs are usage errors, as with any other argument
+        for spec in [['LabelFont', 'Verdana', '14'],
+                     ['ButtonFont', 'Arial', 'twelve', 'plain'],
+                     ['NoSuchFont', 'Arial', '12', 'plain'],
+                     ['LabelFont', 'Arial', '12', 'wavy']]:
+            with contextlib.redirect_stderr(io.StringIO()) as err, \
+                 self.assertRaises(SystemExit):
+                self.parser.run(['font'] + spec)
+            self.assertIn('usage:', err.getvalue())
+
+    def test_path_options(self):
+        # switches never take the next argument as their path
+        parse = lambda *args: self.parser._build_parser('main').parse_args(
+            list(args) + ['main', '--update', 'a=b'])
+        args = parse('--state-cache')
+        self.assertEqual((True, None), (args.state_cache,
+                                        args.state_cache_path))
+        args = parse('--state-cache-path', 'state.json')
+        self.assertEqual('state.json', args.state_cache_path)
+        args = parse('--incremental')
+        self.assertEqual((True, None), (args.incremental,
+                                        args.inventory_path))
+        args = parse('--inventory-path', 'profiles.json')
+        self.assertEqual('profiles.json', args.inventory_path)
+        args = parse('--profile', '--profile-dump')
+        self.assertEqual((True, None), (args.profile_dump,
+                                        args.profile_dump_dir))
+        args = parse('--report')
+        self.assertEqual((True, None), (args.report, args.report_path))
+        args = parse('--printer-cache')
+        self.assertEqual((True, None), (args.printer_cache,
+                                        args.printer_cache_path))
+        args = parse('--backup')
+        self.assertEqual((True, None), (args.backup, args.backup_dir))
+        args = self.parser._build_parser('rollback').parse_args(
+            ['--backup', 'rollback', 'run1'])
+        self.assertEqual('run1', args.run)
+
     def test_receipt_parser_paper(self):
         keypath = self.parser.receipt.paper.keypath
         margins = ['margin.' + m for m in ['top','right','bottom','left']]
@@ -847,6 +1368,711 @@ class TestCliParser(unittest.TestCase):
         self.__receipt_printer_add()
         self.__receipt_printer_remove()
 
+
+
+class TestProfileDiscovery(unittest.TestCase):
+    def setUp(self):
+        self.users = tempfile.mkdtemp()
+        now = time.time()
+        # profile name to days since Workflows preferences last changed
+        for name, age in [('alice', 1), ('bob', 30), ('carol', 3),
+                          ('Public', 1), ('defaultuser0', 1)]:
+            prop = os.path.join(self.users, name, 'Sirsi', 'Workflows',
+                                'Property')
+            os.makedirs(prop)
+            open(os.path.join(prop, 'preference'), 'w').close()
+            os.utime(prop, (now - age * 86400,) * 2)
+        # a profile that has never run Workflows, and a stray file
+        os.makedirs(os.path.join(self.users, 'dave'))
+        open(os.path.join(self.users, 'notes.txt'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.users)
+
+    def names(self, dirs):
+        return [os.path.relpath(d, self.users).split(os.sep)[0] for d in dirs]
+
+    def test_system_profiles(self):
+        # the template of new profiles is a profile like any other
+        os.makedirs(os.path.join(self.users, 'Default', 'Sirsi',
+                                 'Workflows', 'Property'))
+        self.assertEqual({'alice', 'bob', 'carol', 'Default', 'Public',
+                          'defaultuser0'},
+                         set(self.names(iter_sirsi_dirs(self.users))))
+        dirs = iter_sirsi_dirs(self.users, exclude=SYSTEM_PROFILES)
+        self.assertEqual({'alice', 'bob', 'carol', 'Default'},
+                         set(self.names(dirs)))
+
+    def test_exclude(self):
+        dirs = iter_sirsi_dirs(self.users, exclude=['B*', 'public'])
+        self.assertEqual({'alice', 'carol', 'defaultuser0'},
+                         set(self.names(dirs)))
+
+    def test_max_age(self):
+        dirs = iter_sirsi_dirs(self.users, max_age_days=7,
+                               exclude=SYSTEM_PROFILES)
+        self.assertEqual({'alice', 'carol'}, set(self.names(dirs)))
+
+    def test_limit(self):
+        dirs = iter_sirsi_dirs(self.users, limit=2, exclude=SYSTEM_PROFILES)
+        self.assertEqual(['alice', 'carol'], self.names(dirs))
+
+    def test_main_dir(self):
+        dirs = iter_sirsi_dirs(self.users, '/main', limit=0)
+        self.assertEqual(['/main'], list(dirs))
+
+    def test_lazy(self):
+        dirs = iter_sirsi_dirs(self.users)
+        self.assertIsInstance(next(dirs), str)
+
+    def test_cli_options(self):
+        calls = []
+        def pref_files(**options):
+            calls.append(options)
+            return set()
+        parser = WfCfgParser(pref_files, set())
+        parser.run(['--test', '--max-profile-age', '7', '--exclude-profile',
+                    'x*', '--max-profiles', '5', 'main', '--update', 'a=b'])
+        self.assertEqual([{'max_age_days': 7, 'exclude': ['x*'],
+                           'limit': 5}], calls)
+        parser = WfCfgParser(pref_files, set())
+        parser.run(['--test', '--exclude-system-profiles', 'main',
+                    '--update', 'a=b'])
+        self.assertEqual({'exclude': list(SYSTEM_PROFILES)}, calls[-1])
+
+class TestProfileInventory(unittest.TestCase):
+    def setUp(self):
+        self.users = tempfile.mkdtemp()
+        self.path = os.path.join(self.users, 'profiles.json')
+        self.files = set()
+        for name in ['alice', 'bob']:
+            self.add_profile(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.users)
+
+    def add_profile(self, name):
+        sirsi_dir = os.path.join(self.users, name)
+        os.mkdir(sirsi_dir)
+        self.files |= get_property_files('preference', {sirsi_dir}, True)
+
+    def run_cfg(self, full_resync=False):
+        c = Configurator(self.files)
+        c.inventory = ProfileInventory(self.path, full_resync)
+        c.update('a', 'b')
+        return {os.path.basename(profile_of(r.path)): r.status
+                for r in c.run()}
+
+    def test_incremental(self):
+        self.assertEqual({'alice': 'updated', 'bob': 'updated'},
+                         self.run_cfg())
+        self.assertEqual({'alice': 'cached', 'bob': 'cached'},
+                         self.run_cfg())
+        # a new profile, and a profile changed since the last run
+        self.add_profile('carol')
+        bob = os.path.join(self.users, 'bob', 'Property', 'preference')
+        with open(bob, 'w') as fo:
+            fo.write('a=c\n')
+        os.utime(bob, (time.time() + 5,) * 2)
+        self.assertEqual({'alice': 'cached', 'bob': 'updated',
+                          'carol': 'updated'}, self.run_cfg())
+        self.assertEqual({'alice': 'unchanged', 'bob': 'unchanged',
+                          'carol': 'unchanged'}, self.run_cfg(True))
+
+    def test_fingerprint(self):
+        self.run_cfg()
+        c = Configurator(self.files,
+                         inventory=ProfileInventory(self.path))
+        c.update('a', 'c')
+        self.assertEqual({'updated'}, {r.status for r in c.run()})
+
+    def test_errors_not_recorded(self):
+        inventory = ProfileInventory(self.path)
+        results = [FileResult(f, FileResult.ERROR) for f in self.files]
+        inventory.record_results(results, 'fp')
+        inventory.save()
+        self.assertFalse(os.path.exists(self.path))
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.policy = os.path.join(self.tempdir, 'policy.json')
+        self.write_policy('purple')
+        self.pref_files = get_property_files('preference', {self.tempdir},
+                                             True)
+        self.font_files = get_property_files('font', {self.tempdir}, True)
+        self.status = os.path.join(self.tempdir, 'watch.json')
+        self.enforcer = Enforcer(self.policy, self.pref_files,
+                                 self.font_files, debounce=0.01, poll=True,
+                                 interval=0.01, status_path=self.status)
+
+    def tearDown(self):
+        self.enforcer.watcher.close()
+        shutil.rmtree(self.tempdir)
+
+    def write_policy(self, theme):
+        with open(self.policy, 'w') as fo:
+            json.dump({'main': {'update': {'desktop.frame.laf.theme': theme,
+                                           'menu.burger.cheese': 'N'}}}, fo)
+
+    def theme(self):
+        with open(next(iter(self.pref_files)), 'r') as fo:
+            return dict(line.strip().split('=', 1) for line in fo)
+
+    def test_enforce(self):
+        # the first step loads and applies the policy everywhere
+        results = self.enforcer.step(0)
+        self.assertEqual({'updated'}, {r.status for r in results
+                                       if r.path in self.pref_files})
+        self.assertIsNone(self.enforcer.step(0.05))
+        # a user changes an enforced key
+        f = next(iter(self.pref_files))
+        with open(f, 'a') as fo:
+            fo.write('desktop.frame.laf.theme=fall\nmenu.burger.onion=Y\n')
+        results = self.enforcer.step(1)
+        self.assertEqual([f], [r.path for r in results])
+        self.assertEqual('updated', results[0].status)
+        cfg = self.theme()
+        self.assertEqual('purple', cfg['desktop.frame.laf.theme'])
+        self.assertEqual('Y', cfg['menu.burger.onion'])
+
+    def test_reload(self):
+        self.enforcer.step(0)
+        self.write_policy('winter')
+        os.utime(self.policy, (time.time() + 5,) * 2)
+        self.enforcer.step(0)
+        self.assertEqual('winter', self.theme()['desktop.frame.laf.theme'])
+        with open(self.status, 'r') as fo:
+            status = json.load(fo)
+        self.assertEqual(2, status['policy_loads'])
+        self.assertEqual(2, status['passes'])
+        self.assertEqual(0, status['errors'])
+
+    def test_invalid_policy(self):
+        self.enforcer.step(0)
+        # a policy saved halfway is retried; the last one stays enforced
+        with open(self.policy, 'w') as fo:
+            fo.write('{"main": {"upd')
+        os.utime(self.policy, (time.time() + 5,) * 2)
+        f = next(iter(self.pref_files))
+        with open(f, 'a') as fo:
+            fo.write('desktop.frame.laf.theme=fall\n')
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual([f], [r.path for r in self.enforcer.step(1)])
+        self.assertEqual('purple', self.theme()['desktop.frame.laf.theme'])
+        with open(self.status, 'r') as fo:
+            status = json.load(fo)
+        self.assertEqual(1, status['policy_errors'])
+        self.assertIn('not loaded', status['last_error'])
+        self.write_policy('winter')
+        os.utime(self.policy, (time.time() + 10,) * 2)
+        self.enforcer.step(0)
+        self.assertEqual('winter', self.theme()['desktop.frame.laf.theme'])
+        self.assertEqual(2, self.enforcer.status['policy_loads'])
+        # an invalid policy at startup enforces nothing until it is fixed
+        with open(self.policy, 'w') as fo:
+            json.dump({'main': {'colour': 'blue'}}, fo)
+        enforcer = Enforcer(self.policy, self.pref_files, self.font_files,
+                            poll=True, interval=0.01)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertIsNone(enforcer.step(0))
+            self.assertIsNone(enforcer.plan)
+        finally:
+            enforcer.watcher.close()
+
+class TestLockedFile(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'preference')
+        with open(self.path, 'w') as fo:
+            fo.write('a=b\n')
+
+    def tearDown(self):
+        lib.os._without_os_locks.discard(self.tempdir)
+        shutil.rmtree(self.tempdir)
+
+    def test_lock(self):
+        with LockedFile(self.path, 'w') as fo:
+            self.assertTrue(fo.locked)
+            self.assertTrue(LockedFile(self.path, 'r').locked)
+            fo.write('a=c\n')
+        self.assertFalse(LockedFile(self.path, 'r').locked)
+        self.assertFalse(os.path.exists(self.path + LOCKFILE))
+
+    def test_release_windows(self):
+        # Windows cannot remove a file that is still open, even by us
+        lock = LockedFile(self.path, 'r')
+        remove = os.remove
+        def windows_remove(path):
+            if lock._fd is not None:
+                raise PermissionError(path)
+            remove(path)
+        lock.get_lock()
+        removes_open_files = lib.os._removes_open_files
+        lib.os._removes_open_files, os.remove = False, windows_remove
+        try:
+            lock.release_lock()
+        finally:
+            lib.os._removes_open_files, os.remove = removes_open_files, remove
+        self.assertFalse(os.path.exists(self.path + LOCKFILE))
+
+    def test_timeout(self):
+        with LockedFile(self.path, 'r'):
+            other = LockedFile(self.path, 'r', timeout=0.1)
+            with self.assertRaises(LockTimeout):
+                other.get_lock()
+            self.assertGreaterEqual(other.lock_wait, 0.1)
+        with LockedFile(self.path, 'r', timeout=0.1) as other:
+            self.assertLess(other.lock_wait, 0.1)
+
+    def test_other_process(self):
+        # a process holding the lock, which the OS releases when it dies
+        holder = subprocess.Popen(
+            [sys.executable, '-c', 'import sys, lib.os\n'
+             'lock = lib.os.LockedFile(sys.argv[1], "r")\n'
+             'lock.get_lock()\nprint("locked", flush=True)\n'
+             'sys.stdin.read()', self.path],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        try:
+            self.assertEqual('locked', holder.stdout.readline().strip())
+            with self.assertRaises(LockTimeout):
+                LockedFile(self.path, 'r', timeout=0.1).get_lock()
+        finally:
+            holder.kill()
+            holder.wait()
+            holder.stdin.close()
+            holder.stdout.close()
+        with LockedFile(self.path, 'r', timeout=1) as fo:
+            self.assertTrue(fo.locked)
+
+    def test_durability(self):
+        for level in ['none', 'file', 'dir']:
+            with LockedFile(self.path, 'w', durability=level) as fo:
+                fo.write('a=%s\n' % level)
+            with open(self.path, 'r') as fo:
+                self.assertEqual('a=%s\n' % level, fo.read())
+        with self.assertRaises(ValueError):
+            LockedFile(self.path, 'w', durability='paranoid')
+
+    def test_interrupted_write(self):
+        with self.assertRaises(KeyboardInterrupt):
+            with LockedFile(self.path, 'w') as fo:
+                fo.write('a=')
+                raise KeyboardInterrupt
+        with open(self.path, 'r') as fo:
+            self.assertEqual('a=b\n', fo.read())
+        self.assertEqual(['preference'], os.listdir(self.tempdir))
+
+    def test_stale_sentinel(self):
+        # file systems without byte-range locks use the lock file itself
+        lib.os._without_os_locks.add(self.tempdir)
+        dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+        dead.wait()
+        with open(self.path + LOCKFILE, 'w') as fo:
+            fo.write('%s %d' % (socket.gethostname(), dead.pid))
+        with LockedFile(self.path, 'r', timeout=1) as fo:
+            with self.assertRaises(LockTimeout):
+                LockedFile(self.path, 'r', timeout=0.1).get_lock()
+        self.assertFalse(os.path.exists(self.path + LOCKFILE))
+
+class TestBenchmark(unittest.TestCase):
+    def test_benchmark(self):
+        path = os.path.join(tempfile.mkdtemp(), 'bench.json')
+        try:
+            self.assertEqual(0, benchmark.main(['--profiles', '2', '--lines',
+                                                '50', '--repeat', '1',
+                                                '--output', path]))
+            with open(path, 'r') as fo:
+                results = json.load(fo)
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+        self.assertEqual(set(benchmark.scenarios), set(results['results']))
+        self.assertEqual({'discover', 'stage', 'apply', 'unchanged',
+                          'cached', 'total'}, set(results['results']['main']))
+
+    def test_stdout(self):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            self.assertEqual(0, benchmark.main(
+                ['--profiles', '2', '--lines', '50', '--repeat', '1',
+                 '--printers', '5', '--scenarios', 'find_printer']))
+        results = json.loads(stdout.getvalue())
+        self.assertEqual({'find_printer'}, set(results['results']))
+
+    def test_compare(self):
+        baseline = {'results': {'main': {'apply': 1.0, 'stage': 0.001}}}
+        current = {'results': {'main': {'apply': 1.3, 'stage': 0.003},
+                               'font': {'apply': 9.0}}}
+        regressions = benchmark.compare(current, baseline, 0.25)
+        self.assertEqual(1, len(regressions))
+        self.assertTrue(regressions[0].startswith('main/apply'))
+        self.assertEqual([], benchmark.compare(current, baseline, 0.5))
+
+class TestPrinters(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.list_path = os.path.join(self.tempdir, 'printers.json')
+        with open(self.list_path, 'w') as fo:
+            json.dump(['ReceiptBoss 5000', 'HP LaserJet'], fo)
+
+    def tearDown(self):
+        printers.configure()
+        shutil.rmtree(self.tempdir)
+
+    def test_find(self):
+        provider = printers.JsonProvider(self.list_path)
+        calls = []
+        names = provider.names
+        provider.names = lambda: calls.append(1) or names()
+        inventory = printers.PrinterInventory(provider)
+        self.assertEqual({'ReceiptBoss 5000'},
+                         inventory.find(['receiptboss 5000', 'Missing']))
+        self.assertEqual({'ReceiptBoss 5000', 'HP LaserJet'},
+                         inventory.names())
+        # listed once
+        self.assertEqual(1, len(calls))
+
+    def test_cache(self):
+        cache = os.path.join(self.tempdir, 'cache.json')
+        provider = printers.JsonProvider(self.list_path)
+        printers.PrinterInventory(provider, cache).names()
+        os.remove(self.list_path)
+        # a fresh cache is used instead of the provider...
+        self.assertEqual({'HP LaserJet'}, printers.PrinterInventory(
+            provider, cache).find(['hp laserjet']))
+        # ...but not a stale one, or one from another provider
+        with self.assertRaises(FileNotFoundError):
+            printers.PrinterInventory(provider, cache, ttl=-1).names()
+        self.assertEqual(set(), printers.PrinterInventory(
+            printers.StaticProvider([]), cache).names())
+
+    def test_cli(self):
+        files = get_property_files('preference', {self.tempdir}, True)
+        parser = WfCfgParser(files, set())
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(0, parser.run([
+                '--printers-from', self.list_path, 'receipt-printer',
+                '--find', 'Nope', 'RECEIPTBOSS 5000']))
+        for f in files:
+            self.assertEqual('ReceiptBoss 5000',
+                             fileDict(parser.receipt, f)
+                             ['peripherals.receipt.name'])
+
+class TestBackup(unittest.TestCase):
+    def setUp(self):
+        makeDummyFiles()
+        self.tempdir = tempfile.mkdtemp()
+        self.parser = WfCfgParser(lambda **options: set(dummy_files), set())
+
+    def tearDown(self):
+        deleteDummyFiles()
+        shutil.rmtree(self.tempdir)
+
+    def run_quietly(self, *args):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            status = self.parser.run(['--quiet', '--workers', '2',
+                                      '--backup-dir', self.tempdir] +
+                                     list(args))
+        self.assertEqual(0, status)
+        return out.getvalue()
+
+    def contents(self):
+        contents = {}
+        for f in dummy_files:
+            with open(f, 'r') as fo:
+                contents[f] = fo.read()
+        return contents
+
+    def test_rollback(self):
+        original = self.contents()
+        out = self.run_quietly('main', '--update', 'menu.burger.cheese=N')
+        run_id = out.split()[-1]
+        self.assertIn('python wfcfg.py --backup-dir "%s" rollback %s' %
+                      (self.tempdir, run_id), out)
+        changed = self.contents()
+        self.assertNotEqual(original, changed)
+        # identical files are stored once
+        objects = os.path.join(self.tempdir, 'objects')
+        self.assertEqual(1, sum(len(files) for _, _, files in
+                                os.walk(objects)))
+        self.run_quietly('rollback', run_id)
+        self.assertEqual(original, self.contents())
+        # the rollback can be rolled back in turn
+        store = BackupStore(self.tempdir)
+        self.assertEqual(2, len(store.runs()))
+        self.run_quietly('rollback', store.runs()[-1])
+        self.assertEqual(changed, self.contents())
+
+    def test_dry_run(self):
+        out = self.run_quietly('main', '--update', 'menu.burger.cheese=N')
+        run_id = out.split()[-1]
+        removed, kept = sorted(dummy_files)
+        with open(kept, 'r') as fo:
+            changed = fo.read()
+        os.remove(removed)
+        self.run_quietly('--test', 'rollback', run_id)
+        # nothing is restored, created, or backed up
+        exists = os.path.exists(removed)
+        open(removed, 'a').close()
+        self.assertFalse(exists)
+        with open(kept, 'r') as fo:
+            self.assertEqual(changed, fo.read())
+        self.assertEqual([run_id], BackupStore(self.tempdir).runs())
+
+    def test_prune(self):
+        store = BackupStore(self.tempdir)
+        for n in range(3):
+            store.run_id = 'run%d' % n
+            with open('testA.txt', 'a') as fo:
+                fo.write('menu.burger.count=%d\n' % n)
+            store._files = {}
+            store.add('testA.txt')
+            store.save()
+        lib.backup.PRUNE_GRACE = -1
+        try:
+            self.assertEqual(2, store.prune(1))
+        finally:
+            lib.backup.PRUNE_GRACE = 3600
+        self.assertEqual(['run2'], store.runs())
+        with open('testA.txt', 'rb') as fo:
+            self.assertEqual(fo.read(), store.content(
+                store.manifest('run2')['files']['testA.txt']))
+        self.assertEqual(1, sum(len(files) for _, _, files in
+                                os.walk(os.path.join(self.tempdir,
+                                                     'objects'))))
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        makeDummyFiles()
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        deleteDummyFiles()
+        shutil.rmtree(self.tempdir)
+
+    def test_profile(self):
+        parser = WfCfgParser(lambda **options: set(dummy_files), set())
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            parser.run(['--profile', '--profile-dump-dir', self.tempdir, 'main',
+                        '--update', 'menu.burger.onion=Y'])
+        report = out.getvalue().split('Profile:')[1]
+        for phase in ['discovery', 'read', 'parse', 'transform',
+                      'lock wait', 'write']:
+            self.assertIn(phase, report)
+        size = sum(os.path.getsize(f) for f in dummy_files)
+        self.assertIn('%d bytes written' % size, report)
+        self.assertIsNone(profiling.active)
+        dumps = sorted(os.path.splitext(f)[1]
+                       for f in os.listdir(self.tempdir))
+        self.assertEqual(['.prof', '.tracemalloc'], dumps)
+
+    def test_slowest(self):
+        profile = profiling.Profile()
+        profile.add('read', 1.0, 'a')
+        profile.add('read', 3.0, 'b')
+        profile.add('write', 1.0, 'c')
+        profile.per_file(lambda path: None)('c')
+        report = profile.report(slowest=2).splitlines()
+        self.assertIn('Slowest files:', report[-3])
+        self.assertIn(' b (', report[-2])
+        self.assertIn(' a (', report[-1])
+
+class TestReport(unittest.TestCase):
+    def setUp(self):
+        makeDummyFiles()
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'wfcfg.jsonl')
+
+    def tearDown(self):
+        deleteDummyFiles()
+        shutil.rmtree(self.tempdir)
+
+    def run_quietly(self, *args):
+        parser = WfCfgParser(lambda **options: set(dummy_files), set())
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            parser.run(['--quiet', '--report-path', self.path] + list(args))
+        return out.getvalue()
+
+    def records(self):
+        with open(self.path, 'r') as fo:
+            return [json.loads(line) for line in fo]
+
+    def test_report(self):
+        out = self.run_quietly('main', '--update', 'menu.burger.onion=Y')
+        self.assertEqual(['%d files processed: %d updated, 0 unchanged, '
+                          '0 errors.' % ((len(dummy_files),) * 2)],
+                         out.splitlines())
+        records = self.records()
+        self.assertEqual(['file'] * len(dummy_files) + ['run'],
+                         [r['type'] for r in records])
+        self.assertEqual(sorted(dummy_files),
+                         [r['path'] for r in records[:-1]])
+        run = records[-1]
+        self.assertEqual({'updated': len(dummy_files)}, run['counts'])
+        self.assertEqual(sum(os.path.getsize(f) for f in dummy_files),
+                         run['bytes_written'])
+        self.assertEqual(0, run['errors'])
+        self.run_quietly('main', '--update', 'menu.burger.onion=Y')
+        self.assertEqual(2 * (len(dummy_files) + 1), len(self.records()))
+
+    def test_rotation(self):
+        self.run_quietly('main', '--update', 'menu.burger.onion=Y')
+        size = os.path.getsize(self.path)
+        for n in range(4):
+            self.run_quietly('--report-max-bytes', str(size),
+                             '--report-backups', '2', 'main', '--update',
+                             'menu.burger.onion=Y')
+        self.assertEqual(['wfcfg.jsonl', 'wfcfg.jsonl.1', 'wfcfg.jsonl.2'],
+                         sorted(f for f in os.listdir(self.tempdir)
+                                if not f.endswith(LOCKFILE)))
+        self.assertEqual(len(dummy_files) + 1, len(self.records()))
+
+class TestFileDiff(unittest.TestCase):
+    def setUp(self):
+        self.original = tempfile.mkdtemp()
+        self.modified = tempfile.mkdtemp()
+        files = {'same': 'a=1\n', 'touched': 'a=1\n', 'edited': 'a=1\n',
+                 'grown': 'a=1\n', 'deleted': 'x'}
+        os.mkdir(os.path.join(self.original, 'Property'))
+        for name, content in files.items():
+            with open(os.path.join(self.original, 'Property', name), 'w') \
+                    as fo:
+                fo.write(content)
+        shutil.copytree(self.original, self.modified, dirs_exist_ok=True)
+        prop = os.path.join(self.modified, 'Property')
+        os.remove(os.path.join(prop, 'deleted'))
+        for name, content in [('touched', 'a=1\n'), ('edited', 'a=2\n'),
+                              ('grown', 'a=10\n'), ('new', 'y')]:
+            with open(os.path.join(prop, name), 'w') as fo:
+                fo.write(content)
+            os.utime(os.path.join(prop, name), (1, 1))
+
+    def tearDown(self):
+        shutil.rmtree(self.original)
+        shutil.rmtree(self.modified)
+
+    def test_changed_files(self):
+        o, m = filediff.scan(self.original), filediff.scan(self.modified)
+        join = lambda name: os.path.join('Property', name)
+        self.assertEqual({join('deleted')}, o.keys() - m.keys())
+        self.assertEqual({join('new')}, m.keys() - o.keys())
+        hashed = []
+        digest = filediff.file_digest
+        def counting_digest(path):
+            hashed.append(os.path.basename(path))
+            return digest(path)
+        filediff.file_digest = counting_digest
+        try:
+            changed = filediff.changed_files(self.original, self.modified,
+                                             o, m, 2)
+        finally:
+            filediff.file_digest = digest
+        self.assertEqual([join('edited'), join('grown')], changed)
+        # same size and time: not read; different size: not hashed
+        self.assertEqual(['edited', 'edited', 'touched', 'touched'],
+                         sorted(hashed))
+
+    def test_key_diff(self):
+        codec = filediff.property_codec(
+            os.path.join(self.modified, 'Property', 'preference'))
+        self.assertIsInstance(codec, Configurator)
+        self.assertIsNone(filediff.property_codec(
+            os.path.join(self.modified, 'Property', 'edited')))
+        ofile = ['a=1\n', '# comment\n', 'b=2\n', 'c=3\n', 'c=4\n']
+        mfile = ['c=4\n', 'a=9\n', 'd=5\n']
+        added, removed, changed = filediff.key_diff(ofile, mfile, codec)
+        self.assertEqual({'d': '5'}, added)
+        self.assertEqual({'b': '2'}, removed)
+        self.assertEqual({'a': ('1', '9')}, changed)
+        self.assertEqual(['python wfcfg.py main --update "d=5" "a=9" '
+                          '--delete "b"'],
+                         filediff.suggestion(codec, added, removed, changed,
+                                             'command'))
+        self.assertEqual(['[main]', 'update = { "d" = "5", "a" = "9" }',
+                          'delete = ["b"]'],
+                         filediff.suggestion(codec, added, removed, changed,
+                                             'policy'))
+
+    def test_font_suggestion(self):
+        codec = filediff.property_codec(
+            os.path.join(self.modified, 'Property', 'font'))
+        changes = filediff.key_diff(['LabelFont|Arial|plain|12|\n',
+                                     'StatusFont|Arial|plain|12|\n'],
+                                    ['LabelFont|Arial|bold|14|\n',
+                                     'ButtonFont|Arial|plain|9|\n'], codec)
+        self.assertEqual(['python wfcfg.py font ButtonFont "Arial" 9 plain '
+                          'LabelFont "Arial" 14 bold --delete StatusFont'],
+                         filediff.suggestion(codec, *changes, 'command'))
+
+    def test_fleet_drift(self):
+        users = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, users)
+        def profile(name, preference, font=None):
+            prop = os.path.join(users, name, 'Property')
+            os.makedirs(prop)
+            with open(os.path.join(prop, 'preference'), 'w') as fo:
+                fo.write(preference)
+            if font is not None:
+                with open(os.path.join(prop, 'font'), 'w') as fo:
+                    fo.write(font)
+            return os.path.dirname(prop)
+        font = 'LabelFont|Arial|plain|12|\n'
+        baseline = profile('baseline', 'a=1\nh=700\n', font)
+        same = [profile('same%d' % i, 'h=700\na=1\n', font)
+                for i in range(2)]
+        taller = [profile('tall%d' % i, 'a=1\nh=%d\n' % (800 + i), font)
+                  for i in range(3)]
+        other = profile('other', 'h=700\nb=2\n')
+        targets = same + taller + [other, baseline]
+        groups = filediff.fleet_drift(baseline, targets, workers=2)
+        self.assertEqual({(): same,
+                          (('preference', '!', 'h'),): taller,
+                          (('font', '-', ''), ('preference', '+', 'b'),
+                           ('preference', '-', 'a')): [other]}, groups)
+        groups = filediff.fleet_drift(baseline, taller, by_value=True)
+        self.assertEqual(3, len(groups))
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            filediff.print_fleet_drift(baseline, groups, examples=1)
+        self.assertIn('1 profiles differ only in:\n ! preference: h=801',
+                      out.getvalue())
+
+class TestStartup(unittest.TestCase):
+    # seconds allowed to import wfcfg.py and build the parser for '-h'
+    budget = 0.1
+    script = """
+import sys, time
+start = time.perf_counter()
+import wfcfg
+wfcfg.cli.WfCfgParser(wfcfg.pref_files, wfcfg.font_files)._build_parser(None)
+print(time.perf_counter() - start)
+print(' '.join(sorted(sys.modules)))
+"""
+
+    def startup(self):
+        out = subprocess.run([sys.executable, '-c', self.script],
+                             capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        elapsed, modules = out.stdout.splitlines()
+        return float(elapsed), set(modules.split())
+
+    def test_startup_budget(self):
+        best = min(self.startup()[0] for _ in range(3))
+        self.assertLess(best, self.budget,
+                        "Startup took %.3fs; budget is %.3fs." %
+                        (best, self.budget))
+
+    def test_lazy_imports(self):
+        modules = self.startup()[1]
+        for module in ['lib.configurator', 'lib.session', 'lib.policy',
+                       'lib.state_cache', 'hashlib', 'json',
+                       'concurrent.futures']:
+            self.assertNotIn(module, modules)
         
 if __name__ == '__main__':
     unittest.main()
@@ -9,12 +9,16 @@ REM --- "%WfCfg%" = path to wfcfg.py
 set WfCfg=%~dp0wfcfg.py
 REM --- %LogFile% = path to WfCfg log file
 set LogFile=%windir%\temp\wfcfg.log
+REM --- %LogMaxBytes% = size at which the log is moved to wfcfg.log.1
+set LogMaxBytes=5242880
 
 REM --- don't try to run WfCfg unless both Workflows and Python are installed
 if not exist "%Workflows%" goto NoWorkflows
 if not exist "%Python%" goto NoPython
 
 :WfCfg
+REM --- rotate the log once it gets too big
+if exist "%LogFile%" for %%A in ("%LogFile%") do if %%~zA GEQ %LogMaxBytes% move /Y "%LogFile%" "%LogFile%.1" >nul
 echo wfcfg.bat: %DATE% %TIME% >> %LogFile% 2>&1
 REM --- use Python to run WfCfg; pass all CLI arguments to WfCfg
 echo [%TIME%] wfcfg.bat: Executing "%WfCfg%" %* >> %LogFile% 2>&1
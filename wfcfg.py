@@ -7,19 +7,23 @@
 """Command line interface for updating Sirsi Workflows configuration
 files."""
 #:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
-from sys import argv
+from sys import argv, exit
 import lib.cli as cli
 import lib.os as os
 #:::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
 
+# subject files are discovered only when a command needs them
 if os.RUNNING_WINDOWS:
-    pref_files = os.preference_files
-    font_files = os.font_files
+    pref_files = lambda **options: os.get_property_files('preference',
+                                                         **options)
+    font_files = lambda **options: os.get_property_files('font', **options)
 else:
-    pref_files = os.get_property_files('preference', {'/tmp'}, True)
-    font_files = os.get_property_files('font', {'/tmp'}, True)
+    pref_files = lambda **options: os.get_property_files('preference',
+                                                         {'/tmp'}, True)
+    font_files = lambda **options: os.get_property_files('font',
+                                                         {'/tmp'}, True)
     
 # Run from command line with: python wfcfg.py
 if __name__ == '__main__':
     parser = cli.WfCfgParser(pref_files, font_files)
-    parser.run(argv[1:])
+    exit(parser.run(argv[1:]))